@@ -2,6 +2,7 @@
 
 import os
 import logging
+from pathlib import Path
 from typing import Optional, Tuple
 import tensorflow as tf
 import tensorflow_addons as tfa
@@ -13,8 +14,11 @@ from yarll.agents.agent import Agent
 from yarll.agents.actorcritic.actor_critic import ActorCriticNetworkDiscrete,\
     ActorCriticNetworkDiscreteCNN, ActorCriticNetworkDiscreteCNNRNN, actor_discrete_loss,\
     critic_loss, ActorCriticNetworkContinuous, actor_continuous_loss
-from yarll.agents.env_runner import EnvRunner
-from yarll.misc.utils import discount_rewards
+from yarll.agents.env_runner import EnvRunner, VecEnvRunner
+from yarll.memory.rollout_buffer import RolloutBuffer
+from yarll.misc.advantages import generalized_advantage_estimation
+from yarll.misc import profiling
+from yarll.misc.metrics import MetricsAggregator
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -43,9 +47,15 @@ class A2C(Agent):
             n_hidden_layers=1,
             gradient_clip_value=0.5,
             n_local_steps=20,
+            n_envs=1,  # Number of environment copies that are stepped in lockstep
+            env_backend="serial",  # "serial" or "subprocess": how to step the environment copies
+            n_env_workers=None,  # Number of worker processes for the subprocess backend (default: number of cores)
             vf_coef=0.5,
             entropy_coef=0.01,
             loss_reducer="mean",
+            metrics_flush_seconds=10.0,  # Interval at which the aggregated summaries are written
+            metrics_flush_steps=None,  # Or the number of steps after which they are written
+            metrics_percentiles=[],  # Percentiles to write in addition to the mean and count of each metric
             save_model=False
         ))
         self.config.update(usercfg)
@@ -56,6 +66,10 @@ class A2C(Agent):
         self.optimizer = tfa.optimizers.RectifiedAdam(learning_rate=self.config["learning_rate"],
                                                       clipnorm=self.config["gradient_clip_value"])
         self.writer = tf.summary.create_file_writer(str(self.monitor_path))
+        self.metrics = MetricsAggregator(self.writer,
+                                         flush_every_seconds=self.config["metrics_flush_seconds"],
+                                         flush_every_steps=self.config["metrics_flush_steps"],
+                                         percentiles=self.config["metrics_percentiles"])
         return
 
     def build_networks(self):
@@ -72,41 +86,68 @@ class A2C(Agent):
 
     def choose_action(self, state, features) -> dict:
         action, value = self.ac_net.action_value(state[None,:])
-        return {"action": action, "value": value[0]}
+        return {"action": action[0], "value": value[0]}
+
+    def choose_actions(self, states, features) -> dict:
+        action, value = self.ac_net.action_value(states)
+        return {"action": action, "value": value}
+
+    def make_env_runner(self) -> EnvRunner:
+        if int(self.config["n_envs"]) > 1 or self.config["env_backend"] != "serial":
+            return VecEnvRunner(self.env,
+                                self,
+                                self.config,
+                                int(self.config["n_envs"]),
+                                metrics=self.metrics,
+                                backend=self.config["env_backend"],
+                                n_workers=self.config["n_env_workers"])
+        return EnvRunner(self.env, self, self.config, metrics=self.metrics)
 
     def learn(self):
         """Run learning algorithm"""
-        env_runner = EnvRunner(self.env, self, self.config)
+        env_runner = self.make_env_runner()
+        vectorized = isinstance(env_runner, VecEnvRunner)
+        rollout = RolloutBuffer(int(self.config["n_local_steps"]))
         config = self.config
         with self.writer.as_default():
-            for iteration in range(int(config["n_iter"])):
-                # Collect trajectories until we get timesteps_per_batch total timesteps
-                trajectory = env_runner.get_steps(int(self.config["n_local_steps"]))
-                features = trajectory.features
-                features = np.concatenate(trajectory.features) if features[-1] is not None else np.array([None])
-                if trajectory.experiences[-1].terminal:
-                    v = 0
-                else:
-                    inp = [np.asarray(trajectory.states)[None, -1]]
+            try:
+                for iteration in range(int(config["n_iter"])):
+                    # Collect trajectories until we get timesteps_per_batch total timesteps
+                    # A single environment stops at the end of an episode, copies of it are reset on their own
+                    trajectory = env_runner.get_steps(int(self.config["n_local_steps"]), stop_at_trajectory_end=not vectorized,
+                                                     memory=rollout)
+                    features = trajectory.features
+                    features = np.concatenate(trajectory.features) if features[-1] is not None else np.array([None])
+                    states = np.asarray(trajectory.states)
+                    actions = np.asarray(trajectory.actions)
+                    rewards = np.asarray(trajectory.rewards, dtype=np.float32)
+                    values = np.asarray(trajectory.values, dtype=np.float32)
+                    terminals = np.asarray(trajectory.terminals, dtype=np.float32)
+                    next_states = np.asarray(trajectory.next_states)
+                    if not vectorized:
+                        # Add an environment dimension, such that everything has shape [T, n_envs, ...]
+                        states, actions, rewards, values, terminals, next_states = [
+                            x[:, None] for x in (states, actions, rewards, values, terminals, next_states)]
+                    inp = [next_states[-1]]
                     if features[-1] is not None:
-                        inp.append(features[None, -1])
-                    v = self.ac_net.action_value(*inp)[-2 if features[-1] is not None else -1][0]
-                rewards_plus_v = np.asarray(trajectory.rewards + [v])
-                vpred_t = np.asarray(trajectory.values + [v])
-                delta_t = trajectory.rewards + \
-                    self.config["gamma"] * vpred_t[1:] - vpred_t[:-1]
-                batch_r = discount_rewards(
-                    rewards_plus_v, self.config["gamma"])[:-1]
-                batch_adv = discount_rewards(delta_t, self.config["gamma"])
-                states = np.asarray(trajectory.states)
-                iter_actor_loss, iter_critic_loss, iter_loss = self.train(states,
-                                                                          np.asarray(trajectory.actions),
-                                                                          batch_adv,
-                                                                          batch_r,
-                                                                          features=features if features[-1] is not None else None)
-                tf.summary.scalar("model/loss", iter_loss, step=iteration)
-                tf.summary.scalar("model/actor_loss", iter_actor_loss, step=iteration)
-                tf.summary.scalar("model/critic_loss", iter_critic_loss, step=iteration)
+                        inp.append(env_runner.features)
+                    # Value of the states after the last step, ignored for environments whose last step was terminal
+                    v = self.ac_net.action_value(*inp)[-2 if features[-1] is not None else -1]
+                    # With lambda = 1, the returns are the discounted rewards bootstrapped using v
+                    batch_adv, batch_r = generalized_advantage_estimation(rewards, values, terminals, v, self.config["gamma"], 1.0)
+                    n_steps = rewards.size
+                    with profiling.timer("train"):
+                        iter_actor_loss, iter_critic_loss, iter_loss = self.train(states.reshape(n_steps, *states.shape[2:]),
+                                                                                  actions.reshape(n_steps, *actions.shape[2:]),
+                                                                                  batch_adv.reshape(n_steps),
+                                                                                  batch_r.reshape(n_steps),
+                                                                                  features=features if features[-1] is not None else None)
+                    self.metrics.scalar("model/loss", iter_loss, step=iteration)
+                    self.metrics.scalar("model/actor_loss", iter_actor_loss, step=iteration)
+                    self.metrics.scalar("model/critic_loss", iter_critic_loss, step=iteration)
+            finally:
+                env_runner.close()
+                self.metrics.close()
             if self.config["save_model"]:
                 tf.saved_model.save(self.ac_net, self.monitor_path / "model")
 
@@ -157,7 +198,11 @@ class A2CDiscreteCNNRNN(A2CDiscrete):
     def choose_action(self, state, features) -> dict:
         """Choose an action."""
         action, value, rnn_state = self.ac_net.action_value(state[None, :], features)
-        return {"action": action, "value": value[0], "features": rnn_state}
+        return {"action": action[0], "value": value[0], "features": rnn_state}
+
+    def choose_actions(self, states, features) -> dict:
+        action, value, rnn_state = self.ac_net.action_value(states, features)
+        return {"action": action, "value": value, "features": rnn_state}
 
 class A2CContinuous(A2C):
     def __init__(self, *args, **kwargs):
@@ -190,7 +235,11 @@ class A2CContinuous(A2C):
 
     def choose_action(self, state, features) -> dict:
         action, _, value = self.ac_net.action_value(state[None, :])
-        return {"action": action, "value": value[0]}
+        return {"action": action[0], "value": value[0]}
+
+    def choose_actions(self, states, features) -> dict:
+        action, _, value = self.ac_net.action_value(states)
+        return {"action": action, "value": value}
 
     def _actor_loss(self, actions_taken, mean, log_std, advantages):
         return actor_continuous_loss(actions_taken, mean, log_std, advantages)
@@ -2,7 +2,7 @@
 
 """
 Asynchronous Advantage Actor Critic (A3C)
-Most of the work is done in `a3c_worker.py`.
+Most of the work is done in `a3c_worker.py`, or in `a3c_shared.py` when using the shared memory backend.
 Based on:
 - Pseudo code from Asynchronous Methods for Deep Reinforcement Learning
 - Tensorflow code from https://github.com/yao62995/A3C/blob/master/A3C_atari.py and
@@ -48,7 +48,8 @@ class A3C(Agent):
             vf_coef=0.5,
             entropy_coef=0.01,
             loss_reducer="sum",  # use tf.reduce_sum or tf.reduce_mean for the loss
-            save_model=False
+            save_model=False,
+            backend="distributed"  # "distributed": TensorFlow cluster with a parameter server, "shared_memory": Hogwild! worker processes
         ))
         self.config.update(usercfg)
 
@@ -64,8 +65,8 @@ class A3C(Agent):
             sys.executable,
             os.path.join(self.current_folder, "parameter_server.py"),
             self.config["n_tasks"]]
-        processed_cmd = " ".join(shlex_quote(str(x)) for x in cmd)
-        self.ps_process = subprocess.Popen(processed_cmd, shell=True)
+        # Not started through a shell, such that terminating it stops the parameter server itself
+        self.ps_process = subprocess.Popen([str(x) for x in cmd])
 
     def stop_parameter_server(self):
         self.ps_process.terminate()
@@ -76,6 +77,12 @@ class A3C(Agent):
         signal.signal(signal.SIGTERM, self.signal_handler)
 
     def learn(self):
+        if self.config["backend"] == "shared_memory":
+            from yarll.agents.actorcritic.a3c_shared import learn_shared
+            from yarll.misc import profiling
+            n_steps = learn_shared(self.env, self.task_type, self.monitor_path, self.config, self.monitor, self.video)
+            profiling.count("env_steps", n_steps)  # The workers are separate processes that aren't profiled
+            return
         self.start_signal_handler()
         self.start_parameter_server()
         worker_processes = []
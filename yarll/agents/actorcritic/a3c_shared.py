@@ -0,0 +1,304 @@
+# -*- coding: utf8 -*-
+
+"""
+Single-node backend of A3C without a TensorFlow cluster.
+The parameters of the network and the Adam moments are flat float32 vectors in shared memory.
+Every worker process copies the parameters into its own network before collecting n_local_steps steps,
+computes the gradients of its loss with TensorFlow and applies them directly to the shared vectors,
+without a lock (Hogwild!, Recht et al., 2011).
+"""
+
+import ctypes
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+from pathlib import Path
+from typing import Dict, Type
+import numpy as np
+import tensorflow as tf
+from gym import wrappers
+
+from yarll.agents.agent import Agent
+from yarll.agents.actorcritic.actor_critic import ActorCriticNetworkDiscrete, ActorCriticNetworkDiscreteCNN, \
+    ActorCriticNetworkContinuous
+from yarll.agents.env_runner import EnvRunner
+from yarll.environment.registration import make
+from yarll.memory.rollout_buffer import RolloutBuffer
+from yarll.misc.advantages import generalized_advantage_estimation
+from yarll.misc.metrics import MetricsAggregator
+from yarll.misc.network_ops import normal_dist_log_prob
+from yarll.misc.tf_utils import FlatVariables
+from yarll.misc.utils import set_tf_threads
+
+class SharedParameters(object):
+    """
+    Parameters and Adam moments as flat float32 vectors in shared memory.
+    The moments are only shared if `shared_optimizer` is True, otherwise every worker keeps its own.
+    Can be passed to a process when it is started, after which the numpy views are made again.
+    """
+
+    def __init__(self, n_parameters: int, shared_optimizer: bool) -> None:
+        super(SharedParameters, self).__init__()
+        self.n_parameters = n_parameters
+        self.shared_optimizer = shared_optimizer
+        self.raw_parameters = RawArray(ctypes.c_float, n_parameters)
+        self.raw_moments = [RawArray(ctypes.c_float, n_parameters) for _ in range(2)] if shared_optimizer else None
+        self._make_views()
+
+    def _make_views(self) -> None:
+        self.parameters = np.frombuffer(self.raw_parameters, dtype=np.float32)
+        if self.raw_moments is not None:
+            self.m, self.v = [np.frombuffer(raw, dtype=np.float32) for raw in self.raw_moments]
+        else:
+            self.m, self.v = np.zeros(self.n_parameters, np.float32), np.zeros(self.n_parameters, np.float32)
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in ("parameters", "m", "v")}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_views()
+
+
+class HogwildAdam(object):
+    """
+    Adam that updates the shared parameters and moments in place, without a lock.
+    Concurrent updates by other workers can interleave with it, which Hogwild! tolerates.
+    The step used for the bias correction is the number of updates of this worker.
+    """
+
+    def __init__(self, shared: SharedParameters, learning_rate: float,
+                 beta1: float = 0.9, beta2: float = 0.999, epsilon: float = 1e-8) -> None:
+        super(HogwildAdam, self).__init__()
+        self.shared = shared
+        self.learning_rate = learning_rate
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        self.t = 0
+        self.tmp = np.empty(shared.n_parameters, np.float32)  # Avoids allocating temporaries for every update
+
+    def apply(self, gradient: np.ndarray) -> None:
+        self.t += 1
+        m, v, tmp = self.shared.m, self.shared.v, self.tmp
+        np.multiply(gradient, 1.0 - self.beta1, out=tmp)
+        m *= self.beta1
+        m += tmp
+        np.square(gradient, out=tmp)
+        tmp *= 1.0 - self.beta2
+        v *= self.beta2
+        v += tmp
+        step_size = self.learning_rate * np.sqrt(1.0 - self.beta2 ** self.t) / (1.0 - self.beta1 ** self.t)
+        np.sqrt(v, out=tmp)
+        tmp += self.epsilon
+        np.divide(m, tmp, out=tmp)
+        tmp *= step_size
+        self.shared.parameters -= tmp
+
+
+class A3CSharedWorker(Agent):
+    """Worker process of the shared memory backend. Acts as the policy of its environment runner."""
+
+    def __init__(self,
+                 env,
+                 task_id: int,
+                 shared: SharedParameters,
+                 global_steps,
+                 monitor_path: str,
+                 **usercfg) -> None:
+        super(A3CSharedWorker, self).__init__(**usercfg)
+        self.env = env
+        self.task_id = task_id
+        self.shared = shared
+        self.global_steps = global_steps
+        self.monitor_path = Path(monitor_path)
+
+        self.ac_net = self.build_network(env, self.config)
+        self.ac_net(tf.zeros((1, *env.observation_space.shape)))
+        self.variables = self.ac_net.trainable_weights
+        self.flat_variables = FlatVariables(self.variables)
+        self.optimizer = HogwildAdam(shared, self.config["learning_rate"])
+        self.reduce_loss = tf.reduce_sum if self.config["loss_reducer"] == "sum" else tf.reduce_mean
+
+        states_spec = tf.TensorSpec((None, *env.observation_space.shape), tf.float32)
+        self._policy = tf.function(self._policy_fn, input_signature=[states_spec])
+        self._gradient = tf.function(self._gradient_fn, input_signature=[
+            states_spec,
+            self.actions_spec(),
+            tf.TensorSpec((None,), tf.float32),
+            tf.TensorSpec((None,), tf.float32)
+        ])
+
+        self.writer = tf.summary.create_file_writer(str(self.monitor_path / f"task{task_id}"))
+        self.metrics = MetricsAggregator(self.writer)
+
+    @staticmethod
+    def build_network(env, config: dict) -> tf.keras.Model:
+        raise NotImplementedError()
+
+    def actions_spec(self) -> tf.TensorSpec:
+        raise NotImplementedError()
+
+    def _policy_fn(self, states):
+        """Sampled actions and predicted values of a batch of states."""
+        raise NotImplementedError()
+
+    def _losses(self, states, actions, advantages, returns):
+        """Actor loss, critic loss and entropy."""
+        raise NotImplementedError()
+
+    def _gradient_fn(self, states, actions, advantages, returns):
+        with tf.GradientTape() as tape:
+            actor_loss, critic_loss, entropy = self._losses(states, actions, advantages, returns)
+            loss = actor_loss + self.config["vf_coef"] * critic_loss - self.config["entropy_coef"] * entropy
+        gradients = tape.gradient(loss, self.variables)
+        gradients, _ = tf.clip_by_global_norm(gradients, self.config["gradient_clip_value"])
+        flat_gradient = tf.concat([tf.reshape(g, (-1,)) for g in gradients], axis=0)
+        return flat_gradient, actor_loss, critic_loss, loss
+
+    def choose_action(self, state, features) -> dict:
+        action, value = self._policy(state[None])
+        return {"action": action.numpy()[0], "value": value.numpy()[0]}
+
+    def learn(self):
+        config = self.config
+        n_local_steps = int(config["n_local_steps"])
+        env_runner = EnvRunner(self.env, self, config, metrics=self.metrics)
+        rollout = RolloutBuffer(n_local_steps)
+        while self.global_steps.value < config["T_max"]:
+            self.flat_variables.set(self.shared.parameters)
+            trajectory = env_runner.get_steps(n_local_steps, memory=rollout)
+            terminals = trajectory.terminals
+            # Value of the state after the last step, ignored if the last step was terminal
+            bootstrap_value = self._policy(trajectory.next_states[-1:])[1].numpy()[0]
+            advantages, returns = generalized_advantage_estimation(trajectory.rewards, trajectory.values, terminals,
+                                                                   bootstrap_value, config["gamma"], 1.0)
+            gradient, actor_loss, critic_loss, loss = self._gradient(trajectory.states, trajectory.actions,
+                                                                     advantages, returns)
+            self.optimizer.apply(gradient.numpy())
+            with self.global_steps.get_lock():
+                self.global_steps.value += len(terminals)
+                step = self.global_steps.value
+            self.metrics.scalar("model/loss", loss, step=step)
+            self.metrics.scalar("model/actor_loss", actor_loss, step=step)
+            self.metrics.scalar("model/critic_loss", critic_loss, step=step)
+        self.metrics.close()
+
+
+class A3CSharedWorkerDiscrete(A3CSharedWorker):
+    @staticmethod
+    def build_network(env, config: dict) -> tf.keras.Model:
+        return ActorCriticNetworkDiscrete(env.action_space.n,
+                                          int(config["n_hidden_units"]),
+                                          int(config["n_hidden_layers"]))
+
+    def actions_spec(self) -> tf.TensorSpec:
+        return tf.TensorSpec((None,), tf.int64)
+
+    def _policy_fn(self, states):
+        logits, value = self.ac_net(states)
+        return self.ac_net.dist(logits), tf.squeeze(value, axis=-1)
+
+    def _losses(self, states, actions, advantages, returns):
+        logits, values = self.ac_net(states)
+        log_probs = -tf.nn.sparse_softmax_cross_entropy_with_logits(labels=tf.cast(actions, tf.int32), logits=logits)
+        actor_loss = -self.reduce_loss(log_probs * advantages)
+        critic_loss = 0.5 * self.reduce_loss(tf.square(returns - tf.squeeze(values, axis=-1)))
+        entropy = self.reduce_loss(self.ac_net.entropy(logits))
+        return actor_loss, critic_loss, entropy
+
+class A3CSharedWorkerDiscreteCNN(A3CSharedWorkerDiscrete):
+    @staticmethod
+    def build_network(env, config: dict) -> tf.keras.Model:
+        return ActorCriticNetworkDiscreteCNN(env.action_space.n, int(config["n_hidden_units"]))
+
+class A3CSharedWorkerContinuous(A3CSharedWorker):
+    @staticmethod
+    def build_network(env, config: dict) -> tf.keras.Model:
+        return ActorCriticNetworkContinuous(env.action_space.shape,
+                                            int(config["n_hidden_units"]),
+                                            int(config["n_hidden_layers"]))
+
+    def actions_spec(self) -> tf.TensorSpec:
+        return tf.TensorSpec((None, *self.env.action_space.shape), tf.float32)
+
+    def _policy_fn(self, states):
+        action, _, value = self.ac_net(states)
+        return action, tf.squeeze(value, axis=-1)
+
+    def _losses(self, states, actions, advantages, returns):
+        _, mean, values = self.ac_net(states)
+        log_probs = normal_dist_log_prob(actions, mean, self.ac_net.action_mean.log_std)
+        actor_loss = -self.reduce_loss(log_probs * advantages)
+        critic_loss = 0.5 * self.reduce_loss(tf.square(returns - tf.squeeze(values, axis=-1)))
+        entropy = self.ac_net.entropy()  # The same for every state
+        if self.config["loss_reducer"] == "sum":
+            entropy *= tf.cast(tf.shape(states)[0], tf.float32)
+        return actor_loss, critic_loss, entropy
+
+WORKERS: Dict[str, Type[A3CSharedWorker]] = {
+    "A3CTaskDiscrete": A3CSharedWorkerDiscrete,
+    "A3CTaskDiscreteCNN": A3CSharedWorkerDiscreteCNN,
+    "A3CTaskContinuous": A3CSharedWorkerContinuous
+}
+
+def worker_class(task_type: str) -> Type[A3CSharedWorker]:
+    if task_type not in WORKERS:
+        raise NotImplementedError(f"The shared memory backend of A3C doesn't support {task_type}.")
+    return WORKERS[task_type]
+
+def run_worker(env_name: str, task_type: str, task_id: int, shared: SharedParameters, global_steps,
+               monitor_path: str, config: dict, monitor: bool, video: bool) -> None:
+    """Entry point of a worker process."""
+    # The workers run in parallel, so each of them uses a single thread
+    set_tf_threads(1, 1)
+    seed = config.get("seed")
+    if seed is not None:
+        seed = int(seed) + task_id
+        np.random.seed(seed)
+        tf.random.set_seed(seed)
+    env = make(env_name)
+    env.seed(seed)
+    if monitor and task_id == 0:
+        env = wrappers.Monitor(env, monitor_path, force=True, video_callable=(None if video else False))
+    worker = worker_class(task_type)(env, task_id, shared, global_steps, monitor_path, **config)
+    worker.learn()
+    env.close()
+
+def learn_shared(env, task_type: str, monitor_path: str, config: dict, monitor: bool, video: bool) -> int:
+    """
+    Train using n_tasks worker processes until T_max steps have been taken in total.
+    Returns the number of steps and saves the model if requested.
+    """
+    config = {k: v for k, v in config.items() if k not in ("env", "envs")}
+    # Only used to initialize the parameters and save the model
+    network = worker_class(task_type).build_network(env, config)
+    network(tf.zeros((1, *env.observation_space.shape)))
+    flat_variables = FlatVariables(network.trainable_weights)
+    shared = SharedParameters(flat_variables.size, bool(config["shared_optimizer"]))
+    shared.parameters[:] = flat_variables.get()
+
+    # Workers are spawned instead of forked, as TensorFlow doesn't support being used after a fork
+    context = multiprocessing.get_context("spawn")
+    global_steps = context.Value(ctypes.c_long, 0)
+    processes = [context.Process(target=run_worker,
+                                 args=(env.spec.id, task_type, task_id, shared, global_steps, str(monitor_path),
+                                       config, monitor, video),
+                                 daemon=True)
+                 for task_id in range(int(config["n_tasks"]))]
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+    failed = [p.exitcode for p in processes if p.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"{len(failed)} A3C workers failed with exit codes {failed}.")
+
+    if config["save_model"]:
+        flat_variables.set(shared.parameters)
+        tf.saved_model.save(network, str(Path(monitor_path) / "model"))
+    return int(global_steps.value)
@@ -20,6 +20,17 @@ class ActorCriticNetwork(Model):
         raise NotImplementedError()
 
     def action_value(self, states):
+        """
+        Sample actions and predict values for a batch of states.
+        All returned arrays keep the batch dimension.
+        """
+        raise NotImplementedError()
+
+    def action_value_log_prob(self, states):
+        """
+        Same as `action_value`, but also return the log-probabilities of the sampled actions,
+        such that they don't have to be computed again when training on them.
+        """
         raise NotImplementedError()
 
 class ActorCriticNetworkLatent(ActorCriticNetwork):
@@ -51,7 +62,12 @@ class ActorCriticNetworkDiscrete(ActorCriticNetworkLatent):
         """
         logits, value = self.predict(states)
         action = self.dist(logits)
-        return np.squeeze(action, axis=-1), np.squeeze(value, axis=-1)
+        return action.numpy(), np.squeeze(value, axis=-1)
+
+    def action_value_log_prob(self, states):
+        logits, value = self.predict(states)
+        action = self.dist(logits)
+        return action.numpy(), np.squeeze(value, axis=-1), self.log_prob(action, logits).numpy()
 
     def entropy(self, *args):
         logits, *_ = args
@@ -74,7 +90,13 @@ class ActorCriticNetworkMultiDiscrete(ActorCriticNetworkLatent):
         logits, value = self.predict(states)
         reshaped_logits = tf.split(logits, self.n_actions_per_dim, axis=-1)
         action = self.dist(reshaped_logits)
-        return np.squeeze(action), np.squeeze(value, axis=-1)
+        return np.squeeze(action, axis=1), np.squeeze(value, axis=-1)
+
+    def action_value_log_prob(self, states):
+        logits, value = self.predict(states)
+        reshaped_logits = tf.split(logits, self.n_actions_per_dim, axis=-1)
+        action = np.squeeze(self.dist(reshaped_logits), axis=1)
+        return action, np.squeeze(value, axis=-1), self.log_prob(action, logits).numpy()
 
     def entropy(self, *args):
         logits, *_ = args
@@ -102,7 +124,13 @@ class ActorCriticNetworkBernoulli(ActorCriticNetworkLatent):
         samples_from_uniform = tf.random.uniform(probs.shape)
         action = tf.cast(tf.less(samples_from_uniform, probs), tf.float32)
 
-        return np.reshape(action.numpy(), (-1,)), np.squeeze(value, axis=-1)
+        return action.numpy(), np.squeeze(value, axis=-1)
+
+    def action_value_log_prob(self, states):
+        logits, value = self.predict(states)
+        probs = tf.sigmoid(logits)
+        action = tf.cast(tf.less(tf.random.uniform(probs.shape), probs), tf.float32)
+        return action.numpy(), np.squeeze(value, axis=-1), self.log_prob(action, logits).numpy()
 
     def entropy(self, *args):
         logits, *_ = args
@@ -145,18 +173,19 @@ class ActorCriticNetworkDiscreteCNN(ActorCriticNetwork):
         logits, value = self.predict(states)
         action = self.dist(logits)
 
-        return np.squeeze(action.numpy(), axis=-1), np.squeeze(value, axis=-1)
+        return action.numpy(), np.squeeze(value, axis=-1)
+
+    def action_value_log_prob(self, states):
+        logits, value = self.predict(states)
+        action = self.dist(logits)
+        return action.numpy(), np.squeeze(value, axis=-1), self.log_prob(action, logits).numpy()
 
     def entropy(self, *args):
         logits, *_ = args
         return categorical_dist_entropy(logits)
 
     def log_prob(self, actions, logits):
-        map_result = tf.map_fn(lambda x: -tf.nn.sparse_softmax_cross_entropy_with_logits(x[0], x[1]),
-                               (tf.transpose(tf.cast(actions, dtype=tf.int32)),
-                                tf.transpose(tf.reshape(logits, (logits.shape[0], actions.shape[1], -1)), perm=(1, 0, 2))),
-                               dtype=tf.float32)
-        return tf.reduce_sum(map_result, axis=0)
+        return -tf.nn.sparse_softmax_cross_entropy_with_logits(labels=tf.cast(actions, dtype=tf.int32), logits=logits)
 
 class ActorCriticNetworkDiscreteCNNRNN(ActorCriticNetwork):
     """docstring for ActorCriticNetworkDiscreteCNNRNN"""
@@ -195,7 +224,7 @@ class ActorCriticNetworkDiscreteCNNRNN(ActorCriticNetwork):
         logits, value, *features = self.predict(inp)
         action = self.dist(logits)
 
-        return np.squeeze(action, axis=-1), np.squeeze(value, axis=-1), None if not features else features[0]
+        return action.numpy(), np.squeeze(value, axis=-1), None if not features else features[0]
 
     def entropy(self, *args):
         logits, *_ = args
@@ -253,7 +282,12 @@ class ActorCriticNetworkContinuous(ActorCriticNetwork):
 
     def action_value(self, states):
         action, mean, value = self.predict(states)
-        return np.squeeze(action, axis=0), np.squeeze(mean, axis=0), np.squeeze(value, axis=-1)
+        return action, mean, np.squeeze(value, axis=-1)
+
+    def action_value_log_prob(self, states):
+        action, mean, value = self.predict(states)
+        log_prob = normal_dist_log_prob(action, mean, self.action_mean.log_std)
+        return action, mean, np.squeeze(value, axis=-1), log_prob.numpy()
 
     def entropy(self, *args):
         return self.action_mean.entropy()
@@ -1,5 +1,7 @@
 # -*- coding: utf8 -*-
 
+import numpy as np
+
 class Agent(object):
     """Reinforcement learning agent"""
     def __init__(self, **usercfg):
@@ -12,6 +14,22 @@ class Agent(object):
         """Learn in the current environment."""
         raise NotImplementedError()
 
+    def choose_actions(self, states, features) -> dict:
+        """
+        Choose an action for each state in a batch of states.
+        Falls back to calling `choose_action` for every state;
+        agents that can evaluate their policy on a batch at once should override this.
+        """
+        results = [self.choose_action(state, None if features is None else features[i:i + 1])
+                   for i, state in enumerate(states)]
+        batched = {}
+        for key in results[0]:
+            if key == "features":
+                batched[key] = np.concatenate([res[key] for res in results])
+            else:
+                batched[key] = np.asarray([res[key] for res in results])
+        return batched
+
     def get_env_action(self, action):
         return action
 
@@ -16,8 +16,12 @@ from tensorflow.keras.optimizers import Adam
 
 from yarll.agents.agent import Agent
 from yarll.agents.env_runner import EnvRunner
-from yarll.memory.memory import Memory
-from yarll.misc.utils import hard_update, soft_update
+from yarll.memory.ring_buffer_memory import RingBufferMemory
+from yarll.memory.prioritized_memory import PrioritizedMemory
+from yarll.memory.memmap_memory import MemmapMemory
+from yarll.misc import profiling
+from yarll.misc.metrics import MetricsAggregator
+from yarll.misc.tf_utils import TargetUpdater
 from yarll.policies.e_greedy import EGreedy
 
 class DQN(Agent):
@@ -45,9 +49,18 @@ class DQN(Agent):
             n_train_steps=1,  # Number of parameter update steps per iteration
             replay_buffer_size=1e6,
             replay_start_size=32,  # Required number of replay buffer entries to start training
+            prioritized_replay=False,
+            prioritized_replay_alpha=0.6,
+            prioritized_replay_beta=0.4,  # Annealed linearly to 1 over max_steps
+            memmap_replay=False,  # Store the observations of the replay buffer in a file instead of in RAM
+            memmap_replay_file=None,  # Default: a temporary file
+            replay_uint8_scale=None,  # Store observations as uint8 after multiplying them by this (e.g. 255 for pixels)
             hidden_layer_activation="relu",
             normalize_inputs=False,
             summaries=True,
+            metrics_flush_seconds=10.0,  # Interval at which the aggregated summaries are written
+            metrics_flush_steps=None,  # Or the number of steps after which they are written
+            metrics_percentiles=[],  # Percentiles to write in addition to the mean and count of each metric
             checkpoints=True,
             save_model=True,
             write_train_rewards=False
@@ -65,10 +78,28 @@ class DQN(Agent):
         dummy_input_states = tf.random.uniform((1, *env.observation_space.shape))
         self.q_network(dummy_input_states)
         self.target_q_network(dummy_input_states)
-        hard_update(self.q_network.variables, self.target_q_network.variables)
+        self.target_updater = TargetUpdater(self.q_network.variables, self.target_q_network.variables)
+        self.target_updater.hard_update()
+
+
+        if self.config["prioritized_replay"] and self.config["memmap_replay"]:
+            raise ValueError("Prioritized replay doesn't support storing the replay buffer in a memory-mapped file.")
+        if self.config["prioritized_replay"]:
+            self.replay_buffer = PrioritizedMemory(int(self.config["replay_buffer_size"]),
+                                                   alpha=self.config["prioritized_replay_alpha"],
+                                                   beta=self.config["prioritized_replay_beta"])
+        elif self.config["memmap_replay"]:
+            self.replay_buffer = MemmapMemory(int(self.config["replay_buffer_size"]),
+                                              filename=self.config["memmap_replay_file"],
+                                              uint8_scale=self.config["replay_uint8_scale"])
+        else:
+            self.replay_buffer = RingBufferMemory(int(self.config["replay_buffer_size"]))
 
-
-        self.replay_buffer = Memory(int(self.config["replay_buffer_size"]))
+        self.writer = tf.summary.create_file_writer(str(self.monitor_path))
+        self.metrics = MetricsAggregator(self.writer,
+                                         flush_every_seconds=self.config["metrics_flush_seconds"],
+                                         flush_every_steps=self.config["metrics_flush_steps"],
+                                         percentiles=self.config["metrics_percentiles"])
 
         self.env_runner = EnvRunner(self.env,
                                     self,
@@ -76,7 +107,8 @@ class DQN(Agent):
                                     scale_states=self.config["normalize_inputs"],
                                     summaries=self.config["summaries"],
                                     episode_rewards_file=(
-                                        self.monitor_path / "train_rewards.txt" if self.config["write_train_rewards"] else None)
+                                        self.monitor_path / "train_rewards.txt" if self.config["write_train_rewards"] else None),
+                                    metrics=self.metrics
                                     )
 
         if self.config["checkpoints"]:
@@ -85,7 +117,6 @@ class DQN(Agent):
             self.cktp_manager = tf.train.CheckpointManager(self.ckpt, checkpoint_directory, 10)
             self.checkpoint_every_episodes = 10
 
-        self.writer = tf.summary.create_file_writer(str(self.monitor_path))
         self.total_steps = 0
         self.n_updates = 0
 
@@ -104,7 +135,11 @@ class DQN(Agent):
         return {"action": action}
 
     @tf.function
-    def train(self, state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch):
+    def train(self, state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch, weights):
+        """
+        Update the Q network using a batch of experiences.
+        Weights are the importance-sampling weights of the experiences (all 1 without prioritized replay).
+        """
         next_q_values = self.target_q_network(state1_batch)
         max_next_q_values = tf.reduce_max(next_q_values, axis=1)
         target_q_values = reward_batch + (1. - terminal1_batch) * self.config["gamma"] * max_next_q_values
@@ -112,11 +147,12 @@ class DQN(Agent):
             predictions = self.q_network(state0_batch)
             actions_onehot = tf.one_hot(action_batch, self.n_actions)
             q_chosen = tf.reduce_sum(predictions * actions_onehot, axis=-1)
-            loss = tf.reduce_mean(tf.square(q_chosen - target_q_values))
+            td_errors = q_chosen - target_q_values
+            loss = tf.reduce_mean(weights * tf.square(td_errors))
         gradients = tape.gradient(loss, self.q_network.trainable_weights)
         self.optimizer.apply_gradients(zip(gradients, self.q_network.trainable_weights))
         q_mean, q_variance = tf.nn.moments(q_chosen, axes=[0])
-        return q_mean, tf.sqrt(q_variance), tf.reduce_mean(target_q_values), loss
+        return q_mean, tf.sqrt(q_variance), tf.reduce_mean(target_q_values), loss, td_errors
 
     def learn(self):
         # Arrays to keep results from train function over different train steps in
@@ -124,43 +160,54 @@ class DQN(Agent):
         q_stds = np.empty((self.config["n_train_steps"],), np.float32)
         target_qs = np.empty((self.config["n_train_steps"],), np.float32)
         losses = np.empty((self.config["n_train_steps"],), np.float32)
+        uniform_weights = np.ones((self.config["batch_size"],), np.float32)
+        beta_start = self.config["prioritized_replay_beta"]
         total_episodes = 0
-        with self.writer.as_default():
-            for _ in range(self.config["max_steps"]):
-
-                experience = self.env_runner.get_steps(1)[0]
-
-                # Update epsilon
-                self.policy.epsilon = max(self.config["epsilon_min"], self.policy.epsilon * self.config["epsilon_decay"])
-
-                self.total_steps += 1
-                self.replay_buffer.add(experience.state, experience.action, experience.reward,
-                                       experience.next_state, experience.terminal)
-                if self.replay_buffer.n_entries > self.config["replay_start_size"]:
-                    for i in range(self.config["n_train_steps"]):
-                        sample = self.replay_buffer.get_batch(self.config["batch_size"])
-                        q_mean, q_std, target_q, loss = self.train(
-                            sample["states0"],
-                            sample["actions"].astype(np.int),
-                            sample["rewards"],
-                            sample["states1"],
-                            sample["terminals1"])
-                        q_means[i] = q_mean
-                        q_stds[i] = q_std
-                        target_qs[i] = target_q
-                        losses[i] = loss
-                    tf.summary.scalar("model/predicted_q_mean", np.mean(q_means), self.total_steps)
-                    tf.summary.scalar("model/predicted_q_std", np.mean(q_stds), self.total_steps)
-                    tf.summary.scalar("model/target_q_mean", np.mean(target_qs), self.total_steps)
-                    tf.summary.scalar("model/loss", np.mean(losses), self.total_steps)
-                    # Update the target network
-                    soft_update(self.q_network.variables,
-                                self.target_q_network.variables,
-                                self.config["tau"])
-                    self.n_updates += 1
-                if experience.terminal:
-                    total_episodes += 1
-                    if self.config["checkpoints"] and (total_episodes % self.checkpoint_every_episodes) == 0:
-                        self.cktp_manager.save()
+        try:
+            with self.writer.as_default():
+                for step in range(self.config["max_steps"]):
+
+                    experience = self.env_runner.get_steps(1)[0]
+
+                    # Update epsilon
+                    self.policy.epsilon = max(self.config["epsilon_min"], self.policy.epsilon * self.config["epsilon_decay"])
+
+                    self.total_steps += 1
+                    self.replay_buffer.add(experience.state, experience.action, experience.reward,
+                                           experience.next_state, experience.terminal)
+                    if self.replay_buffer.n_entries > self.config["replay_start_size"]:
+                        for i in range(self.config["n_train_steps"]):
+                            with profiling.timer("replay_sample"):
+                                sample = self.replay_buffer.get_batch(self.config["batch_size"])
+                            with profiling.timer("train"):
+                                q_mean, q_std, target_q, loss, td_errors = self.train(
+                                    sample["states0"],
+                                    sample["actions"].astype(np.int32),
+                                    sample["rewards"],
+                                    sample["states1"],
+                                    sample["terminals1"],
+                                    sample.get("weights", uniform_weights))
+                            if self.config["prioritized_replay"]:
+                                self.replay_buffer.update_priorities(sample["indices"], td_errors.numpy())
+                                self.replay_buffer.beta = beta_start + (1.0 - beta_start) * step / self.config["max_steps"]
+                            q_means[i] = q_mean
+                            q_stds[i] = q_std
+                            target_qs[i] = target_q
+                            losses[i] = loss
+                        self.metrics.scalar("model/predicted_q_mean", np.mean(q_means), self.total_steps)
+                        self.metrics.scalar("model/predicted_q_std", np.mean(q_stds), self.total_steps)
+                        self.metrics.scalar("model/target_q_mean", np.mean(target_qs), self.total_steps)
+                        self.metrics.scalar("model/loss", np.mean(losses), self.total_steps)
+                        # Update the target network
+                        with profiling.timer("target_update"):
+                            self.target_updater.soft_update(self.config["tau"])
+                        self.n_updates += 1
+                    if experience.terminal:
+                        total_episodes += 1
+                        if self.config["checkpoints"] and (total_episodes % self.checkpoint_every_episodes) == 0:
+                            with profiling.timer("checkpoint"):
+                                self.cktp_manager.save()
+        finally:
+            self.metrics.close()
         if self.config["save_model"]:
             self.q_network.save_weights(str(self.monitor_path / "q_weights"))
@@ -3,7 +3,11 @@ from pathlib import Path
 from typing import Any, Callable, Dict, List, Optional, Union
 import tensorflow as tf
 import numpy as np
-from yarll.memory.experiences_memory import ExperiencesMemory, Experience
+from yarll.environment.env_pool import make_env_pool
+from yarll.memory.experiences_memory import ExperiencesMemory
+from yarll.memory.rollout_buffer import RolloutBuffer
+from yarll.misc import profiling
+from yarll.misc.metrics import MetricsAggregator
 from yarll.misc.scalers import LowsHighsScaler, RunningMeanStdScaler
 
 
@@ -17,6 +21,7 @@ class EnvRunner(object):
                  state_preprocessor: Optional[Callable] = None,
                  summaries: bool = True, # Write tensorflow summaries
                  episode_rewards_file: Optional[Union[Path, str]] = None, # write each episode reward to the given file
+                 metrics: Optional[MetricsAggregator] = None, # Log summaries and episode rewards through it if given
                  ) -> None:
         super(EnvRunner, self).__init__()
         self.env = env
@@ -36,6 +41,7 @@ class EnvRunner(object):
         self.state_preprocessor = state_preprocessor
         self.summaries = summaries
         self.episode_rewards_file = episode_rewards_file
+        self.metrics = metrics
         self.total_steps = 0
         self.total_episodes = 0
 
@@ -50,6 +56,25 @@ class EnvRunner(object):
                 self.state_scaler = RunningMeanStdScaler(self.env.observation_space.shape)
         self.reset_env()
 
+    def log_episode(self, length: int, reward: float) -> None:
+        """Write the summaries and reward of an episode that just ended."""
+        if self.metrics is not None:
+            if self.summaries:
+                self.metrics.scalar("env/Episode_length", length, self.total_steps)
+                self.metrics.scalar("episode_reward", reward, self.total_steps)
+                self.metrics.scalar("env/N_episodes", self.total_episodes, self.total_steps)
+            if self.episode_rewards_file is not None:
+                self.metrics.line(self.episode_rewards_file, f"{reward}")
+            return
+        # summaries won't be written if there is no writer.as_default around it somewhere (e.g. in algorithm itself)
+        if self.summaries:
+            tf.summary.scalar("env/Episode_length", length, step=self.total_steps)
+            tf.summary.scalar("episode_reward", reward, step=self.total_steps)
+            tf.summary.scalar("env/N_episodes", self.total_episodes, step=self.total_steps)
+        if self.episode_rewards_file is not None:
+            with open(self.episode_rewards_file, "a") as f:
+                f.write(f"{reward}\n")
+
     def choose_action(self, state: np.ndarray):
         """Choose an action based on the current state in the environment."""
         return self.policy.choose_action(state, self.features)
@@ -64,24 +89,50 @@ class EnvRunner(object):
 
     def step_env(self, action):
         """Execute an action in the current environment."""
-        state, reward, done, info = self.env.step(self.policy.get_env_action(action))
-        state = state if self.state_preprocessor is None else self.state_preprocessor(state)
+        with profiling.timer("env_step"):
+            state, reward, done, info = self.env.step(self.policy.get_env_action(action))
+        if self.state_preprocessor is not None:
+            with profiling.timer("preprocess"):
+                state = self.state_preprocessor(state)
+        profiling.count("env_steps")
         return state, reward, done, info
 
-    def get_steps(self, n_steps: int, reset: bool = False, stop_at_trajectory_end: bool = True, render: bool = False) -> ExperiencesMemory:
+    def close(self) -> None:
+        """Release what is used to step the environment. Nothing to do for a single environment."""
+        pass
+
+    def get_steps(self,
+                  n_steps: int,
+                  reset: bool = False,
+                  stop_at_trajectory_end: bool = True,
+                  render: bool = False,
+                  memory: Optional[RolloutBuffer] = None) -> Union[ExperiencesMemory, RolloutBuffer]:
+        """
+        Collect at most n_steps steps in the environment.
+        If a (preallocated) rollout buffer is given, it is reset and the steps are written into it.
+        """
         if reset:
             self.reset_env()
             self.policy.new_trajectory()
-        memory = ExperiencesMemory()
+        if memory is None:
+            memory = ExperiencesMemory()
+        else:
+            memory.reset()
         for _ in range(n_steps):
             input_state = np.asarray(self.state, dtype=np.float32)
-            input_state = self.scale_state(input_state) if self.scale_states else input_state
-            results = self.choose_action(input_state)
+            if self.scale_states:
+                with profiling.timer("preprocess"):
+                    input_state = self.scale_state(input_state)
+            with profiling.timer("choose_action"):
+                results = self.choose_action(input_state)
             action = results["action"]
             value = results.get("value", None)
             new_features = results.get("features", None)
+            # Log-probabilities of the behaviour policy, only stored by memories that support them
+            extra = {"log_prob": results["log_prob"]} if "log_prob" in results else {}
             new_state, rew, done, _ = self.step_env(action)
-            memory.add(self.state, action, rew, value, terminal=done, features=self.features, next_state=new_state)
+            memory.add(self.state, action, rew, value, terminal=done, features=self.features, next_state=new_state,
+                       **extra)
             self.state = new_state
             self.features = new_features
             self.episode_reward += rew
@@ -89,14 +140,7 @@ class EnvRunner(object):
             self.total_steps += 1
             if done or self.episode_steps >= self.config["episode_max_length"]:
                 self.total_episodes += 1
-                # summaries won't be written if there is no writer.as_default around it somewhere (e.g. in algorithm itself)
-                if self.summaries:
-                    tf.summary.scalar("env/Episode_length", self.episode_steps, step=self.total_steps)
-                    tf.summary.scalar("episode_reward", self.episode_reward, step=self.total_steps)
-                    tf.summary.scalar("env/N_episodes", self.total_episodes, step=self.total_steps)
-                if self.episode_rewards_file is not None:
-                    with open(self.episode_rewards_file, "a") as f:
-                        f.write(f"{self.episode_reward}\n")
+                self.log_episode(self.episode_steps, self.episode_reward)
                 self.episodes_rewards.append(self.episode_reward)
                 self.episode_reward = 0
                 self.episode_steps = 0
@@ -111,15 +155,9 @@ class EnvRunner(object):
                 self.env.render()
 
         if self.scale_states:
-            self.state_scaler.fit([exp.state for exp in memory.experiences])
-            for i, exp in enumerate(memory.experiences):
-                memory.experiences[i] = Experience(self.scale_state(exp.state),
-                                                   exp.action,
-                                                   exp.reward,
-                                                   self.scale_state(exp.next_state),
-                                                   exp.value,
-                                                   exp.features,
-                                                   exp.terminal)
+            with profiling.timer("preprocess"):
+                self.state_scaler.fit(np.asarray(memory.states))
+                memory.map_states(self.scale_state)
         return memory
 
     def get_trajectory(self, stop_at_trajectory_end: bool = True, render: bool = False) -> ExperiencesMemory:
@@ -140,3 +178,134 @@ class EnvRunner(object):
             trajectories.append(trajectory)
             timesteps_total += len(trajectory.rewards)
         return trajectories
+
+
+class VecEnvRunner(EnvRunner):
+    """
+    Environment runner that steps multiple copies of an environment in lockstep.
+    The actions for all environments are chosen using a single call to the policy.
+    With the "subprocess" backend, the environments are stepped in parallel in worker processes.
+    """
+    def __init__(self,
+                 env,
+                 policy,
+                 config: Dict[str, Any],
+                 n_envs: int,
+                 scale_states: bool = False,
+                 state_preprocessor: Optional[Callable] = None,
+                 summaries: bool = True,
+                 episode_rewards_file: Optional[Union[Path, str]] = None,
+                 metrics: Optional[MetricsAggregator] = None,
+                 backend: str = "serial",
+                 n_workers: Optional[int] = None
+                 ) -> None:
+        self.n_envs = n_envs
+        self.env_pool = make_env_pool(env, n_envs, backend=backend, seed=config.get("seed", None), n_workers=n_workers)
+        self.states: Optional[np.ndarray] = None
+        super(VecEnvRunner, self).__init__(env,
+                                           policy,
+                                           config,
+                                           scale_states=scale_states,
+                                           state_preprocessor=state_preprocessor,
+                                           summaries=summaries,
+                                           episode_rewards_file=episode_rewards_file,
+                                           metrics=metrics)
+        self.features = self.initial_features()
+        self.episode_steps = np.zeros(n_envs, dtype=np.int64)
+        self.episode_reward = np.zeros(n_envs, dtype=np.float64)
+
+    def initial_features(self):
+        """Initial features of the policy, repeated for every environment."""
+        if self.policy.initial_features is None:
+            return None
+        return np.repeat(self.policy.initial_features, self.n_envs, axis=0)
+
+    def choose_action(self, state: np.ndarray):
+        """Choose an action for the current state of every environment."""
+        return self.policy.choose_actions(state, self.features)
+
+    def reset_single_env(self, i: int) -> np.ndarray:
+        """Reset the environment with index i and return its preprocessed initial state."""
+        state = self.env_pool.reset(i)
+        return state if self.state_preprocessor is None else self.state_preprocessor(state)
+
+    def reset_env(self) -> None:
+        """Reset all environments and get their initial states"""
+        self.states = np.asarray([self.reset_single_env(i) for i in range(self.n_envs)])
+
+    def step_env(self, action):
+        """Execute an action in every environment."""
+        with profiling.timer("env_step"):
+            states, rewards, dones, infos = self.env_pool.step([self.policy.get_env_action(a) for a in action])
+        if self.state_preprocessor is not None:
+            with profiling.timer("preprocess"):
+                states = [self.state_preprocessor(state) for state in states]
+        profiling.count("env_steps", self.n_envs)
+        return np.asarray(states), rewards, dones, infos
+
+    def close(self) -> None:
+        """Stop the environments of the pool."""
+        self.env_pool.close()
+
+    def get_steps(self,
+                  n_steps: int,
+                  reset: bool = False,
+                  stop_at_trajectory_end: bool = False,
+                  render: bool = False,
+                  memory: Optional[RolloutBuffer] = None) -> Union[ExperiencesMemory, RolloutBuffer]:
+        """
+        Collect n_steps steps in each environment.
+        Every experience in the returned memory holds the data of all environments,
+        with the environment index as the first dimension of each field.
+        Environments that finish an episode are reset on their own,
+        so collection never stops at the end of a trajectory.
+        If a (preallocated) rollout buffer is given, it is reset and the steps are written into it.
+        """
+        if reset:
+            self.reset_env()
+            self.features = self.initial_features()
+            self.policy.new_trajectory()
+        if memory is None:
+            memory = ExperiencesMemory()
+        else:
+            memory.reset()
+        for _ in range(n_steps):
+            input_states = np.asarray(self.states, dtype=np.float32)
+            if self.scale_states:
+                with profiling.timer("preprocess"):
+                    input_states = self.scale_state(input_states)
+            with profiling.timer("choose_action"):
+                results = self.choose_action(input_states)
+            actions = results["action"]
+            values = results.get("value", None)
+            new_features = results.get("features", None)
+            extra = {"log_prob": results["log_prob"]} if "log_prob" in results else {}
+            new_states, rews, dones, _ = self.step_env(actions)
+            memory.add(self.states, actions, rews, values, terminal=dones, features=self.features, next_state=new_states,
+                       **extra)
+            # Copies, because rows of finished environments are overwritten below
+            self.states = new_states.copy()
+            self.features = None if new_features is None else np.array(new_features)
+            self.episode_reward += rews
+            self.episode_steps += 1
+            self.total_steps += self.n_envs
+            ended = np.logical_or(dones, self.episode_steps >= self.config["episode_max_length"])
+            for i in np.flatnonzero(ended):
+                self.total_episodes += 1
+                self.log_episode(self.episode_steps[i], self.episode_reward[i])
+                self.episodes_rewards.append(self.episode_reward[i])
+                self.episode_reward[i] = 0
+                self.episode_steps[i] = 0
+                self.states[i] = self.reset_single_env(i)
+                if self.features is not None:
+                    self.features[i] = self.policy.initial_features[0]
+            if np.any(ended):
+                self.policy.new_trajectory()
+            if render:
+                self.env_pool.render(0)
+
+        if self.scale_states:
+            with profiling.timer("preprocess"):
+                self.state_scaler.fit(np.concatenate(memory.states))
+                memory.map_states(self.scale_state)
+        return memory
@@ -2,6 +2,9 @@
 
 import sys
 import os
+from pathlib import Path
+import time
+from typing import List
 import tensorflow as tf
 import tensorflow_addons as tfa
 from mpi4py import MPI
@@ -9,9 +12,14 @@ import numpy as np
 
 from yarll.agents.agent import Agent
 from yarll.agents.ppo.ppo import ppo_loss
+from yarll.agents.ppo.parameter_sync import ParameterBroadcaster, STOP
+from yarll.agents.ppo.rollout_transfer import RolloutGatherer, RolloutReceiver, rollout_dtype, DONE_TAG
 from yarll.agents.actorcritic.actor_critic import ActorCriticNetworkDiscrete,\
     ActorCriticNetworkDiscreteCNN, ActorCriticNetworkContinuous
-from yarll.misc.utils import FastSaver
+from yarll.misc import profiling
+from yarll.misc.metrics import MetricsAggregator
+from yarll.misc.network_ops import normal_dist_log_prob
+from yarll.misc.tf_utils import FlatVariables
 
 
 class DPPO(Agent):
@@ -23,7 +31,7 @@ class DPPO(Agent):
         super(DPPO, self).__init__()
         self.env = env
         self.env_name: str = env.spec.id
-        self.monitor_path: str = monitor_path
+        self.monitor_path = Path(monitor_path)
 
         self.comm = MPI.COMM_SELF
 
@@ -36,151 +44,210 @@ class DPPO(Agent):
             learning_rate=2.5e-4,
             n_iter=10000,
             n_epochs=4,
-            n_local_steps=128,
+            n_local_steps=128,  # Steps per environment per rollout
+            n_envs=1,  # Number of environment copies that each worker steps in lockstep
             gradient_clip_value=0.5,
             vf_coef=0.5,
             entropy_coef=0.01,
             cso_epsilon=0.1,  # Clipped surrogate objective epsilon
             learn_method="batches",
             batch_size=64,
+            sync_dtype="float32",  # Data type in which the parameters are broadcast: "float32" or "float16"
+            sync_deltas=False,  # Broadcast the change of the parameters since the previous broadcast
+            asynchronous=False,  # Train on the rollouts that arrived instead of waiting for those of all workers
+            rollouts_per_update=1,  # Asynchronous mode: number of rollouts to train on per update
+            max_staleness=4,  # Asynchronous mode: number of updates a rollout may lag behind the master
+            stale_rollouts="drop",  # What to do with staler rollouts: "drop" or "correct" (truncated importance weights)
             save_model=False
         ))
         self.config.update(usercfg)
+        if self.config["asynchronous"] and self.config["sync_deltas"]:
+            raise ValueError("Deltas of the parameters can't be sent in asynchronous mode.")
 
         self.task_type = None  # To be filled in by subclasses
 
         self.n_updates: int = 0
 
-        with tf.variable_scope("new_network"):
-            self.new_network = self.build_networks()
-            if self.RNN:
-                self.initial_features = self.new_network.state_init
-            else:
-                self.initial_features = None
-            self.new_network_vars = tf.get_collection(
-                tf.GraphKeys.TRAINABLE_VARIABLES, tf.get_variable_scope().name)
-        self._global_step = tf.get_variable(
-            "global_step",
-            [],
-            tf.int32,
-            initializer=tf.constant_initializer(0, dtype=tf.int32),
-            trainable=False)
-        self.action = self.new_network.action
-        self.value = self.new_network.value
-        self.states = self.new_network.states
-        self.actions_taken = self.new_network.actions_taken
-        self.advantage = tf.placeholder(tf.float32, [None], name="advantage")
-        self.ret = tf.placeholder(tf.float32, [None], name="return")
-
-        with tf.variable_scope("old_network"):
-            self.old_network = self.build_networks()
-            self.old_network_vars = tf.get_collection(
-                tf.GraphKeys.TRAINABLE_VARIABLES, tf.get_variable_scope().name)
-
-        self.set_old_to_new = tf.group(
-            *[v1.assign(v2) for v1, v2 in zip(self.old_network_vars, self.new_network_vars)])
-
-        # Reduces by taking the mean instead of summing
-        self.actor_loss = -tf.reduce_mean(self.make_actor_loss(self.old_network, self.new_network, self.advantage))
-        self.critic_loss = tf.reduce_mean(tf.square(self.value - self.ret))
-        self.mean_entropy = tf.reduce_mean(self.new_network.entropy)
-        self.loss = self.actor_loss + self.config["vf_coef"] * self.critic_loss + \
-            self.config["entropy_coef"] * self.mean_entropy
-
-        grads = tf.gradients(self.loss, self.new_network_vars)
-
-        self.n_steps = tf.shape(self.states)[0]
-        if self.config["save_model"]:
-            tf.add_to_collection("action", self.action)
-            tf.add_to_collection("states", self.states)
-            self.saver = FastSaver()
-        summary_actor_loss = tf.summary.scalar(
-            "model/Actor_loss", self.actor_loss)
-        summary_critic_loss = tf.summary.scalar(
-            "model/Critic_loss", self.critic_loss)
-        summary_loss = tf.summary.scalar("model/Loss", self.loss)
-        summary_entropy = tf.summary.scalar("model/Entropy", -self.mean_entropy)
-        summary_grad_norm = tf.summary.scalar(
-            "model/grad_global_norm", tf.global_norm(grads))
-        summary_var_norm = tf.summary.scalar(
-            "model/var_global_norm", tf.global_norm(self.new_network_vars))
-        self.model_summary_op = tf.summary.merge([
-            summary_actor_loss,
-            summary_critic_loss,
-            summary_loss,
-            summary_entropy,
-            summary_grad_norm,
-            summary_var_norm
-        ])
-        self.writer = tf.summary.FileWriter(os.path.join(
-            self.monitor_path, "master"))
-
-        # grads before clipping were passed to the summary, now clip and apply them
-        if self.config["gradient_clip_value"] is not None:
-            grads, _ = tf.clip_by_global_norm(grads, self.config["gradient_clip_value"])
-
-        with tf.variable_scope("optimizer"):
-            self.optimizer = tfa.optimizers.RectifiedAdam(
-                self.config["learning_rate"], name="optim")
-            apply_grads = self.optimizer.apply_gradients(
-                zip(grads, self.new_network_vars))
+        self.new_network = self.build_networks()
+        self.new_network(tf.zeros((1, *self.env.observation_space.shape)))
+        if self.RNN:
+            self.initial_features = self.new_network.state_init
+        else:
+            self.initial_features = None
+        self.new_network_vars = self.new_network.trainable_weights
+        # All parameters as a single vector, to broadcast them to the workers at once
+        self.flat_variables = FlatVariables(self.new_network_vars)
+        self.optimizer = tfa.optimizers.RectifiedAdam(self.config["learning_rate"])
 
-            inc_step = self._global_step.assign_add(self.n_steps)
-            self.train_op = tf.group(apply_grads, inc_step)
-        optimizer_variables = [var for var in tf.global_variables() if var.name.startswith("optimizer")]
-        self.init_op = tf.variables_initializer(self.new_network_vars + optimizer_variables + [self._global_step])
-
-    def make_actor_loss(self, old_network, new_network, advantage):
-        return ppo_loss(old_network.action_log_prob, new_network.action_log_prob, self.config["cso_epsilon"], advantage)
+        self.writer = tf.summary.create_file_writer(str(self.monitor_path / "master"))
+        self.metrics = MetricsAggregator(self.writer)
 
     def build_networks(self):
         raise NotImplementedError
 
-    def update_network(self, states, actions, advs, returns, features=None):
-        fetches = [self.model_summary_op, self.train_op]
-        feed_dict = {
-            self.states: states,
-            self.old_network.states: states,
-            self.actions_taken: actions,
-            self.old_network.actions_taken: actions,
-            self.advantage: advs,
-            self.ret: returns
-        }
-        if features != [] and features is not None:
-            feed_dict[self.old_network.rnn_state_in] = features
-            feed_dict[self.new_network.rnn_state_in] = features
-        summary, _ = tf.get_default_session().run(fetches, feed_dict)
-        self.writer.add_summary(summary, self.n_updates)
+    def _log_prob_entropy_value(self, states, actions):
+        """Log-probabilities of the actions under the new network, its mean entropy and its value predictions."""
+        raise NotImplementedError
+
+    def _actor_loss(self, old_log_probs, new_log_probs, advantages):
+        return ppo_loss(old_log_probs, new_log_probs, self.config["cso_epsilon"], advantages)
+
+    @tf.function
+    def log_probs(self, states, actions):
+        return self._log_prob_entropy_value(states, actions)[0]
+
+    @tf.function
+    def train(self, states, actions, advantages, returns, old_log_probs):
+        with tf.GradientTape() as tape:
+            new_log_probs, mean_entropy, values = self._log_prob_entropy_value(states, actions)
+            # Reduces by taking the mean instead of summing
+            actor_loss = -tf.reduce_mean(self._actor_loss(old_log_probs, new_log_probs, advantages))
+            critic_loss = tf.reduce_mean(tf.square(values - returns))
+            loss = actor_loss + self.config["vf_coef"] * critic_loss - self.config["entropy_coef"] * mean_entropy
+        grads = tape.gradient(loss, self.new_network_vars)
+        grad_global_norm = tf.linalg.global_norm(grads)
+        # grads before clipping are passed to the summary, now clip and apply them
+        if self.config["gradient_clip_value"] is not None:
+            grads, _ = tf.clip_by_global_norm(grads, self.config["gradient_clip_value"])
+        self.optimizer.apply_gradients(zip(grads, self.new_network_vars))
+        return actor_loss, critic_loss, loss, mean_entropy, grad_global_norm
+
+    def update_network(self, states, actions, advs, returns, log_probs):
+        actor_loss, critic_loss, loss, mean_entropy, grad_global_norm = self.train(
+            tf.convert_to_tensor(states, tf.float32),
+            tf.convert_to_tensor(actions),
+            tf.convert_to_tensor(advs, tf.float32),
+            tf.convert_to_tensor(returns, tf.float32),
+            tf.convert_to_tensor(log_probs, tf.float32))
+        self.metrics.scalar("model/Actor_loss", actor_loss, self.n_updates)
+        self.metrics.scalar("model/Critic_loss", critic_loss, self.n_updates)
+        self.metrics.scalar("model/Loss", loss, self.n_updates)
+        self.metrics.scalar("model/Entropy", mean_entropy, self.n_updates)
+        self.metrics.scalar("model/grad_global_norm", grad_global_norm, self.n_updates)
         self.n_updates += 1
 
-    def learn_by_batches(self, trajectories):
-        all_states, all_actions, all_advs, all_returns = [], [], [], []
-        for states, actions, advs, returns, _ in trajectories:
-            all_states.extend(states)
-            all_actions.extend(actions)
-            all_advs.extend(advs)
-            all_returns.extend(returns)
-        all_advs = np.array(all_advs)
-        all_advs = (all_advs - all_advs.mean()) / all_advs.std()
-        indices = np.arange(len(all_states))
+    def update_network_on(self, records: np.ndarray):
+        """Update using the fields of an array of step records."""
+        self.update_network(records["states"], records["actions"], records["advantages"], records["returns"],
+                            records["log_probs"])
+
+    def learn_by_batches(self, rollouts: np.ndarray, shuffled: np.ndarray):
+        """
+        Learn on minibatches of the steps of all rollouts.
+        Every epoch, the steps are shuffled into the preallocated array `shuffled`, of which the minibatches are views.
+        """
+        advs = rollouts["advantages"]
+        advs -= advs.mean()
+        advs /= advs.std() + 1e-8
         batch_size = int(self.config["batch_size"])
         for _ in range(int(self.config["n_epochs"])):
-            np.random.shuffle(indices)
-            for j in range(0, len(all_states), batch_size):
-                batch_indices = indices[j:(j + batch_size)]
-                batch_states = np.array(all_states)[batch_indices]
-                batch_actions = np.array(all_actions)[batch_indices]
-                batch_advs = np.array(all_advs)[batch_indices]
-                batch_rs = np.array(all_returns)[batch_indices]
-                self.update_network(batch_states, batch_actions, batch_advs, batch_rs)
-            self.writer.flush()
-
-
-    def learn_by_trajectories(self, trajectories):
+            np.take(rollouts, np.random.permutation(len(rollouts)), out=shuffled)
+            for j in range(0, len(shuffled), batch_size):
+                self.update_network_on(shuffled[j:(j + batch_size)])
+
+    def learn_by_trajectories(self, rollouts: List[np.ndarray]):
         for _ in range(int(self.config["n_epochs"])):
-            for states, actions, advs, returns, features in trajectories:
-                self.update_network(states, actions, advs, returns, features)
-            self.writer.flush()
+            for rollout in rollouts:
+                self.update_network_on(rollout)
+
+    def learn_on(self, records: np.ndarray, rollouts: List[np.ndarray], shuffled: np.ndarray):
+        """Learn on a batch of records, which consists of the rollouts (views of it)."""
+        with profiling.timer("train"):
+            if self.config["learn_method"] == "batches":
+                self.learn_by_batches(records, shuffled)
+            else:
+                self.learn_by_trajectories(rollouts)
+
+    def correct_stale(self, rollout: np.ndarray) -> None:
+        """
+        Weigh the advantages of a rollout that was collected with an old policy
+        by the truncated importance weights min(1, pi(a|s) / mu(a|s)) of the current policy pi and the old one mu.
+        """
+        log_probs = self.log_probs(tf.convert_to_tensor(rollout["states"], tf.float32),
+                                   tf.convert_to_tensor(rollout["actions"])).numpy()
+        rollout["advantages"] *= np.minimum(1.0, np.exp(log_probs - rollout["log_probs"]))
+
+    def learn_synchronously(self, comm, broadcaster: ParameterBroadcaster, dtype: np.dtype):
+        """Every update, broadcast the parameters and wait for the rollouts of all workers."""
+        n_workers = int(self.config["n_workers"])
+        n_steps = int(self.config["n_local_steps"]) * int(self.config["n_envs"])
+        gatherer = RolloutGatherer(comm, MPI.ROOT, dtype, [n_steps] * n_workers)
+        rollouts = [gatherer.worker_rollout(worker) for worker in range(n_workers)]
+        shuffled = np.empty_like(gatherer.records)
+        for iteration in range(int(self.config["n_iter"])):
+            start = time.perf_counter()
+            with profiling.timer("sync"):
+                broadcaster.broadcast(iteration)
+            self.metrics.scalar("sync/broadcast_seconds", time.perf_counter() - start, iteration)
+            with profiling.timer("gather"):
+                records = gatherer.gather()
+            profiling.count("env_steps", len(records))
+            self.learn_on(records, rollouts, shuffled)
+        broadcaster.broadcast(STOP)
+
+    def learn_asynchronously(self, comm, broadcaster: ParameterBroadcaster, dtype: np.dtype):
+        """
+        Train on rollouts in the order in which they arrive, without waiting for the slower workers.
+        After every update, the new parameters are sent to every worker, which picks them up after its current rollout.
+        Rollouts collected more than max_staleness updates ago are dropped or corrected.
+        """
+        n_workers = int(self.config["n_workers"])
+        n_steps = int(self.config["n_local_steps"]) * int(self.config["n_envs"])
+        n_rollouts = int(self.config["rollouts_per_update"])
+        max_staleness = int(self.config["max_staleness"])
+        records = np.zeros(n_rollouts * n_steps, dtype)
+        rollouts = [records[i * n_steps:(i + 1) * n_steps] for i in range(n_rollouts)]
+        shuffled = np.empty_like(records)
+        sends = []  # Requests of the parameters that are being sent, with their message
+
+        def send(version: int):
+            nonlocal sends
+            sends = [(request, message) for request, message in sends if not request.Test()]
+            message = broadcaster.pack(version).copy()  # The message of the previous version may still be in use
+            sends += [(broadcaster.isend(message, worker), message) for worker in range(n_workers)]
+
+        receivers = [RolloutReceiver(comm, worker, dtype, n_steps) for worker in range(n_workers)]
+        requests = [receiver.post() for receiver in receivers]
+        send(0)
+        version = n_received = n_dropped = n_batch = 0
+        while version < int(self.config["n_iter"]):
+            start = time.perf_counter()
+            with profiling.timer("gather"):
+                arrived = MPI.Request.Waitsome(requests)
+            self.metrics.scalar("async/wait_seconds", time.perf_counter() - start, version)
+            for worker in arrived:
+                receiver = receivers[worker]
+                staleness = version - receiver.version
+                self.metrics.scalar("async/staleness", staleness, n_received)
+                n_received += 1
+                profiling.count("env_steps", n_steps)
+                if staleness > max_staleness and self.config["stale_rollouts"] == "drop":
+                    n_dropped += 1
+                else:
+                    rollouts[n_batch][...] = receiver.records
+                    if staleness > max_staleness:
+                        self.correct_stale(rollouts[n_batch])
+                    n_batch += 1
+                requests[worker] = receiver.post()
+                if n_batch == n_rollouts:
+                    self.learn_on(records, rollouts, shuffled)
+                    n_batch = 0
+                    version += 1
+                    send(version)
+                    self.metrics.scalar("async/dropped_fraction", n_dropped / n_received, version)
+        # Rollouts may still arrive until every worker has seen the STOP, they are discarded
+        send(STOP)
+        done = np.zeros(n_workers, np.int64)
+        done_requests = [comm.Irecv(done[worker:worker + 1], source=worker, tag=DONE_TAG) for worker in range(n_workers)]
+        while not all(request == MPI.REQUEST_NULL for request in done_requests):
+            for i in MPI.Request.Waitsome(requests + done_requests):
+                if i < n_workers:
+                    requests[i] = receivers[i].post()
+                else:
+                    done_requests[i - n_workers] = MPI.REQUEST_NULL
+        for receiver in receivers:
+            receiver.cancel()
+        MPI.Request.Waitall([request for request, _ in sends])
 
     def learn(self):
         """Run learning algorithm"""
@@ -192,7 +259,7 @@ class DPPO(Agent):
             self.env_name,
             self.task_type,
             self.config["config_path"],
-            "--monitor_path", self.monitor_path
+            "--monitor_path", str(self.monitor_path)
         ]
         seed = self.config["seed"]
         if seed is not None:
@@ -202,22 +269,17 @@ class DPPO(Agent):
             args=args,
             maxprocs=int(self.config["n_workers"])
         )
-        sess_config = tf.ConfigProto()
-        sess_config.gpu_options.allow_growth = True
-        with tf.Session(config=sess_config) as sess, sess.as_default():
-            tf.get_default_session().run(self.init_op)
-            for _ in range(config["n_iter"]):
-                # Collect trajectories until we get timesteps_per_batch total timesteps
-                for var in self.new_network_vars:
-                    comm.Bcast(var.eval(), root=MPI.ROOT)
-                trajectories = comm.gather(None, root=MPI.ROOT)
-                tf.get_default_session().run(self.set_old_to_new)
-
-                # Mix steps of all trajectories and learn by minibatches or not
-                if self.config["learn_method"] == "batches":
-                    self.learn_by_batches(trajectories)
-                else:
-                    self.learn_by_trajectories(trajectories)
+        broadcaster = ParameterBroadcaster(comm, MPI.ROOT, self.flat_variables,
+                                           dtype=self.config["sync_dtype"], deltas=self.config["sync_deltas"])
+        dtype = rollout_dtype(self.env.observation_space, self.env.action_space)
+        if self.config["asynchronous"]:
+            self.learn_asynchronously(comm, broadcaster, dtype)
+        else:
+            self.learn_synchronously(comm, broadcaster, dtype)
+        comm.Disconnect()
+        self.metrics.close()
+        if self.config["save_model"]:
+            tf.saved_model.save(self.new_network, str(self.monitor_path / "model"))
 
 class DPPODiscrete(DPPO):
 
@@ -227,11 +289,15 @@ class DPPODiscrete(DPPO):
 
     def build_networks(self):
         return ActorCriticNetworkDiscrete(
-            list(self.env.observation_space.shape),
             self.env.action_space.n,
             int(self.config["n_hidden_units"]),
             int(self.config["n_hidden_layers"]))
 
+    def _log_prob_entropy_value(self, states, actions):
+        logits, values = self.new_network(states)
+        log_probs = self.new_network.log_prob(actions, logits)
+        return log_probs, tf.reduce_mean(self.new_network.entropy(logits)), tf.squeeze(values, axis=-1)
+
 
 class DPPODiscreteCNN(DPPODiscrete):
 
@@ -241,10 +307,14 @@ class DPPODiscreteCNN(DPPODiscrete):
 
     def build_networks(self):
         return ActorCriticNetworkDiscreteCNN(
-            list(self.env.observation_space.shape),
             self.env.action_space.n,
             int(self.config["n_hidden_units"]))
 
+    def _log_prob_entropy_value(self, states, actions):
+        logits, values = self.new_network(states)
+        log_probs = -tf.nn.sparse_softmax_cross_entropy_with_logits(labels=tf.cast(actions, tf.int32), logits=logits)
+        return log_probs, tf.reduce_mean(self.new_network.entropy(logits)), tf.squeeze(values, axis=-1)
+
 
 class DPPOContinuous(DPPO):
 
@@ -254,10 +324,14 @@ class DPPOContinuous(DPPO):
 
     def build_networks(self):
         return ActorCriticNetworkContinuous(
-            list(self.env.observation_space.shape),
-            self.env.action_space,
+            self.env.action_space.shape,
             int(self.config["n_hidden_units"]),
             int(self.config["n_hidden_layers"]))
 
+    def _log_prob_entropy_value(self, states, actions):
+        _, mean, values = self.new_network(states)
+        log_probs = normal_dist_log_prob(actions, mean, self.new_network.action_mean.log_std)
+        return log_probs, self.new_network.entropy(), tf.squeeze(values, axis=-1)
+
     def get_env_action(self, action):
         return action
@@ -3,6 +3,8 @@
 
 import argparse
 import os
+import time
+from pathlib import Path
 from typing import Dict, Any
 import numpy as np
 from mpi4py import MPI
@@ -11,9 +13,17 @@ os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
 import tensorflow as tf
 
 from yarll.environment.registration import make
-from yarll.misc.utils import load, json_to_dict
-from yarll.agents.actorcritic.actor_critic import ActorCriticNetworkDiscrete, ActorCriticNetworkDiscreteCNN, ActorCriticNetworkDiscreteCNNRNN, actor_critic_discrete_loss, ActorCriticNetworkContinuous, actor_critic_continuous_loss
-from yarll.agents.env_runner import EnvRunner
+from yarll.misc.utils import load, json_to_dict, set_tf_threads
+from yarll.agents.actorcritic.actor_critic import ActorCriticNetworkDiscrete, ActorCriticNetworkDiscreteCNN, \
+    ActorCriticNetworkContinuous
+from yarll.agents.env_runner import EnvRunner, VecEnvRunner
+from yarll.agents.ppo.parameter_sync import ParameterReceiver
+from yarll.agents.ppo.rollout_transfer import RolloutSender, rollout_dtype
+from yarll.memory.rollout_buffer import RolloutBuffer
+from yarll.misc.advantages import generalized_advantage_estimation
+from yarll.misc.metrics import MetricsAggregator
+from yarll.misc.network_ops import normal_dist_log_prob
+from yarll.misc.tf_utils import FlatVariables
 
 
 class DPPOWorker(object):
@@ -27,77 +37,101 @@ class DPPOWorker(object):
         self.task_id = task_id
         if seed is not None:
             self.env.seed(seed)
-        self.writer = tf.summary.FileWriter(os.path.join(
-            monitor_path,
-            "task{}".format(task_id)))
+        self.writer = tf.summary.create_file_writer(str(Path(monitor_path) / "task{}".format(task_id)))
+        self.metrics = MetricsAggregator(self.writer)
 
         # Only used (and overwritten) by agents that use an RNN
         self.initial_features = None
-        with tf.device('/cpu:0'):
-            with tf.variable_scope("new_network"):  # The workers only have 1 network
-                self.global_network = self.build_networks()
-                self.states = self.global_network.states
-                self.action = self.global_network.action
-                self.value = self.global_network.value
-                self.global_vars = tf.get_collection(
-                    tf.GraphKeys.TRAINABLE_VARIABLES, tf.get_variable_scope().name)
-                self._global_step = tf.get_variable(
-                    "global_step", [],
-                    tf.int32,
-                    initializer=tf.constant_initializer(0, dtype=tf.int32),
-                    trainable=False)
-
-            self.env_runner = EnvRunner(
-                self.env, self, {})
+        self.global_network = self.build_networks()
+        states_spec = tf.TensorSpec((None, *self.env.observation_space.shape), tf.float32)
+        self._policy = tf.function(self._policy_fn, input_signature=[states_spec])
+        self._policy(tf.zeros((1, *self.env.observation_space.shape)))  # Makes the variables
+        self.global_vars = self.global_network.trainable_weights
+        self.receiver = ParameterReceiver(self.comm, 0, FlatVariables(self.global_vars),
+                                          dtype=self.config["sync_dtype"], deltas=self.config["sync_deltas"])
+
+        # With multiple environments, the actions for all of them are chosen using a single call to the policy
+        self.n_envs = int(self.config["n_envs"])
+        if self.n_envs > 1:
+            self.env_runner = VecEnvRunner(self.env, self, dict(self.config, seed=seed), self.n_envs,
+                                           metrics=self.metrics)
+        else:
+            self.env_runner = EnvRunner(self.env, self, self.config, metrics=self.metrics)
+        self.rollout = RolloutBuffer(int(self.config["n_local_steps"]))
+        self.sender = RolloutSender(self.comm, 0, rollout_dtype(self.env.observation_space, self.env.action_space),
+                                    int(self.config["n_local_steps"]) * self.n_envs)
 
     def build_networks(self):
         raise NotImplementedError
 
+    def _policy_fn(self, states):
+        """Sampled actions, predicted values and log-probabilities of the actions for a batch of states."""
+        raise NotImplementedError
+
+    def collect(self):
+        """
+        Collect a rollout and return its states, actions, advantages, returns and log-probabilities,
+        with the steps of all environments after each other per timestep.
+        """
+        experiences = self.env_runner.get_steps(
+            int(self.config["n_local_steps"]), stop_at_trajectory_end=False, memory=self.rollout)
+        fields = [experiences.states, experiences.actions, experiences.rewards, experiences.values,
+                  experiences.terminals, experiences.log_probs]
+        next_states = experiences.next_states[-1]
+        if self.n_envs == 1:
+            # Add an environment dimension, such that everything has shape [T, n_envs, ...]
+            fields = [x[:, None] for x in fields]
+            next_states = next_states[None]
+        states, actions, rewards, values, terminals, log_probs = fields
+        # Value of the states after the last step, ignored for environments whose last step was terminal
+        value = self.get_critic_value(next_states, self.env_runner.features)
+        advantages, returns = generalized_advantage_estimation(rewards,
+                                                               values,
+                                                               terminals,
+                                                               value,
+                                                               self.config["gamma"],
+                                                               self.config["gae_lambda"])
+        n_steps = rewards.size
+        return states.reshape(n_steps, *states.shape[2:]), actions.reshape(n_steps, *actions.shape[2:]), \
+            advantages.reshape(n_steps), returns.reshape(n_steps), log_probs.reshape(n_steps)
+
     def run(self):
-        with tf.Session() as sess, sess.as_default():
-            var_receivers = [np.zeros(var.shape.as_list(), dtype=var.dtype.as_numpy_dtype) for var in self.global_vars]
-            while True:
-                for var_receiver, tf_var in zip(var_receivers, self.global_vars):
-                    self.comm.Bcast(var_receiver, root=0)
-                    tf_var.load(var_receiver)
-                experiences = self.env_runner.get_steps(
-                    int(self.config["n_local_steps"]), stop_at_trajectory_end=False)
-                T = experiences.steps
-                value = 0 if experiences.terminals[-1] else self.get_critic_value(
-                    np.asarray(experiences.states)[None, -1], experiences.features[-1])
-                vpred = np.asarray(experiences.values + [value])
-                gamma = self.config["gamma"]
-                lambda_ = self.config["gae_lambda"]
-                gaelam = advantages = np.empty(T, 'float32')
-                last_gaelam = 0
-                for t in reversed(range(T)):
-                    nonterminal = 1 - experiences.terminals[t]
-                    delta = experiences.rewards[t] + gamma * vpred[t + 1] * nonterminal - vpred[t]
-                    gaelam[t] = last_gaelam = delta + gamma * lambda_ * nonterminal * last_gaelam
-                returns = advantages + experiences.values
-                processed = experiences.states, experiences.actions, advantages, returns, experiences.features[0]
-                self.comm.gather(processed, root=0)
-
-    @property
-    def global_step(self):
-        return self._global_step.eval()
+        asynchronous = self.config["asynchronous"]
+        # In asynchronous mode, the worker continues with the parameters it has until new ones have arrived
+        running = self.receiver.receive_latest(block=True) if asynchronous else self.receiver.receive()
+        iteration = 0
+        while running:
+            start = time.perf_counter()
+            rollout = self.collect()
+            collected = time.perf_counter()
+            self.sender.pack(*rollout)
+            if asynchronous:
+                self.sender.send_version(self.receiver.version)
+                running = self.receiver.receive_latest(block=False)
+            else:
+                self.sender.send()
+                running = self.receiver.receive()
+            # Fraction of the time spent collecting instead of waiting for the master
+            self.metrics.scalar("worker/utilisation", (collected - start) / (time.perf_counter() - start), iteration)
+            iteration += 1
+        if asynchronous:
+            self.sender.done()
+        self.metrics.close()
+        self.comm.Disconnect()
 
     def get_critic_value(self, state, *rest):
-        fetches = [self.global_network.value]
-        feed_dict = {self.global_network.states: state}
-        value = tf.get_default_session().run(fetches, feed_dict=feed_dict)[0].flatten()
-        return value
+        return self._policy(state)[1].numpy()
 
     def choose_action(self, state, *rest):
-        fetches = [self.global_network.action, self.global_network.value]
-        feed_dict = {
-            self.global_network.states: [state]
-        }
-        action, value = tf.get_default_session().run(fetches, feed_dict=feed_dict)
-        return {"action": action, "value": value[0]}
+        action, value, log_prob = self._policy(state[None])
+        return {"action": action.numpy()[0], "value": value.numpy()[0], "log_prob": log_prob.numpy()[0]}
+
+    def choose_actions(self, states, *rest):
+        action, value, log_prob = self._policy(states)
+        return {"action": action.numpy(), "value": value.numpy(), "log_prob": log_prob.numpy()}
 
     def get_env_action(self, action):
-        return np.argmax(action)
+        return action
 
     def new_trajectory(self):
         pass
@@ -106,115 +140,44 @@ class DPPOWorker(object):
 class DPPOWorkerDiscrete(DPPOWorker):
     """DPPOWorker for a discrete action space."""
 
-    def __init__(self, env_id, task_id, comm, monitor_path, config, seed=None):
-        self.make_loss = actor_critic_discrete_loss
-        super(DPPOWorkerDiscrete, self).__init__(
-            env_id,
-            task_id,
-            comm,
-            monitor_path,
-            config,
-            seed
-        )
-
     def build_networks(self):
         ac_net = ActorCriticNetworkDiscrete(
-            list(self.env.observation_space.shape),
             self.env.action_space.n,
             int(self.config["n_hidden_units"]),
             int(self.config["n_hidden_layers"]))
         return ac_net
 
+    def _policy_fn(self, states):
+        logits, value = self.global_network(states)
+        action = self.global_network.dist(logits)
+        log_prob = -tf.nn.sparse_softmax_cross_entropy_with_logits(labels=tf.cast(action, tf.int32), logits=logits)
+        return action, tf.squeeze(value, axis=-1), log_prob
+
 
 class DPPOWorkerDiscreteCNN(DPPOWorkerDiscrete):
     """DPPOWorker for a discrete action space."""
 
-    def __init__(self, env_id, task_id, comm, monitor_path, config, seed=None):
-        self.make_loss = actor_critic_discrete_loss
-        super(DPPOWorkerDiscreteCNN, self).__init__(
-            env_id,
-            task_id,
-            comm,
-            monitor_path,
-            config,
-            seed
-        )
-
     def build_networks(self):
         ac_net = ActorCriticNetworkDiscreteCNN(
-            list(self.env.observation_space.shape),
             self.env.action_space.n,
-            int(self.config["n_hidden_units"]),
-            summary=False)
+            int(self.config["n_hidden_units"]))
         return ac_net
 
 
-class DPPOWorkerDiscreteCNNRNN(DPPOWorkerDiscreteCNN):
-    """DPPOWorker for a discrete action space."""
-
-    def __init__(self, env_id, task_id, comm, monitor_path, config, seed=None):
-        self.make_loss = actor_critic_discrete_loss
-        super(DPPOWorkerDiscreteCNNRNN, self).__init__(
-            env_id,
-            task_id,
-            comm,
-            monitor_path,
-            config,
-            seed
-        )
-
-    def build_networks(self):
-        ac_net = ActorCriticNetworkDiscreteCNNRNN(
-            list(self.env.observation_space.shape),
-            self.env.action_space.n,
-            int(self.config["n_hidden_units"]),
-            summary=False)
-        self.initial_features = ac_net.state_init
-        return ac_net
-
-    def choose_action(self, state, features):
-        feed_dict = {
-            self.states: [state]
-        }
-
-        feed_dict[self.global_network.rnn_state_in] = features
-        action, rnn_state, value = tf.get_default_session().run(
-            [self.action, self.global_network.rnn_state_out, self.value],
-            feed_dict=feed_dict)
-        return {"action": action, "value": value, "features": rnn_state}
-
-    def get_critic_value(self, states, features):
-        feed_dict = {
-            self.states: states
-        }
-        feed_dict[self.global_network.rnn_state_in] = features
-        return tf.get_default_session().run(self.value, feed_dict=feed_dict)[0]
-
-
 class DPPOWorkerContinuous(DPPOWorker):
     """DPPOWorker for a continuous action space."""
 
-    def __init__(self, env_id, task_id, comm, monitor_path, config, seed=None):
-        self.make_loss = actor_critic_continuous_loss
-        super(DPPOWorkerContinuous, self).__init__(
-            env_id,
-            task_id,
-            comm,
-            monitor_path,
-            config,
-            seed
-        )
-
     def build_networks(self):
         ac_net = ActorCriticNetworkContinuous(
-            list(self.env.observation_space.shape),
-            self.env.action_space,
+            self.env.action_space.shape,
             int(self.config["n_hidden_units"]),
             int(self.config["n_hidden_layers"]))
         return ac_net
 
-    def get_env_action(self, action):
-        return action
+    def _policy_fn(self, states):
+        action, mean, value = self.global_network(states)
+        log_prob = normal_dist_log_prob(action, mean, self.global_network.action_mean.log_std)
+        return action, tf.squeeze(value, axis=-1), log_prob
 
 
 parser = argparse.ArgumentParser()
@@ -223,8 +186,6 @@ parser.add_argument("env_id", type=str,
                     help="Name of the environment on which to run")
 parser.add_argument("cls", type=str, help="Which class to use for the task.")
 parser.add_argument("config", type=str, help="Path to config file")
-parser.add_argument("-seed", type=int, default=None,
-                    help="Seed to use for the environment.")
 parser.add_argument("--monitor_path", type=str,
                     help="Path where to save monitor files.")
 parser.add_argument("--seed", type=int, default=None, help="Seed to use for environments.")
@@ -234,10 +195,18 @@ def main():
     comm = MPI.Comm.Get_parent()
     task_id = comm.Get_rank()
     args = parser.parse_args()
+    # The workers run in parallel, so each of them uses a single thread
+    set_tf_threads(1, 1)
     cls = load("yarll.agents.ppo.dppo_worker:" + args.cls)
     config = json_to_dict(args.config)
-
-    task = cls(args.env_id, task_id, comm, args.monitor_path, config, args.seed)
+    seed = None
+    if args.seed is not None:
+        # Every environment of every worker is stepped differently
+        seed = args.seed + task_id * int(config["n_envs"])
+        np.random.seed(seed)
+        tf.random.set_seed(seed)
+
+    task = cls(args.env_id, task_id, comm, args.monitor_path, config, seed)
     task.run()
 
 
@@ -0,0 +1,116 @@
+# -*- coding: utf8 -*-
+
+"""
+Transfer of the parameters of the DPPO master to its workers.
+All parameters are packed into one preallocated buffer that is sent using a single collective,
+instead of one collective per variable.
+The buffer can be sent as float16 and can contain the change of the parameters since the previous broadcast,
+which the workers add to their parameters.
+The message starts with a header holding the version of the parameters (the number of updates of the master)
+or STOP, which tells the workers to stop.
+In asynchronous mode, the master sends the message to every worker separately and the workers pick it up when
+they are done with a rollout.
+"""
+
+import numpy as np
+import tensorflow as tf
+
+from yarll.misc.tf_utils import FlatVariables
+
+SYNC_DTYPES = {"float32": np.float32, "float16": np.float16}
+HEADER_BYTES = 8  # The version as an int64
+STOP = -1
+PARAMETERS_TAG = 2
+
+def _message(n_parameters: int, dtype: str):
+    """
+    Message with its header and parameters as views of it.
+    It is sent as bytes, as MPI doesn't have a float16 type.
+    """
+    message = np.zeros(HEADER_BYTES + n_parameters * np.dtype(SYNC_DTYPES[dtype]).itemsize, np.uint8)
+    return message, message[:HEADER_BYTES].view(np.int64), message[HEADER_BYTES:].view(SYNC_DTYPES[dtype])
+
+class ParameterBroadcaster(object):
+    """Sending side, used by the master."""
+
+    def __init__(self, comm, root: int, flat_variables: FlatVariables, dtype: str = "float32", deltas: bool = False) -> None:
+        super(ParameterBroadcaster, self).__init__()
+        self.comm = comm
+        self.root = root
+        self.flat_variables = flat_variables
+        self.dtype = tf.as_dtype(SYNC_DTYPES[dtype])
+        self.message, self.header, self.buffer = _message(flat_variables.size, dtype)
+        # Parameters as the workers have them. The rounding errors of a float16 delta are sent along with the next one.
+        self.synced = tf.Variable(tf.zeros(flat_variables.size), trainable=False) if deltas else None
+
+    @tf.function
+    def _pack(self):
+        parameters = self.flat_variables.flat()
+        if self.synced is None:
+            return tf.cast(parameters, self.dtype)
+        delta = tf.cast(parameters - self.synced, self.dtype)
+        self.synced.assign_add(tf.cast(delta, tf.float32))
+        return delta
+
+    def pack(self, version: int) -> np.ndarray:
+        """Write the current parameters (unless version is STOP) and the version to the message."""
+        if version != STOP:
+            self.buffer[:] = self._pack().numpy()
+        self.header[0] = version
+        return self.message
+
+    def broadcast(self, version: int = 0) -> None:
+        self.comm.Bcast(self.pack(version), root=self.root)
+
+    def isend(self, message: np.ndarray, worker: int):
+        """Start sending a packed message to one worker. The message may not change until the request completes."""
+        if self.synced is not None:
+            raise ValueError("Deltas can only be broadcast, as every worker has to receive all of them.")
+        return self.comm.Isend(message, dest=worker, tag=PARAMETERS_TAG)
+
+
+class ParameterReceiver(object):
+    """Receiving side, used by the workers."""
+
+    def __init__(self, comm, root: int, flat_variables: FlatVariables, dtype: str = "float32", deltas: bool = False) -> None:
+        super(ParameterReceiver, self).__init__()
+        self.comm = comm
+        self.root = root
+        self.flat_variables = flat_variables
+        self.deltas = deltas
+        self.message, self.header, self.buffer = _message(flat_variables.size, dtype)
+        self.version = 0  # Version of the parameters that were assigned last
+        if deltas:
+            # The deltas are relative to zero the first time
+            flat_variables.set(np.zeros(flat_variables.size, np.float32))
+
+    def _assign(self) -> None:
+        if self.deltas:
+            self.flat_variables.add(self.buffer)
+        else:
+            self.flat_variables.set(self.buffer)
+        self.version = int(self.header[0])
+
+    def receive(self) -> bool:
+        """Receive the broadcast parameters and assign them to the variables. Returns False if the master asks to stop."""
+        self.comm.Bcast(self.message, root=self.root)
+        if self.header[0] == STOP:
+            return False
+        self._assign()
+        return True
+
+    def receive_latest(self, block: bool) -> bool:
+        """
+        Receive the parameters that were sent to this worker alone and assign the latest of them.
+        Unless block is True, the variables are left as they are if nothing was sent since the previous call.
+        Returns False if the master asks to stop.
+        """
+        received = False
+        while (block and not received) or self.comm.Iprobe(source=self.root, tag=PARAMETERS_TAG):
+            self.comm.Recv(self.message, source=self.root, tag=PARAMETERS_TAG)
+            if self.header[0] == STOP:
+                return False
+            received = True
+        if received:
+            self._assign()
+        return True
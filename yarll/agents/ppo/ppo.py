@@ -1,7 +1,8 @@
 # -*- coding: utf8 -*-
 
-import csv
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
 import tensorflow as tf
 import tensorflow_addons as tfa
 import numpy as np
@@ -12,7 +13,13 @@ from yarll.agents.actorcritic.actor_critic import ActorCriticNetwork, ActorCriti
     ActorCriticNetworkMultiDiscrete, ActorCriticNetworkBernoulli, ActorCriticNetworkDiscreteCNN, \
     ActorCriticNetworkContinuous, critic_loss
 from yarll.misc.network_ops import normal_dist_log_prob
-from yarll.agents.env_runner import EnvRunner
+from yarll.agents.env_runner import EnvRunner, VecEnvRunner
+from yarll.memory.rollout_buffer import RolloutBuffer
+from yarll.memory.experience_logger import ExperienceLogger
+from yarll.misc import profiling
+from yarll.misc.advantages import generalized_advantage_estimation
+from yarll.misc.metrics import MetricsAggregator
+from yarll.misc.tf_utils import TargetUpdater
 
 
 def ppo_loss(old_logprob, new_logprob, epsilon, advantage):
@@ -45,21 +52,32 @@ class PPO(Agent):
             n_epochs=10,
             max_steps=500000,
             batch_size=64,  # Timesteps per training batch
-            n_local_steps=256,
+            n_local_steps=256,  # Steps per environment per iteration
+            n_envs=1,  # Number of environment copies that are stepped in lockstep
+            env_backend="serial",  # "serial" or "subprocess": how to step the environment copies
+            n_env_workers=None,  # Number of worker processes for the subprocess backend (default: number of cores)
             normalize_states=False,
             gradient_clip_value=None,
             vf_coef=0.5,
             entropy_coef=0.01,
             cso_epsilon=0.2,  # Clipped surrogate objective epsilon
             summary_every_updates=200,
+            metrics_flush_seconds=10.0,  # Interval at which the aggregated summaries are written
+            metrics_flush_steps=None,  # Or the number of steps after which they are written
+            metrics_percentiles=[],  # Percentiles to write in addition to the mean and count of each metric
+            compiled_update=False,  # Do all epochs and minibatches of an iteration in one compiled function
+            pipelined=False,  # Collect the next rollout with the previous weights while training on the current one
+            log_experiences=True,  # Write the experiences to the experiences directory in the monitor path
+            experiences_sample_rate=1.0,  # Fraction of the experiences that is logged
+            experiences_chunk_size=10000,  # Number of experiences per file
             save_model=False,
             checkpoints=True
         ))
         self.config.update(usercfg)
 
-        self.old_network = self.build_networks()
-
         self.new_network = self.build_networks()
+        # Network that chooses the actions: a snapshot of the new network when collecting and training are pipelined
+        self.acting_network = self.build_networks() if self.config["pipelined"] else self.new_network
         if self.RNN:
             self.initial_features = self.new_network.state_init
         else:
@@ -83,10 +101,32 @@ class PPO(Agent):
         #        summaries.append(tf.summary.histogram(v.name, v))
 
         self.writer = tf.summary.create_file_writer(str(self.monitor_path))
-        self.env_runner = EnvRunner(self.env,
-                                    self,
-                                    usercfg,
-                                    scale_states=self.config["normalize_states"])
+        self.metrics = MetricsAggregator(self.writer,
+                                         flush_every_seconds=self.config["metrics_flush_seconds"],
+                                         flush_every_steps=self.config["metrics_flush_steps"],
+                                         percentiles=self.config["metrics_percentiles"])
+        if int(self.config["n_envs"]) > 1 or self.config["env_backend"] != "serial":
+            self.env_runner = VecEnvRunner(self.env,
+                                           self,
+                                           usercfg,
+                                           int(self.config["n_envs"]),
+                                           scale_states=self.config["normalize_states"],
+                                           metrics=self.metrics,
+                                           backend=self.config["env_backend"],
+                                           n_workers=self.config["n_env_workers"])
+        else:
+            self.env_runner = EnvRunner(self.env,
+                                        self,
+                                        usercfg,
+                                        scale_states=self.config["normalize_states"],
+                                        metrics=self.metrics)
+        # Reused every iteration to collect the steps in
+        self.rollout = RolloutBuffer(int(self.config["n_local_steps"]))
+        self.experience_logger = ExperienceLogger(self.monitor_path / "experiences",
+                                                  chunk_size=int(self.config["experiences_chunk_size"]),
+                                                  sample_rate=self.config["experiences_sample_rate"],
+                                                  seed=self.config.get("seed")) \
+            if self.config["log_experiences"] else None
 
         optim_kwargs = {k: self.config[l]
                         for k, l in [("clipnorm", "gradient_clip_value")] if self.config[l] is not None}
@@ -99,6 +139,7 @@ class PPO(Agent):
             self.ckpt = tf.train.Checkpoint(net=self.new_network)
             self.cktp_manager = tf.train.CheckpointManager(self.ckpt, checkpoint_directory, 10)
             self.checkpoint_every_iters = 10
+        self.n_updates = 0
 
     def _specific_summaries(self, n_updates: int) -> None:
         """Summaries that are specific to the variant of the algorithm."""
@@ -111,59 +152,105 @@ class PPO(Agent):
         raise NotImplementedError
 
     def choose_action(self, state, features) -> dict:
-        action, value = self.new_network.action_value(state[None, :])
-        return {"action": action, "value": value[0]}
+        action, value, log_prob = self.acting_network.action_value_log_prob(state[None, :])
+        return {"action": action[0], "value": value[0], "log_prob": log_prob[0]}
+
+    def choose_actions(self, states, features) -> dict:
+        action, value, log_prob = self.acting_network.action_value_log_prob(states)
+        return {"action": action, "value": value, "log_prob": log_prob}
 
-    def get_processed_trajectories(self):
+    def get_processed_trajectories(self, rollout: Optional[RolloutBuffer] = None):
         trajectory = self.env_runner.get_steps(
-            int(self.config["n_local_steps"]), stop_at_trajectory_end=False)
-        to_save = [exp.state.tolist() + exp.action.tolist() + [exp.reward] + exp.next_state.tolist() for exp in trajectory.experiences]
-        with open(self.monitor_path / "experiences.csv", "a") as f:
-            writer = csv.writer(f)
-            writer.writerows(to_save)
+            int(self.config["n_local_steps"]), stop_at_trajectory_end=False,
+            memory=self.rollout if rollout is None else rollout)
+        states = np.asarray(trajectory.states)
+        actions = np.asarray(trajectory.actions)
+        rewards = np.asarray(trajectory.rewards, dtype=np.float32)
+        values = np.asarray(trajectory.values, dtype=np.float32)
+        log_probs = np.asarray(trajectory.log_probs, dtype=np.float32)
+        terminals = np.asarray(trajectory.terminals, dtype=np.float32)
+        next_states = np.asarray(trajectory.next_states)
+        if not isinstance(self.env_runner, VecEnvRunner):
+            # Add an environment dimension, such that everything has shape [T, n_envs, ...]
+            states, actions, rewards, values, log_probs, terminals, next_states = [
+                x[:, None] for x in (states, actions, rewards, values, log_probs, terminals, next_states)]
+        T, n_envs = rewards.shape
+        n_steps = T * n_envs
+        if self.experience_logger is not None:
+            self.experience_logger.add(states.reshape(n_steps, *states.shape[2:]),
+                                       actions.reshape(n_steps, *actions.shape[2:]),
+                                       rewards.reshape(n_steps),
+                                       next_states.reshape(n_steps, *next_states.shape[2:]),
+                                       terminals.reshape(n_steps))
         features = trajectory.features
         features = np.concatenate(trajectory.features) if features[-1] is not None else np.array([None])
-        T = trajectory.steps
-        if trajectory.experiences[-1].terminal:
-            v = 0
-        else:
-            inp = [np.asarray(trajectory.states)[None, -1]]
-            if features[-1] is not None:
-                inp.append(features[None, -1])
-            v = self.new_network.action_value(*inp)[-2 if features[-1] is not None else -1][0]
-        vpred = np.asarray(trajectory.values + [v])
-        gamma = self.config["gamma"]
-        lambda_ = self.config["gae_lambda"]
-        gaelam = advantages = np.empty(T, 'float32')
-        last_gaelam = 0
-        for t in reversed(range(T)):
-            nonterminal = 1 - trajectory.terminals[min(t + 1, T - 1)]
-            delta = trajectory.rewards[t] + gamma * vpred[t + 1] * nonterminal - vpred[t]
-            gaelam[t] = last_gaelam = delta + gamma * lambda_ * nonterminal * last_gaelam
-        rs = advantages + trajectory.values
-        return trajectory.states, trajectory.actions, advantages, rs, trajectory.values, trajectory.features
-
-    def set_old_to_new(self):
-        for old_var, new_var in zip(self.old_network.trainable_variables, self.new_network.trainable_variables):
-            old_var.assign(new_var)
+        inp = [next_states[-1]]
+        if features[-1] is not None:
+            inp.append(self.env_runner.features)
+        # Value of the states after the last step, ignored for environments whose last step was terminal
+        v = self.acting_network.action_value(*inp)[-2 if features[-1] is not None else -1]
+        advantages, rs = generalized_advantage_estimation(rewards,
+                                                          values,
+                                                          terminals,
+                                                          v,
+                                                          self.config["gamma"],
+                                                          self.config["gae_lambda"])
+        return states.reshape(n_steps, *states.shape[2:]), actions.reshape(n_steps, *actions.shape[2:]), \
+            advantages.reshape(n_steps), rs.reshape(n_steps), values.reshape(n_steps), log_probs.reshape(n_steps), \
+            trajectory.features
 
     def _critic_loss(self, returns, value):
         return critic_loss(returns, value)
 
     @tf.function
-    def train(self, states, actions_taken, advantages, returns, features=None):
+    def train(self, states, actions_taken, advantages, returns, old_log_prob, features=None):
+        """
+        Update the network using a batch of experiences.
+        old_log_prob are the log-probabilities of the actions under the policy that chose them.
+        """
+        return self._train_step(states, actions_taken, advantages, returns, old_log_prob, features)
+
+    @tf.function
+    def train_iteration(self, states, actions_taken, advantages, returns, old_log_prob):
+        """
+        Do all epochs of updates on the experiences of an iteration:
+        shuffling, making minibatches, normalizing their advantages and updating the network.
+        Returns the mean of the train statistics over all updates.
+        """
+        n = tf.shape(states)[0]
+        batch_size = int(self.config["batch_size"])
+        totals = [tf.constant(0.0) for _ in range(5)]
+        n_updates = tf.constant(0.0)
+        for _ in tf.range(int(self.config["n_epochs"])):
+            indices = tf.random.shuffle(tf.range(n))
+            for start in tf.range(0, n, batch_size):
+                batch_indices = indices[start:start + batch_size]
+                batch_advs = tf.gather(advantages, batch_indices)
+                adv_mean, adv_variance = tf.nn.moments(batch_advs, axes=[0])
+                normalized_advs = (batch_advs - adv_mean) / (tf.sqrt(adv_variance) + 1e-8)
+                actor_loss, critic_loss, loss, grad_global_norm, _, _, new_network_output = self._train_step(
+                    tf.gather(states, batch_indices),
+                    tf.gather(actions_taken, batch_indices),
+                    normalized_advs,
+                    tf.gather(returns, batch_indices),
+                    tf.gather(old_log_prob, batch_indices))
+                entropy = tf.reduce_mean(self.new_network.entropy(new_network_output))
+                results = [loss, actor_loss, critic_loss, grad_global_norm, entropy]
+                totals = [total + result for total, result in zip(totals, results)]
+                n_updates += 1.0
+        return [total / n_updates for total in totals]
+
+    def _train_step(self, states, actions_taken, advantages, returns, old_log_prob, features=None):
         states = tf.cast(states, dtype=tf.float32)
         advantages = tf.cast(advantages, dtype=tf.float32)
         returns = tf.cast(returns, dtype=tf.float32)
+        old_log_prob = tf.cast(old_log_prob, dtype=tf.float32)
         inp = states if features is None else [states, tf.cast(features, tf.float32)]
         with tf.GradientTape() as tape:
             new_res = self.new_network(inp)
             new_logits = new_res[0]
             values = tf.squeeze(new_res[1])
-            old_res = self.old_network(inp)
-            old_logits = old_res[0]
             new_log_prob = self.new_network.log_prob(actions_taken, new_logits)
-            old_log_prob = self.old_network.log_prob(actions_taken, old_logits)
             mean_actor_loss = -tf.reduce_mean(self._actor_loss(old_log_prob, new_log_prob, advantages))
             mean_critic_loss = .5 * tf.reduce_mean(self._critic_loss(returns, values))
             loss = mean_actor_loss + self.config["vf_coef"] * mean_critic_loss - self.config["entropy_coef"] * tf.reduce_mean(self.new_network.entropy(new_logits))
@@ -171,64 +258,121 @@ class PPO(Agent):
         self.optimizer.apply_gradients(zip(gradients, self.new_network.trainable_weights))
         return mean_actor_loss, mean_critic_loss, loss, tf.linalg.global_norm(gradients), old_log_prob, new_log_prob, new_logits
 
+    def pipelined_trajectories(self, n_iterations: int):
+        """
+        Yield n_iterations processed trajectories, while collecting the next one in a background thread.
+        That one is collected using a snapshot of the network taken before training on the yielded one,
+        so its actions are chosen by a policy that is at most one iteration old.
+        """
+        snapshot = TargetUpdater(self.new_network.variables, self.acting_network.variables)
+        # One rollout is collected while the other one is trained on
+        rollouts = [self.rollout, RolloutBuffer(int(self.config["n_local_steps"]))]
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            snapshot.hard_update()
+            future = executor.submit(self.get_processed_trajectories, rollouts[0])
+            for iteration in range(1, n_iterations + 1):
+                processed = future.result()
+                if iteration < n_iterations:
+                    snapshot.hard_update()
+                    future = executor.submit(self.get_processed_trajectories, rollouts[iteration % 2])
+                yield processed
+
+    def update(self, states, actions, advs, rs, values, log_probs, n_steps: int) -> None:
+        """Train on the processed experiences of an iteration. n_steps is the number of steps taken so far."""
+        if self.config["compiled_update"]:
+            with profiling.timer("train"):
+                train_loss, train_actor_loss, train_critic_loss, grad_global_norm, entropy = \
+                    self.train_iteration(tf.convert_to_tensor(states, tf.float32),
+                                         tf.convert_to_tensor(actions),
+                                         tf.convert_to_tensor(advs, tf.float32),
+                                         tf.convert_to_tensor(rs, tf.float32),
+                                         tf.convert_to_tensor(log_probs, tf.float32))
+            self.metrics.scalar("model/Loss", train_loss, step=n_steps)
+            self.metrics.scalar("model/Actor_loss", train_actor_loss, step=n_steps)
+            self.metrics.scalar("model/Critic_loss", train_critic_loss, step=n_steps)
+            self.metrics.scalar("model/old_log_prob/mean", np.mean(log_probs), n_steps)
+            self.metrics.scalar("model/old_value_pred/mean", np.mean(values), n_steps)
+            self.metrics.scalar("model/return/mean", np.mean(rs), n_steps)
+            self.metrics.scalar("model/return/std", np.std(rs), n_steps)
+            self.metrics.scalar("model/entropy", entropy, n_steps)
+            self.metrics.scalar("model/action/mean", np.mean(actions), n_steps)
+            self.metrics.scalar("model/action/std", np.std(actions), n_steps)
+            self.metrics.scalar("model/grad_global_norm", grad_global_norm, n_steps)
+            self._specific_summaries(n_steps)
+        else:
+            indices = np.arange(len(states))
+            for _ in range(int(self.config["n_epochs"])):
+                np.random.shuffle(indices)
+                batch_size = int(self.config["batch_size"])
+                for j in range(0, len(states), batch_size):
+                    batch_indices = indices[j:(j + batch_size)]
+                    batch_states = states[batch_indices]
+                    batch_actions = actions[batch_indices]
+                    batch_advs = advs[batch_indices]
+                    normalized_advs = (batch_advs - batch_advs.mean()) / (batch_advs.std() + 1e-8)
+                    batch_values = values[batch_indices]
+                    batch_rs = rs[batch_indices]
+                    batch_log_probs = log_probs[batch_indices]
+                    with profiling.timer("train"):
+                        train_actor_loss, train_critic_loss, train_loss, \
+                            grad_global_norm, new_log_prob, old_log_prob, new_network_output = self.train(batch_states,
+                                                                                                          batch_actions,
+                                                                                                          normalized_advs,
+                                                                                                          batch_rs,
+                                                                                                          batch_log_probs)
+                    if (self.n_updates % self.config["summary_every_updates"]) == 0:
+                        self.metrics.scalar("model/Loss", train_loss, step=n_steps)
+                        self.metrics.scalar("model/Actor_loss", train_actor_loss, step=n_steps)
+                        self.metrics.scalar("model/Critic_loss", train_critic_loss, step=n_steps)
+                        self.metrics.scalar("model/advantage/mean", np.mean(normalized_advs), step=n_steps)
+                        self.metrics.scalar("model/advantage/std", np.std(normalized_advs), step=n_steps)
+                        self.metrics.scalar("model/new_log_prob/mean", tf.reduce_mean(new_log_prob), n_steps)
+                        self.metrics.scalar("model/old_log_prob/mean", tf.reduce_mean(old_log_prob), n_steps)
+                        self.metrics.scalar("model/old_value_pred/mean", tf.reduce_mean(batch_values), n_steps)
+                        self.metrics.scalar("model/return/mean", np.mean(batch_rs), n_steps)
+                        self.metrics.scalar("model/return/std", np.std(batch_rs), n_steps)
+                        self.metrics.scalar("model/entropy",
+                                          tf.reduce_mean(self.new_network.entropy(new_network_output)),
+                                          n_steps)
+                        self.metrics.scalar("model/action/mean", np.mean(batch_actions), n_steps)
+                        self.metrics.scalar("model/action/std", np.std(batch_actions), n_steps)
+                        self.metrics.scalar("model/grad_global_norm", grad_global_norm, n_steps)
+                        self._specific_summaries(n_steps)
+                    self.n_updates += 1
+
     def learn(self):
         """Run learning algorithm"""
         config = self.config
         input_shape = (None, *self.env.observation_space.shape)
-        self.old_network.build(input_shape)
         self.new_network.build(input_shape)
-        n_updates = 0
+        self.acting_network.build(input_shape)
+        steps_per_iteration = int(self.config["n_local_steps"]) * int(self.config["n_envs"])
+        trajectories = self.pipelined_trajectories(int(np.ceil(int(config["max_steps"]) / steps_per_iteration))) \
+            if self.config["pipelined"] else None
         n_steps = 0
         iteration = 0
-        with self.writer.as_default():
-            while n_steps < int(config["max_steps"]):
-                # Collect trajectories until we get timesteps_per_batch total timesteps
-                states, actions, advs, rs, values, _ = self.get_processed_trajectories()
-                traj_steps = len(states)
-                n_steps += traj_steps
-                self.ckpt.save_counter.assign_add(traj_steps - 1)
-                self.set_old_to_new()
-
-                indices = np.arange(len(states))
-                for _ in range(int(self.config["n_epochs"])):
-                    np.random.shuffle(indices)
-                    batch_size = int(self.config["batch_size"])
-                    for j in range(0, len(states), batch_size):
-                        batch_indices = indices[j:(j + batch_size)]
-                        batch_states = np.array(states)[batch_indices]
-                        batch_actions = np.array(actions)[batch_indices]
-                        batch_advs = np.array(advs)[batch_indices]
-                        normalized_advs = (batch_advs - batch_advs.mean()) / (batch_advs.std() + 1e-8)
-                        batch_values = np.array(values)[batch_indices]
-                        batch_rs = np.array(rs)[batch_indices]
-                        train_actor_loss, train_critic_loss, train_loss, \
-                            grad_global_norm, new_log_prob, old_log_prob, new_network_output = self.train(batch_states,
-                                                                                                          batch_actions,
-                                                                                                          normalized_advs,
-                                                                                                          batch_rs)
-                        if (n_updates % self.config["summary_every_updates"]) == 0:
-                            tf.summary.scalar("model/Loss", train_loss, step=n_steps)
-                            tf.summary.scalar("model/Actor_loss", train_actor_loss, step=n_steps)
-                            tf.summary.scalar("model/Critic_loss", train_critic_loss, step=n_steps)
-                            tf.summary.scalar("model/advantage/mean", np.mean(normalized_advs), step=n_steps)
-                            tf.summary.scalar("model/advantage/std", np.std(normalized_advs), step=n_steps)
-                            tf.summary.scalar("model/new_log_prob/mean", tf.reduce_mean(new_log_prob), n_steps)
-                            tf.summary.scalar("model/old_log_prob/mean", tf.reduce_mean(old_log_prob), n_steps)
-                            tf.summary.scalar("model/old_value_pred/mean", tf.reduce_mean(batch_values), n_steps)
-                            tf.summary.scalar("model/return/mean", np.mean(batch_rs), n_steps)
-                            tf.summary.scalar("model/return/std", np.std(batch_rs), n_steps)
-                            tf.summary.scalar("model/entropy",
-                                              tf.reduce_mean(self.new_network.entropy(new_network_output)),
-                                              n_steps)
-                            tf.summary.scalar("model/action/mean", np.mean(batch_actions), n_steps)
-                            tf.summary.scalar("model/action/std", np.std(batch_actions), n_steps)
-                            tf.summary.scalar("model/grad_global_norm", grad_global_norm, n_steps)
-                            self._specific_summaries(n_steps)
-                        n_updates += 1
-                if self.config["checkpoints"] and (iteration % self.checkpoint_every_iters) == 0:
-                    self.cktp_manager.save()
-                iteration += 1
-
+        try:
+            with self.writer.as_default():
+                while n_steps < int(config["max_steps"]):
+                    # Collect trajectories until we get timesteps_per_batch total timesteps
+                    states, actions, advs, rs, values, log_probs, _ = self.get_processed_trajectories() \
+                        if trajectories is None else next(trajectories)
+                    traj_steps = len(states)
+                    n_steps += traj_steps
+                    self.ckpt.save_counter.assign_add(traj_steps - 1)
+
+                    self.update(states, actions, advs, rs, values, log_probs, n_steps)
+                    if self.config["checkpoints"] and (iteration % self.checkpoint_every_iters) == 0:
+                        with profiling.timer("checkpoint"):
+                            self.cktp_manager.save()
+                    iteration += 1
+        finally:
+            if trajectories is not None:
+                trajectories.close()  # Waits for the rollout that is being collected in the background
+            self.env_runner.close()
+            self.metrics.close()
+            if self.experience_logger is not None:
+                self.experience_logger.close()
         if self.config["save_model"]:
             tf.saved_model.save(self.new_network, str(self.monitor_path / "model.h5"))
 
@@ -268,22 +412,18 @@ class PPOContinuous(PPO):
             int(self.config["n_hidden_units"]),
             int(self.config["n_hidden_layers"]))
 
-    @tf.function
-    def train(self, states, actions_taken, advantages, returns, features=None):
+    def _train_step(self, states, actions_taken, advantages, returns, old_log_prob, features=None):
         states = tf.cast(states, dtype=tf.float32)
         advantages = tf.cast(advantages, dtype=tf.float32)
         returns = tf.cast(returns, dtype=tf.float32)
+        old_log_prob = tf.cast(old_log_prob, dtype=tf.float32)
         inp = states if features is None else [states, tf.cast(features, tf.float32)]
         with tf.GradientTape() as tape:
             new_res = self.new_network(inp)
             new_mean = new_res[1]
             values = tf.squeeze(new_res[2])
             new_log_std = self.new_network.action_mean.log_std
-            old_res = self.old_network(inp)
-            old_mean = old_res[1]
-            old_log_std = self.old_network.action_mean.log_std
             new_log_prob = normal_dist_log_prob(actions_taken, new_mean, new_log_std)
-            old_log_prob = normal_dist_log_prob(actions_taken, old_mean, old_log_std)
             mean_actor_loss = -tf.reduce_mean(self._actor_loss(old_log_prob, new_log_prob, advantages))
             mean_critic_loss = tf.reduce_mean(self._critic_loss(returns, values))
             loss = mean_actor_loss + self.config["vf_coef"] * mean_critic_loss
@@ -293,13 +433,17 @@ class PPOContinuous(PPO):
         return mean_actor_loss, mean_critic_loss, loss, tf.linalg.global_norm(gradients), old_log_prob, new_log_prob, new_mean
 
     def _specific_summaries(self, n_updates: int) -> None:
-        tf.summary.scalar("model/std",
+        self.metrics.scalar("model/std",
                           tf.reduce_mean(tf.exp(self.new_network.action_mean.log_std)),
                           n_updates)
 
     def choose_action(self, state, features) -> dict:
-        action, _, value = self.new_network.action_value(state[None, :])
-        return {"action": action, "value": value[0]}
+        action, _, value, log_prob = self.acting_network.action_value_log_prob(state[None, :])
+        return {"action": action[0], "value": value[0], "log_prob": log_prob[0]}
+
+    def choose_actions(self, states, features) -> dict:
+        action, _, value, log_prob = self.acting_network.action_value_log_prob(states)
+        return {"action": action, "value": value, "log_prob": log_prob}
 
     def get_env_action(self, action):
         return action
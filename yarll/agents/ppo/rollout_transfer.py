@@ -0,0 +1,134 @@
+# -*- coding: utf8 -*-
+
+"""
+Transfer of the processed rollouts of the DPPO workers to the master.
+A rollout is packed into a contiguous array of records (one per step) with a fixed structured type,
+such that the master can receive the rollouts of all workers at once using a buffer-based `Gatherv`
+directly into a preallocated array, instead of unpickling lists of arrays.
+The fields of the array and slices of it (the minibatches) are views that don't copy any data.
+In asynchronous mode, every worker sends its rollouts on its own, preceded by a header holding the version of
+the parameters with which it was collected, and the master receives them in whichever order they arrive.
+"""
+
+from typing import Sequence
+import numpy as np
+
+HEADER_BYTES = 8  # The version as an int64
+ROLLOUT_TAG = 1
+DONE_TAG = 3
+
+def _message(dtype: np.dtype, n_steps: int):
+    """Message with its header and the records as views of it."""
+    message = np.zeros(HEADER_BYTES + n_steps * dtype.itemsize, np.uint8)
+    return message, message[:HEADER_BYTES].view(np.int64), message[HEADER_BYTES:].view(dtype)
+
+def rollout_dtype(observation_space, action_space) -> np.dtype:
+    """Type of the record of a step."""
+    action_dtype = np.int64 if action_space.dtype.kind in "iu" else np.float32
+    return np.dtype([
+        ("states", np.float32, observation_space.shape),
+        ("actions", action_dtype, action_space.shape),
+        ("advantages", np.float32),
+        ("returns", np.float32),
+        ("log_probs", np.float32)
+    ])
+
+class RolloutSender(object):
+    """
+    Worker side: packs a rollout of n_steps steps and sends it to the master.
+    In asynchronous mode, a rollout is sent while the next one is collected, from one of two alternating messages.
+    """
+
+    def __init__(self, comm, root: int, dtype: np.dtype, n_steps: int) -> None:
+        super(RolloutSender, self).__init__()
+        self.comm = comm
+        self.root = root
+        # Sent as bytes, the master knows the type of the records
+        self.messages = [_message(dtype, n_steps) for _ in range(2)]
+        self.requests = [None, None]  # Of the last send from each message
+        self.current = 0
+        self.message, self.header, self.records = self.messages[self.current]
+
+    def pack(self, states, actions, advantages, returns, log_probs) -> None:
+        if self.requests[self.current] is not None:
+            self.requests[self.current].Wait()  # The previous rollout in this message is still being sent
+            self.requests[self.current] = None
+        records = self.records
+        records["states"] = states
+        records["actions"] = actions
+        records["advantages"] = advantages
+        records["returns"] = returns
+        records["log_probs"] = log_probs
+
+    def send(self) -> None:
+        """Send the rollout as part of a gather of the rollouts of all workers."""
+        self.comm.Gatherv(self.message[HEADER_BYTES:], None, root=self.root)
+
+    def send_version(self, version: int) -> None:
+        """
+        Start sending the rollout with the version of the parameters it was collected with to the master alone.
+        The next rollout is packed into the other message.
+        """
+        self.header[0] = version
+        # A synchronous send, so it only completes when the master has started receiving it (see done)
+        self.requests[self.current] = self.comm.Issend(self.message, dest=self.root, tag=ROLLOUT_TAG)
+        self.current = 1 - self.current
+        self.message, self.header, self.records = self.messages[self.current]
+
+    def done(self) -> None:
+        """Tell the master that no more rollouts will be sent, once it started receiving those that were."""
+        for request in self.requests:
+            if request is not None:
+                request.Wait()
+        self.requests = [None, None]
+        self.comm.Ssend(self.header, dest=self.root, tag=DONE_TAG)
+
+
+class RolloutGatherer(object):
+    """
+    Master side: receives the rollouts of all workers into one preallocated array.
+    The rollout of worker i is in rows offsets[i]:offsets[i + 1].
+    """
+
+    def __init__(self, comm, root: int, dtype: np.dtype, n_steps_per_worker: Sequence[int]) -> None:
+        super(RolloutGatherer, self).__init__()
+        self.comm = comm
+        self.root = root
+        self.offsets = np.concatenate([[0], np.cumsum(n_steps_per_worker)]).astype(np.int64)
+        self.records = np.zeros(self.offsets[-1], dtype)
+        self.message = self.records.view(np.uint8)
+        self.counts = (np.diff(self.offsets) * dtype.itemsize).tolist()  # In bytes
+        self.displacements = (self.offsets[:-1] * dtype.itemsize).tolist()
+
+    def gather(self) -> np.ndarray:
+        self.comm.Gatherv(None, [self.message, (self.counts, self.displacements)], root=self.root)
+        return self.records
+
+    def worker_rollout(self, worker: int) -> np.ndarray:
+        return self.records[self.offsets[worker]:self.offsets[worker + 1]]
+
+
+class RolloutReceiver(object):
+    """Master side, in asynchronous mode: receives the rollouts of one worker into a preallocated array."""
+
+    def __init__(self, comm, worker: int, dtype: np.dtype, n_steps: int) -> None:
+        super(RolloutReceiver, self).__init__()
+        self.comm = comm
+        self.worker = worker
+        self.message, self.header, self.records = _message(dtype, n_steps)
+        self.request = None
+
+    def post(self):
+        """Start receiving the next rollout. The request completes when it has arrived."""
+        self.request = self.comm.Irecv(self.message, source=self.worker, tag=ROLLOUT_TAG)
+        return self.request
+
+    @property
+    def version(self) -> int:
+        return int(self.header[0])
+
+    def cancel(self) -> None:
+        """Cancel the request of a rollout that won't be sent anymore."""
+        if not self.request.Test():
+            self.request.Cancel()
+            self.request.Wait()
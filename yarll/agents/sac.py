@@ -19,8 +19,14 @@ import tensorflow_probability as tfp
 
 from yarll.agents.agent import Agent
 from yarll.agents.env_runner import EnvRunner
-from yarll.memory.memory import Memory
-from yarll.misc.utils import hard_update, soft_update
+from yarll.memory.ring_buffer_memory import RingBufferMemory
+from yarll.memory.prioritized_memory import PrioritizedMemory
+from yarll.memory.memmap_memory import MemmapMemory
+from yarll.memory.device_replay_buffer import DeviceReplayBuffer
+from yarll.misc import profiling
+from yarll.memory.experience_logger import ExperienceLogger
+from yarll.misc.metrics import MetricsAggregator
+from yarll.misc.tf_utils import TargetUpdater, soft_update
 
 # TODO: put this in separate file
 class DeterministicPolicy:
@@ -63,11 +69,24 @@ class SAC(Agent):
             tau=0.005,
             logprob_epsilon=1e-6,  # For numerical stability when computing tf.log
             n_train_steps=1,  # Number of parameter update steps per iteration
+            fused_train=False,  # Sample and do all train steps of an iteration in one compiled function
             replay_buffer_size=1e6,
             replay_start_size=256,  # Required number of replay buffer entries to start training
+            prioritized_replay=False,
+            prioritized_replay_alpha=0.6,
+            prioritized_replay_beta=0.4,  # Annealed linearly to 1 over max_steps
+            memmap_replay=False,  # Store the observations of the replay buffer in a file instead of in RAM
+            memmap_replay_file=None,  # Default: a temporary file
+            replay_uint8_scale=None,  # Store observations as uint8 after multiplying them by this (e.g. 255 for pixels)
             hidden_layer_activation="relu",
             normalize_inputs=False,
+            log_experiences=True,  # Write the experiences to the experiences directory in the monitor path
+            experiences_sample_rate=1.0,  # Fraction of the experiences that is logged
+            experiences_chunk_size=10000,  # Number of experiences per file
             summaries=True,
+            metrics_flush_seconds=10.0,  # Interval at which the aggregated summaries are written
+            metrics_flush_steps=None,  # Or the number of steps after which they are written
+            metrics_percentiles=[],  # Percentiles to write in addition to the mean and count of each metric
             checkpoints=True,
             save_model=True,
             test_frequency=0,
@@ -101,7 +120,9 @@ class SAC(Agent):
         for net, target_net in zip(self.softq_networks, self.target_softq_networks):
             net(dummy_input_states, dummy_input_actions)
             target_net(dummy_input_states, dummy_input_actions)
-            hard_update(net.variables, target_net.variables)
+        self.target_updater = TargetUpdater([v for net in self.softq_networks for v in net.variables],
+                                            [v for net in self.target_softq_networks for v in net.variables])
+        self.target_updater.hard_update()
 
         self._alpha = tf.Variable(tf.exp(0.0), name='alpha')
 
@@ -111,17 +132,42 @@ class SAC(Agent):
                                  for _ in self.softq_networks]
         self.alpha_optimizer = tfa.optimizers.RectifiedAdam(learning_rate=self.config["alpha_learning_rate"])
 
-        self.replay_buffer = Memory(int(self.config["replay_buffer_size"]))
+        if self.config["prioritized_replay"] and self.config["memmap_replay"]:
+            raise ValueError("Prioritized replay doesn't support storing the replay buffer in a memory-mapped file.")
+        if self.config["fused_train"]:
+            if self.config["prioritized_replay"] or self.config["memmap_replay"]:
+                raise ValueError("Fused training only supports uniform sampling from a replay buffer in device memory.")
+            self.replay_buffer = DeviceReplayBuffer(int(self.config["replay_buffer_size"]))
+        elif self.config["prioritized_replay"]:
+            self.replay_buffer = PrioritizedMemory(int(self.config["replay_buffer_size"]),
+                                                   alpha=self.config["prioritized_replay_alpha"],
+                                                   beta=self.config["prioritized_replay_beta"])
+        elif self.config["memmap_replay"]:
+            self.replay_buffer = MemmapMemory(int(self.config["replay_buffer_size"]),
+                                              filename=self.config["memmap_replay_file"],
+                                              uint8_scale=self.config["replay_uint8_scale"])
+        else:
+            self.replay_buffer = RingBufferMemory(int(self.config["replay_buffer_size"]))
+        self.experience_logger = ExperienceLogger(self.monitor_path / "experiences",
+                                                  chunk_size=int(self.config["experiences_chunk_size"]),
+                                                  sample_rate=self.config["experiences_sample_rate"],
+                                                  seed=self.config.get("seed")) \
+            if self.config["log_experiences"] else None
         self.n_updates = 0
         self.total_steps = 0
         self.total_episodes = 0
         self.writer = tf.summary.create_file_writer(str(self.monitor_path)) if self.config["summaries"] else tf.summary.create_noop_writer()
+        self.metrics = MetricsAggregator(self.writer,
+                                         flush_every_seconds=self.config["metrics_flush_seconds"],
+                                         flush_every_steps=self.config["metrics_flush_steps"],
+                                         percentiles=self.config["metrics_percentiles"])
 
         self.env_runner = EnvRunner(self.env,
                                     self,
                                     usercfg,
                                     scale_states=self.config["normalize_inputs"],
-                                    summaries=self.config["summaries"]
+                                    summaries=self.config["summaries"],
+                                    metrics=self.metrics
                                     )
 
         if self.config["checkpoints"]:
@@ -143,7 +189,8 @@ class SAC(Agent):
                                              scale_states=True,
                                              summaries=False,
                                              episode_rewards_file=(
-                                             self.monitor_path / "test_rewards.txt")
+                                             self.monitor_path / "test_rewards.txt"),
+                                             metrics=self.metrics
                                              )
             header = [""] # (epoch) id has no name in header
             header += [f"rew_{i}" for i in range(self.config["n_test_episodes"])]
@@ -164,7 +211,41 @@ class SAC(Agent):
         return self.actor_network(state[None, :])[0].numpy()[0]
 
     @tf.function
-    def train(self, state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch):
+    def train(self, state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch, weights):
+        """
+        Update the critics, actor and alpha using a batch of experiences.
+        Weights are the importance-sampling weights of the experiences (all 1 without prioritized replay).
+        """
+        return self._train_step(state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch, weights)
+
+    @tf.function
+    def train_fused(self, n_steps):
+        """
+        Do n_steps updates on batches sampled from the device replay buffer, followed by the update
+        of the target networks. Returns the mean of the train statistics over the steps.
+        """
+        batch_size = self.config["batch_size"]
+        weights = tf.ones((batch_size,), tf.float32)
+        totals = [tf.constant(0.0) for _ in range(7)]
+        for _ in tf.range(n_steps):
+            sample = self.replay_buffer.sample(batch_size)
+            softq_mean, softq_std, softq_targets, softq_loss, actor_loss, alpha_loss, action_logprob_mean, _ = \
+                self._train_step(sample["states0"],
+                                 tf.reshape(sample["actions"], [batch_size, self.n_actions]),
+                                 sample["rewards"],
+                                 sample["states1"],
+                                 sample["terminals1"],
+                                 weights)
+            results = [softq_mean, softq_std, tf.reduce_mean(softq_targets), softq_loss,
+                       actor_loss, alpha_loss, action_logprob_mean]
+            totals = [total + result for total, result in zip(totals, results)]
+        for net, target_net in zip(self.softq_networks, self.target_softq_networks):
+            soft_update(net.variables, target_net.variables, self.config["tau"])
+        n = tf.cast(n_steps, tf.float32)
+        return [total / n for total in totals]
+
+    def _train_step(self, state0_batch, action_batch, reward_batch, state1_batch, terminal1_batch, weights):
+        """Body of `train`, also used in the loop of `train_fused`."""
         # Calculate critic targets
 
         next_action_batch, next_logprob_batch = self.actor_network(state1_batch)
@@ -177,11 +258,14 @@ class SAC(Agent):
 
         # Update critics
         softq_losses = []
+        td_errors = []
         for net, optimizer in zip(self.softq_networks, self.softq_optimizers):
             with tf.GradientTape() as tape:
                 softq = net(state0_batch, action_batch)
-                softq_loss = 0.5 * tf.losses.MSE(y_true=softq_targets, y_pred=tf.squeeze(softq))
+                td_error = tf.reshape(softq, [self.config["batch_size"]]) - softq_targets
+                softq_loss = 0.5 * tf.reduce_mean(weights * tf.square(td_error))
                 softq_losses.append(tf.stop_gradient(softq_loss))
+                td_errors.append(tf.stop_gradient(tf.abs(td_error)))
             softq_gradients = tape.gradient(softq_loss, net.trainable_weights)
             optimizer.apply_gradients(zip(softq_gradients, net.trainable_weights))
 
@@ -203,7 +287,8 @@ class SAC(Agent):
         self.alpha_optimizer.apply_gradients(zip(alpha_gradients, [self._alpha]))
 
         softq_mean, softq_variance = tf.nn.moments(softq, axes=[0])
-        return softq_mean[0], tf.sqrt(softq_variance[0]), softq_targets, tf.reduce_mean(softq_losses), tf.reduce_mean(actor_loss), alpha_loss, tf.reduce_mean(action_logprob)
+        return softq_mean[0], tf.sqrt(softq_variance[0]), softq_targets, tf.reduce_mean(softq_losses), \
+            tf.reduce_mean(actor_loss), alpha_loss, tf.reduce_mean(action_logprob), tf.reduce_mean(td_errors, axis=0)
 
     def learn(self):
         # Arrays to keep results from train function over different train steps in
@@ -213,64 +298,88 @@ class SAC(Agent):
         actor_losses = np.empty((self.config["n_train_steps"],), np.float32)
         alpha_losses = np.empty((self.config["n_train_steps"],), np.float32)
         action_logprob_means = np.empty((self.config["n_train_steps"],), np.float32)
-        to_save = []
+        uniform_weights = np.ones((self.config["batch_size"],), np.float32)
+        beta_start = self.config["prioritized_replay_beta"]
         total_episodes = 0
-        with self.writer.as_default():
-            for step in range(self.config["max_steps"]):
-                if self.config["test_frequency"] > 0 and (step % self.config["test_frequency"]) == 0 and self.config["n_test_episodes"] > 0:
-                    for i in range(self.config["n_test_episodes"]):
-                        test_trajectory = self.test_env_runner.get_trajectory(stop_at_trajectory_end=True)
-                        self.total_rewards[i] = np.sum(test_trajectory.rewards)
-                    test_rewards_mean = np.mean(self.total_rewards)
-                    test_rewards_std = np.std(self.total_rewards)
-                    to_write = [step] + self.total_rewards.tolist() + [test_rewards_mean, test_rewards_std]
-                    with open(self.test_results_file, "a") as f:
-                        writer = csv.writer(f)
-                        writer.writerow(to_write)
-
-                experience = self.env_runner.get_steps(1)[0]
-                self.total_steps += 1
-                self.replay_buffer.add(experience.state, experience.action, experience.reward,
-                                       experience.next_state, experience.terminal)
-                to_save.append(experience.state.tolist() + experience.action.tolist() +
-                               [experience.reward] + experience.next_state.tolist())
-                if self.replay_buffer.n_entries > self.config["replay_start_size"]:
-                    for i in range(self.config["n_train_steps"]):
-                        sample = self.replay_buffer.get_batch(self.config["batch_size"])
-                        softq_mean, softq_std, softq_targets, softq_loss, actor_loss, alpha_loss, action_logprob_mean = self.train(
-                            sample["states0"],
-                            np.resize(sample["actions"], [self.config["batch_size"],
-                                                          self.n_actions]),  # for n_actions == 1
-                            sample["rewards"],
-                            sample["states1"],
-                            sample["terminals1"])
-                        softq_means[i] = softq_mean
-                        softq_stds[i] = softq_std
-                        softq_losses[i] = softq_loss
-                        actor_losses[i] = actor_loss
-                        alpha_losses[i] = alpha_loss
-                        action_logprob_means[i] = action_logprob_mean
-                    tf.summary.scalar("model/predicted_softq_mean", np.mean(softq_means), self.total_steps)
-                    tf.summary.scalar("model/predicted_softq_std", np.mean(softq_stds), self.total_steps)
-                    tf.summary.scalar("model/softq_targets", np.mean(softq_targets), self.total_steps)
-                    tf.summary.scalar("model/softq_loss", np.mean(softq_losses), self.total_steps)
-                    tf.summary.scalar("model/actor_loss", np.mean(actor_losses), self.total_steps)
-                    tf.summary.scalar("model/alpha_loss", np.mean(alpha_losses), self.total_steps)
-                    tf.summary.scalar("model/alpha", self._alpha, self.total_steps)
-                    tf.summary.scalar("model/action_logprob_mean", np.mean(action_logprob_means), self.total_steps)
-                    # Update the target networks
-                    for net, target_net in zip(self.softq_networks, self.target_softq_networks):
-                        soft_update(net.variables,
-                                    target_net.variables,
-                                    self.config["tau"])
-                    self.n_updates += 1
-                if experience.terminal:
-                    total_episodes += 1
-                    if self.config["checkpoints"] and (total_episodes % self.checkpoint_every_episodes) == 0:
-                        self.cktp_manager.save()
-        with open(self.monitor_path / "experiences.csv", "w") as f:
-            writer = csv.writer(f)
-            writer.writerows(to_save)
+        try:
+            with self.writer.as_default():
+                for step in range(self.config["max_steps"]):
+                    if self.config["test_frequency"] > 0 and (step % self.config["test_frequency"]) == 0 and self.config["n_test_episodes"] > 0:
+                        for i in range(self.config["n_test_episodes"]):
+                            test_trajectory = self.test_env_runner.get_trajectory(stop_at_trajectory_end=True)
+                            self.total_rewards[i] = np.sum(test_trajectory.rewards)
+                        test_rewards_mean = np.mean(self.total_rewards)
+                        test_rewards_std = np.std(self.total_rewards)
+                        to_write = [step] + self.total_rewards.tolist() + [test_rewards_mean, test_rewards_std]
+                        with open(self.test_results_file, "a") as f:
+                            writer = csv.writer(f)
+                            writer.writerow(to_write)
+
+                    experience = self.env_runner.get_steps(1)[0]
+                    self.total_steps += 1
+                    self.replay_buffer.add(experience.state, experience.action, experience.reward,
+                                           experience.next_state, experience.terminal)
+                    if self.experience_logger is not None:
+                        self.experience_logger.add_single(experience.state, experience.action, experience.reward,
+                                                          experience.next_state, experience.terminal)
+                    if self.config["fused_train"] and self.replay_buffer.n_entries > self.config["replay_start_size"]:
+                        with profiling.timer("train"):
+                            self.replay_buffer.sync()
+                            softq_mean, softq_std, softq_target, softq_loss, actor_loss, alpha_loss, \
+                                action_logprob_mean = self.train_fused(tf.constant(self.config["n_train_steps"]))
+                        self.metrics.scalar("model/predicted_softq_mean", softq_mean, self.total_steps)
+                        self.metrics.scalar("model/predicted_softq_std", softq_std, self.total_steps)
+                        self.metrics.scalar("model/softq_targets", softq_target, self.total_steps)
+                        self.metrics.scalar("model/softq_loss", softq_loss, self.total_steps)
+                        self.metrics.scalar("model/actor_loss", actor_loss, self.total_steps)
+                        self.metrics.scalar("model/alpha_loss", alpha_loss, self.total_steps)
+                        self.metrics.scalar("model/alpha", self._alpha, self.total_steps)
+                        self.metrics.scalar("model/action_logprob_mean", action_logprob_mean, self.total_steps)
+                        self.n_updates += 1
+                    elif self.replay_buffer.n_entries > self.config["replay_start_size"]:
+                        for i in range(self.config["n_train_steps"]):
+                            with profiling.timer("replay_sample"):
+                                sample = self.replay_buffer.get_batch(self.config["batch_size"])
+                            with profiling.timer("train"):
+                                softq_mean, softq_std, softq_targets, softq_loss, actor_loss, alpha_loss, action_logprob_mean, \
+                                    td_errors = self.train(
+                                        sample["states0"],
+                                        np.resize(sample["actions"], [self.config["batch_size"],
+                                                                      self.n_actions]),  # for n_actions == 1
+                                        sample["rewards"],
+                                        sample["states1"],
+                                        sample["terminals1"],
+                                        sample.get("weights", uniform_weights))
+                            if self.config["prioritized_replay"]:
+                                self.replay_buffer.update_priorities(sample["indices"], td_errors.numpy())
+                                self.replay_buffer.beta = beta_start + (1.0 - beta_start) * step / self.config["max_steps"]
+                            softq_means[i] = softq_mean
+                            softq_stds[i] = softq_std
+                            softq_losses[i] = softq_loss
+                            actor_losses[i] = actor_loss
+                            alpha_losses[i] = alpha_loss
+                            action_logprob_means[i] = action_logprob_mean
+                        self.metrics.scalar("model/predicted_softq_mean", np.mean(softq_means), self.total_steps)
+                        self.metrics.scalar("model/predicted_softq_std", np.mean(softq_stds), self.total_steps)
+                        self.metrics.scalar("model/softq_targets", np.mean(softq_targets), self.total_steps)
+                        self.metrics.scalar("model/softq_loss", np.mean(softq_losses), self.total_steps)
+                        self.metrics.scalar("model/actor_loss", np.mean(actor_losses), self.total_steps)
+                        self.metrics.scalar("model/alpha_loss", np.mean(alpha_losses), self.total_steps)
+                        self.metrics.scalar("model/alpha", self._alpha, self.total_steps)
+                        self.metrics.scalar("model/action_logprob_mean", np.mean(action_logprob_means), self.total_steps)
+                        # Update the target networks
+                        with profiling.timer("target_update"):
+                            self.target_updater.soft_update(self.config["tau"])
+                        self.n_updates += 1
+                    if experience.terminal:
+                        total_episodes += 1
+                        if self.config["checkpoints"] and (total_episodes % self.checkpoint_every_episodes) == 0:
+                            with profiling.timer("checkpoint"):
+                                self.cktp_manager.save()
+        finally:
+            self.metrics.close()
+            if self.experience_logger is not None:
+                self.experience_logger.close()
         if self.config["save_model"]:
             tf.saved_model.save(self.actor_network, str(self.monitor_path / "model.h5"))
 
@@ -0,0 +1,8 @@
+# -*- coding: utf8 -*-
+
+"""
+Throughput benchmarks of the environments, the environment runner, the replay memory,
+the learners and whole experiments.
+Run them using `python -m yarll.benchmarks run --output results.json`
+and compare two runs using `python -m yarll.benchmarks compare old.json new.json`.
+"""
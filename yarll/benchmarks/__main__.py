@@ -0,0 +1,6 @@
+# -*- coding: utf8 -*-
+
+from yarll.benchmarks.cli import main
+
+if __name__ == '__main__':
+    main()
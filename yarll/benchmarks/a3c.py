@@ -0,0 +1,41 @@
+# -*- coding: utf8 -*-
+
+"""
+Steps per second of A3C with the distributed backend (TensorFlow cluster with a parameter server)
+and the shared memory backend (Hogwild! worker processes), on the same experiment specifications.
+"""
+
+from copy import deepcopy
+from pathlib import Path
+import traceback
+from typing import List, Optional, Sequence
+
+from yarll.benchmarks.end_to_end import SPECS_DIRECTORY, spec_steps
+from yarll.misc.utils import json_to_dict
+
+DEFAULT_SPECS = ["CartPole-v0-A3C-experiment.json", "Pendulum-A3C-experiment.json"]
+BACKENDS = ["distributed", "shared_memory"]
+
+def backend_steps(spec_file: Path, backend: str, n_steps: int) -> dict:
+    spec = deepcopy(json_to_dict(spec_file))
+    spec["agent"]["args"]["backend"] = backend
+    res = spec_steps(spec, f"{spec_file.stem}/{backend}", n_steps)
+    res["benchmark"] = "a3c"
+    if res["n"] == 0:
+        # The distributed backend doesn't report it when its workers fail
+        raise RuntimeError("No environment steps were taken, see the output of the workers.")
+    return res
+
+def run(n_steps: int = 20000,
+        specs: Optional[Sequence[str]] = None,
+        backends: Sequence[str] = BACKENDS) -> List[dict]:
+    results = []
+    spec_files = [Path(s) for s in specs] if specs is not None else [SPECS_DIRECTORY / s for s in DEFAULT_SPECS]
+    for spec_file in spec_files:
+        for backend in backends:
+            try:
+                results.append(backend_steps(spec_file, backend, n_steps))
+            except Exception as e:
+                traceback.print_exc()
+                results.append(dict(benchmark="a3c", variant=f"{spec_file.stem}/{backend}", env=None, error=repr(e)))
+    return results
@@ -0,0 +1,156 @@
+# -*- coding: utf8 -*-
+
+"""
+Command line interface of the benchmarks.
+`run` writes the results and information about the machine and software to a JSON file,
+`compare` prints the ratio between the rates of two such files.
+`record` and `replay` measure the throughput of a learner on rollouts that were recorded beforehand.
+"""
+
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+from typing import Dict, List
+
+from yarll.benchmarks.a3c import BACKENDS as A3C_BACKENDS
+from yarll.benchmarks.common import DEFAULT_AGENTS, DEFAULT_ENVS, result_id
+
+SUITES = ["imports", "environment", "memory", "learner", "end_to_end", "a3c"]
+
+def environment_info() -> dict:
+    """Information about the machine and versions of the packages that influence the results."""
+    import gym
+    import numpy as np
+    import tensorflow as tf
+    return {
+        "time": datetime.datetime.now().astimezone().isoformat(),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "tensorflow": tf.__version__,
+        "gym": gym.__version__
+    }
+
+def run(args) -> None:
+    from yarll.benchmarks import a3c, end_to_end, environment, imports, learner, memory
+    results: List[dict] = []
+    for suite in args.suites:
+        print(f"Running the {suite} benchmarks")
+        if suite == "imports":
+            results.extend(imports.run(n_repeats=args.n_import_repeats))
+        elif suite == "environment":
+            results.extend(environment.run(args.envs, args.agents, n_steps=args.n_steps, n_policy_steps=args.n_policy_steps))
+        elif suite == "memory":
+            results.extend(memory.run(args.envs, n_inserts=args.n_inserts, n_batches=args.n_batches))
+        elif suite == "learner":
+            results.extend(learner.run(args.envs, args.agents, n_updates=args.n_updates))
+        elif suite == "end_to_end":
+            results.extend(end_to_end.run(args.agents, n_steps=args.end_to_end_steps, specs=args.specs))
+        elif suite == "a3c":
+            results.extend(a3c.run(n_steps=args.a3c_steps, specs=args.a3c_specs, backends=args.a3c_backends))
+    for res in results:
+        if "rate" in res:
+            print(f"{result_id(res)}: {res['rate']:.1f} {res['unit']}")
+        else:
+            print(f"{result_id(res)}: {res['error']}")
+    with open(args.output, "w") as f:
+        arguments = {k: v for k, v in vars(args).items() if k != "func"}
+        json.dump({"info": environment_info(), "arguments": arguments, "results": results}, f, indent=4)
+    print(f"Results written to {args.output}")
+
+def record(args) -> None:
+    from yarll.benchmarks import replay
+    replay.record(args.env, args.policy, args.n_steps, args.output)
+    print(f"Rollouts written to {args.output}")
+
+def replay(args) -> None:
+    from yarll.benchmarks import replay as replay_benchmark
+    results = []
+    for agent_name in args.agents:
+        profile_file = args.profile
+        if profile_file is not None and len(args.agents) > 1:
+            profile_file = Path(profile_file).with_name(f"{Path(profile_file).stem}_{agent_name}.json")
+        res = replay_benchmark.replay(args.rollouts, agent_name, args.n_iterations, profile_file=profile_file)
+        print(f"{result_id(res)}: {res['rate']:.1f} {res['unit']}")
+        results.append(res)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            arguments = {k: v for k, v in vars(args).items() if k != "func"}
+            json.dump({"info": environment_info(), "arguments": arguments, "results": results}, f, indent=4)
+        print(f"Results written to {args.output}")
+
+def compare(args) -> None:
+    rates: List[Dict[str, dict]] = []
+    for filename in [args.baseline, args.new]:
+        with open(filename) as f:
+            rates.append({result_id(res): res for res in json.load(f)["results"] if "rate" in res})
+    baseline, new = rates
+    for name in sorted(set(baseline) | set(new)):
+        if name not in baseline or name not in new:
+            print(f"{name}: only in {args.baseline if name in baseline else args.new}")
+            continue
+        ratio = new[name]["rate"] / baseline[name]["rate"]
+        print(f"{name}: {baseline[name]['rate']:.1f} -> {new[name]['rate']:.1f} {new[name]['unit']} ({ratio:.2f}x)")
+
+parser = argparse.ArgumentParser(description="Throughput benchmarks of yarll.")
+subparsers = parser.add_subparsers(dest="command")
+subparsers.required = True
+
+run_parser = subparsers.add_parser("run", help="Run benchmarks and write the results to a JSON file.")
+run_parser.add_argument("--output", type=str, default="benchmarks.json", help="File to write the results to.")
+run_parser.add_argument("--suites", type=str, nargs="+", choices=SUITES, default=SUITES, help="Benchmarks to run.")
+run_parser.add_argument("--envs", type=str, nargs="+", default=DEFAULT_ENVS, help="Environments to use.")
+run_parser.add_argument("--agents", type=str, nargs="+", default=DEFAULT_AGENTS, help="Agents to use.")
+run_parser.add_argument("--n_import_repeats", type=int, default=3, help="New interpreters to import each module in.")
+run_parser.add_argument("--n_steps", type=int, default=10000, help="Environment steps without an agent.")
+run_parser.add_argument("--n_policy_steps", type=int, default=1000,
+                        help="Environment steps when actions are chosen by an agent.")
+run_parser.add_argument("--n_inserts", type=int, default=100000, help="Experiences to add to a memory.")
+run_parser.add_argument("--n_batches", type=int, default=1000, help="Batches to sample from a memory.")
+run_parser.add_argument("--n_updates", type=int, default=200, help="Updates of a learner.")
+run_parser.add_argument("--end_to_end_steps", type=int, default=2048, help="Environment steps of an experiment.")
+run_parser.add_argument("--specs", type=str, nargs="+", default=None,
+                        help="Experiment specifications to run (default: those in experiment_specs/ of the agents).")
+run_parser.add_argument("--a3c_steps", type=int, default=20000, help="Environment steps of an A3C experiment.")
+run_parser.add_argument("--a3c_specs", type=str, nargs="+", default=None,
+                        help="A3C experiment specifications to run (default: those of CartPole-v0 and Pendulum-v0).")
+run_parser.add_argument("--a3c_backends", type=str, nargs="+", choices=A3C_BACKENDS, default=A3C_BACKENDS,
+                        help="A3C backends to compare.")
+run_parser.set_defaults(func=run)
+
+record_parser = subparsers.add_parser("record", help="Record rollouts to replay into learners.")
+record_parser.add_argument("env", type=str, help="Environment to record.")
+record_parser.add_argument("output", type=str, help="File to write the rollouts to (.npz).")
+record_parser.add_argument("--policy", type=str, default="random",
+                           help="Agent that chooses the actions, or random for uniformly random actions.")
+record_parser.add_argument("--n_steps", type=int, default=10000, help="Environment steps to record.")
+record_parser.set_defaults(func=record)
+
+replay_parser = subparsers.add_parser("replay", help="Measure the updates per second of learners on recorded rollouts.")
+replay_parser.add_argument("rollouts", type=str, help="File with rollouts written by the record command.")
+replay_parser.add_argument("--agents", type=str, nargs="+", default=DEFAULT_AGENTS, help="Agents to use.")
+replay_parser.add_argument("--n_iterations", type=int, default=20,
+                           help="Iterations of the learners (an iteration of DQN and SAC does n_train_steps updates).")
+replay_parser.add_argument("--profile", type=str, default=None,
+                           help="File to write the time spent in each phase of the updates to "
+                                "(with the name of the agent appended if there are several).")
+replay_parser.add_argument("--output", type=str, default=None, help="File to write the results to.")
+replay_parser.set_defaults(func=replay)
+
+compare_parser = subparsers.add_parser("compare", help="Compare the results of two runs.")
+compare_parser.add_argument("baseline", type=str, help="Results to compare against.")
+compare_parser.add_argument("new", type=str, help="New results.")
+compare_parser.set_defaults(func=compare)
+
+def main():
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf8 -*-
+
+"""
+Helpers shared by the benchmarks.
+Every benchmark returns a list of results: dictionaries with the name of the benchmark,
+the variant that was measured, the environment, the rate and its unit.
+"""
+
+from pathlib import Path
+import time
+from typing import Callable, Dict, Optional, Union
+
+# Environments every benchmark is run on: a discrete and a continuous control task and a tabular one
+DEFAULT_ENVS = ["CartPole-v0", "Pendulum-v0", "FrozenLake8x8-v0"]
+# Agents of which the learner and the action selection are measured
+DEFAULT_AGENTS = ["PPO", "A2C", "DQN", "SAC"]
+
+def result(benchmark: str, variant: str, env_id: Optional[str], n: int, seconds: float, unit: str, **extra) -> dict:
+    """Result of a benchmark that did n operations in the given number of seconds."""
+    return dict(benchmark=benchmark,
+                variant=variant,
+                env=env_id,
+                n=n,
+                seconds=seconds,
+                rate=n / seconds if seconds > 0 else float("inf"),
+                unit=unit,
+                **extra)
+
+def result_id(res: dict) -> str:
+    """Identifier of a result that stays the same between runs."""
+    return "/".join(str(part) for part in (res["benchmark"], res["variant"], res["env"]) if part is not None)
+
+def timed(fn: Callable[[], None], n_calls: int, n_warmup: int = 1) -> float:
+    """Seconds taken by n_calls calls of fn, after n_warmup calls that aren't measured (e.g. to trace tf.functions)."""
+    for _ in range(n_warmup):
+        fn()
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        fn()
+    return time.perf_counter() - start
+
+def make_env(env_id: str):
+    import yarll.environment  # Registers the environments of yarll  # pylint: disable=unused-import
+    from yarll.environment.registration import make
+    return make(env_id)
+
+def agent_supports(agent_name: str, env) -> bool:
+    """Whether an agent can be used for the spaces of an environment."""
+    from yarll.agents.registration import agent_registry
+    from yarll.misc.utils import spaces_mapping
+    action_space = spaces_mapping.get(type(env.action_space), None)
+    state_dimensions = spaces_mapping.get(type(env.observation_space), None)
+    return any(variant["action_space"] == action_space and variant["state_dimensions"] == state_dimensions
+               and not variant["RNN"] for variant in agent_registry.get(agent_name, []))
+
+def make_benchmark_agent(agent_name: str, env, monitor_path: Union[Path, str], **args):
+    """Make an agent for an environment that doesn't write logs, experiences or checkpoints."""
+    from yarll.agents.registration import make_agent
+    from yarll.misc.utils import spaces_mapping
+    config: Dict = dict(log_experiences=False, checkpoints=False, summaries=False, video=False)
+    config.update(args)
+    return make_agent(agent_name,
+                      spaces_mapping.get(type(env.observation_space), None),
+                      spaces_mapping.get(type(env.action_space), None),
+                      env=env,
+                      monitor_path=monitor_path,
+                      **config)
+
+def close_benchmark_agent(agent) -> None:
+    """Stop the summary writer thread of an agent and close its environment (e.g. a monitor writing to monitor_path)."""
+    agent.metrics.close()
+    agent.env.close()
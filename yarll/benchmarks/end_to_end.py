@@ -0,0 +1,67 @@
+# -*- coding: utf8 -*-
+
+"""Steps per second of whole experiments, using the specifications in experiment_specs/ with a limited number of steps."""
+
+from copy import deepcopy
+from pathlib import Path
+import json
+import tempfile
+import traceback
+from typing import List, Optional, Sequence
+
+from yarll.benchmarks.common import DEFAULT_AGENTS, result
+from yarll.misc.utils import json_to_dict
+
+SPECS_DIRECTORY = Path(__file__).parent / "../../experiment_specs"
+
+def limit_steps(spec: dict, n_steps: int) -> dict:
+    """Copy of an experiment specification that stops after about n_steps environment steps."""
+    spec = deepcopy(spec)
+    args = spec["agent"]["args"]
+    if spec["agent"]["name"] == "A2C":
+        # A2C runs for a number of iterations of n_local_steps (20 by default) steps in each environment
+        args["n_iter"] = max(1, n_steps // (int(args.get("n_local_steps", 20)) * int(args.get("n_envs", 1))))
+    elif spec["agent"]["name"] == "A3C":
+        args["T_max"] = n_steps  # Summed over all workers
+    else:
+        args["max_steps"] = n_steps
+    return spec
+
+def experiment_steps(spec_file: Path, n_steps: int) -> dict:
+    """Steps per second of an experiment, as measured by the profiler."""
+    return spec_steps(json_to_dict(spec_file), spec_file.stem, n_steps)
+
+def spec_steps(spec: dict, variant: str, n_steps: int) -> dict:
+    """Steps per second of an experiment given as a specification dictionary."""
+    from yarll.main import run_experiment
+    spec = limit_steps(spec, n_steps)
+    spec["profiling"] = True
+    with tempfile.TemporaryDirectory() as monitor_path:
+        run_experiment(spec, monitor_path=monitor_path, seed=0)
+        with open(Path(monitor_path) / "profile.json") as f:
+            profile = json.load(f)
+    steps = profile["counters"].get("env_steps", 0)
+    # The specification identifies the experiment, so the environment isn't part of the identifier of the result
+    return result("end_to_end", variant, None, steps, profile["wall_time"], "steps/s",
+                  agent=spec["agent"]["name"], environment=spec["environments"]["source"])
+
+def spec_files(agents: Sequence[str], directory: Path = SPECS_DIRECTORY) -> List[Path]:
+    """Experiment specifications of single environments that use one of the agents."""
+    files = []
+    for spec_file in sorted(directory.resolve().glob("*.json")):
+        spec = json_to_dict(spec_file)
+        if spec.get("agent", {}).get("name") in agents and spec.get("environments", {}).get("type") == "single":
+            files.append(spec_file)
+    return files
+
+def run(agents: Sequence[str] = DEFAULT_AGENTS,
+        n_steps: int = 2048,
+        specs: Optional[Sequence[str]] = None) -> List[dict]:
+    results = []
+    for spec_file in ([Path(s) for s in specs] if specs is not None else spec_files(agents)):
+        try:
+            results.append(experiment_steps(spec_file, n_steps))
+        except Exception as e:  # E.g. an environment of which the dependencies aren't installed
+            traceback.print_exc()
+            results.append(dict(benchmark="end_to_end", variant=spec_file.stem, env=None, error=repr(e)))
+    return results
@@ -0,0 +1,71 @@
+# -*- coding: utf8 -*-
+
+"""Steps per second of the environments on their own and inside an `EnvRunner`."""
+
+import tempfile
+import time
+from typing import List, Sequence
+
+from yarll.benchmarks.common import DEFAULT_AGENTS, DEFAULT_ENVS, agent_supports, close_benchmark_agent, \
+    make_benchmark_agent, make_env, result
+
+class RandomPolicy(object):
+    """Policy that chooses uniformly random actions, for measuring the overhead of the runner itself."""
+
+    def __init__(self, action_space) -> None:
+        super(RandomPolicy, self).__init__()
+        self.action_space = action_space
+        self.initial_features = None
+
+    def choose_action(self, state, features) -> dict:
+        return {"action": self.action_space.sample()}
+
+    def get_env_action(self, action):
+        return action
+
+    def new_trajectory(self) -> None:
+        return
+
+def env_steps(env_id: str, n_steps: int) -> dict:
+    """Steps per second of an environment with random actions that are sampled beforehand."""
+    env = make_env(env_id)
+    actions = [env.action_space.sample() for _ in range(n_steps)]
+    env.reset()
+    start = time.perf_counter()
+    for action in actions:
+        _, _, done, _ = env.step(action)
+        if done:
+            env.reset()
+    return result("env_steps", "random_actions", env_id, n_steps, time.perf_counter() - start, "steps/s")
+
+def env_runner_steps(env_id: str, policy_name: str, n_steps: int) -> dict:
+    """Steps per second of an `EnvRunner` using a random policy or the action selection of an agent."""
+    from yarll.agents.env_runner import EnvRunner
+    env = make_env(env_id)
+    with tempfile.TemporaryDirectory() as monitor_path:
+        if policy_name == "random":
+            policy = RandomPolicy(env.action_space)
+        else:
+            policy = make_benchmark_agent(policy_name, env, monitor_path)
+        runner = EnvRunner(env, policy, {}, summaries=False)
+        runner.get_steps(10, stop_at_trajectory_end=False)  # Warm up (e.g. tracing of the networks)
+        start = time.perf_counter()
+        runner.get_steps(n_steps, stop_at_trajectory_end=False)
+        seconds = time.perf_counter() - start
+        if policy_name != "random":
+            close_benchmark_agent(policy)
+    return result("env_runner", policy_name, env_id, n_steps, seconds, "steps/s")
+
+def run(env_ids: Sequence[str] = DEFAULT_ENVS,
+        agents: Sequence[str] = DEFAULT_AGENTS,
+        n_steps: int = 10000,
+        n_policy_steps: int = 1000) -> List[dict]:
+    results = []
+    for env_id in env_ids:
+        results.append(env_steps(env_id, n_steps))
+        results.append(env_runner_steps(env_id, "random", n_steps))
+        env = make_env(env_id)
+        for agent_name in agents:
+            if agent_supports(agent_name, env):
+                results.append(env_runner_steps(env_id, agent_name, n_policy_steps))
+    return results
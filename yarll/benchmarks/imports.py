@@ -0,0 +1,49 @@
+# -*- coding: utf8 -*-
+
+"""
+Time needed to import modules of yarll in a new interpreter, as paid by every worker process or script.
+Besides the time, the heavy dependencies that were imported along with each module are recorded.
+"""
+
+import json
+import subprocess
+import sys
+from typing import List, Sequence
+
+from yarll.benchmarks.common import result
+
+DEFAULT_MODULES = [
+    "yarll.environment.registration",
+    "yarll.environment.env_pool",
+    "yarll.memory.memory",
+    "yarll.misc.scalers",
+    "yarll.misc.advantages",
+    "yarll.misc.utils",
+    "yarll.agents.registration",
+    "yarll.main",
+    "yarll.agents.ppo.ppo",
+    "yarll.agents.sac"
+]
+HEAVY_DEPENDENCIES = ["tensorflow", "tensorflow_addons", "tensorflow_probability", "scipy", "gym"]
+
+_MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "imported": [m for m in {dependencies!r} if m in sys.modules]}}))
+"""
+
+def import_time(module: str, n_repeats: int) -> dict:
+    """Seconds to import a module, summed over n_repeats new interpreters."""
+    total = 0.0
+    for _ in range(n_repeats):
+        output = subprocess.check_output([sys.executable, "-c", _MEASURE.format(module=module, dependencies=HEAVY_DEPENDENCIES)],
+                                         stderr=subprocess.DEVNULL)
+        measurement = json.loads(output.decode().strip().splitlines()[-1])
+        total += measurement["seconds"]
+    return result("import", module, None, n_repeats, total, "imports/s",
+                  mean_seconds=total / n_repeats, imported=measurement["imported"])
+
+def run(modules: Sequence[str] = DEFAULT_MODULES, n_repeats: int = 3) -> List[dict]:
+    return [import_time(module, n_repeats) for module in modules]
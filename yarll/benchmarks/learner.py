@@ -0,0 +1,73 @@
+# -*- coding: utf8 -*-
+
+"""Updates per second of the `train` function of the agents, on random batches of the size they use."""
+
+import tempfile
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import gym
+import numpy as np
+
+from yarll.benchmarks.common import DEFAULT_AGENTS, DEFAULT_ENVS, agent_supports, close_benchmark_agent, \
+    make_benchmark_agent, make_env, result, timed
+
+def random_batch(env, batch_size: int) -> Dict[str, np.ndarray]:
+    """Batch of experiences with states and actions sampled from the spaces of the environment."""
+    actions = np.asarray([env.action_space.sample() for _ in range(batch_size)])
+    return {
+        "states0": np.asarray([env.observation_space.sample() for _ in range(batch_size)], np.float32),
+        "actions": actions.astype(np.int32 if isinstance(env.action_space, gym.spaces.Discrete) else np.float32),
+        "rewards": np.random.standard_normal(batch_size).astype(np.float32),
+        "states1": np.asarray([env.observation_space.sample() for _ in range(batch_size)], np.float32),
+        "terminals1": (np.random.uniform(size=batch_size) < 0.01).astype(np.float32),
+        "advantages": np.random.standard_normal(batch_size).astype(np.float32),
+        "returns": np.random.standard_normal(batch_size).astype(np.float32),
+        "log_probs": np.full(batch_size, -1.0, np.float32),
+        "weights": np.ones(batch_size, np.float32)
+    }
+
+def _ppo(agent, env) -> Tuple[Callable, int]:
+    batch_size = int(agent.config["batch_size"])
+    b = random_batch(env, batch_size)
+    return lambda: agent.train(b["states0"], b["actions"], b["advantages"], b["returns"], b["log_probs"]), batch_size
+
+def _a2c(agent, env) -> Tuple[Callable, int]:
+    batch_size = int(agent.config["n_local_steps"]) * int(agent.config["n_envs"])
+    b = random_batch(env, batch_size)
+    return lambda: agent.train(b["states0"], b["actions"], b["advantages"], b["returns"]), batch_size
+
+def _q_learning(agent, env) -> Tuple[Callable, int]:
+    batch_size = int(agent.config["batch_size"])
+    b = random_batch(env, batch_size)
+    if isinstance(env.action_space, gym.spaces.Box):
+        b["actions"] = b["actions"].reshape(batch_size, -1)
+    return lambda: agent.train(b["states0"], b["actions"], b["rewards"], b["states1"], b["terminals1"],
+                               b["weights"]), batch_size
+
+# Function that returns the update to measure and its batch size, per agent
+UPDATES: Dict[str, Callable] = {
+    "PPO": _ppo,
+    "A2C": _a2c,
+    "DQN": _q_learning,
+    "SAC": _q_learning
+}
+
+def learner_updates(agent_name: str, env_id: str, n_updates: int) -> dict:
+    env = make_env(env_id)
+    with tempfile.TemporaryDirectory() as monitor_path:
+        agent = make_benchmark_agent(agent_name, env, monitor_path)
+        update, batch_size = UPDATES[agent_name](agent, env)
+        seconds = timed(update, n_updates, n_warmup=2)
+        close_benchmark_agent(agent)
+    return result("learner", agent_name, env_id, n_updates, seconds, "updates/s", batch_size=batch_size)
+
+def run(env_ids: Sequence[str] = DEFAULT_ENVS,
+        agents: Sequence[str] = DEFAULT_AGENTS,
+        n_updates: int = 200) -> List[dict]:
+    results = []
+    for env_id in env_ids:
+        env = make_env(env_id)
+        for agent_name in agents:
+            if agent_name in UPDATES and agent_supports(agent_name, env):
+                results.append(learner_updates(agent_name, env_id, n_updates))
+    return results
@@ -0,0 +1,41 @@
+# -*- coding: utf8 -*-
+
+"""Insert and sample throughput of the replay memories."""
+
+import time
+from typing import List, Sequence
+
+import numpy as np
+
+from yarll.benchmarks.common import DEFAULT_ENVS, make_env, result, timed
+
+def memory_throughput(memory_class, env_id: str, n_inserts: int, n_batches: int, batch_size: int) -> List[dict]:
+    """Experiences inserted per second and batches sampled per second, using states of an environment."""
+    env = make_env(env_id)
+    states = np.asarray([env.observation_space.sample() for _ in range(n_inserts + 1)], np.float32)
+    actions = [env.action_space.sample() for _ in range(n_inserts)]
+    rewards = np.random.standard_normal(n_inserts)
+    terminals = np.random.uniform(size=n_inserts) < 0.01
+    memory = memory_class(n_inserts)
+    start = time.perf_counter()
+    for i in range(n_inserts):
+        memory.add(states[i], actions[i], rewards[i], states[i + 1], terminals[i])
+    insert_seconds = time.perf_counter() - start
+    sample_seconds = timed(lambda: memory.get_batch(batch_size), n_batches)
+    variant = memory_class.__name__
+    return [
+        result("memory_insert", variant, env_id, n_inserts, insert_seconds, "experiences/s"),
+        result("memory_sample", variant, env_id, n_batches, sample_seconds, "batches/s", batch_size=batch_size)
+    ]
+
+def run(env_ids: Sequence[str] = DEFAULT_ENVS,
+        n_inserts: int = 100000,
+        n_batches: int = 1000,
+        batch_size: int = 256) -> List[dict]:
+    from yarll.memory.memory import Memory
+    from yarll.memory.ring_buffer_memory import RingBufferMemory
+    results = []
+    for env_id in env_ids:
+        for memory_class in [Memory, RingBufferMemory]:
+            results.extend(memory_throughput(memory_class, env_id, n_inserts, n_batches, batch_size))
+    return results
@@ -0,0 +1,157 @@
+# -*- coding: utf8 -*-
+
+"""
+Throughput of the learners on recorded rollouts, without stepping any environment.
+Rollouts are recorded once with `record` into a single uncompressed .npz file
+(float32 states, values and log-probabilities, uint8 terminals),
+after which `replay` feeds them to the update of an agent as fast as it can process them.
+"""
+
+from pathlib import Path
+import tempfile
+import time
+from typing import Callable, Dict, Optional, Union
+
+import numpy as np
+
+from yarll.benchmarks.common import close_benchmark_agent, make_benchmark_agent, make_env, result
+from yarll.benchmarks.environment import RandomPolicy
+from yarll.misc import profiling
+from yarll.misc.advantages import generalized_advantage_estimation
+
+def record(env_id: str, policy_name: str, n_steps: int, filename: Union[Path, str], **agent_args) -> None:
+    """
+    Record n_steps steps of an environment, with actions chosen by the given agent or randomly (policy_name "random").
+    Values and log-probabilities are NaN if the policy doesn't provide them.
+    """
+    from yarll.agents.env_runner import EnvRunner
+    env = make_env(env_id)
+    with tempfile.TemporaryDirectory() as monitor_path:
+        policy = RandomPolicy(env.action_space) if policy_name == "random" \
+            else make_benchmark_agent(policy_name, env, monitor_path, **agent_args)
+        runner = EnvRunner(env, policy, {}, summaries=False)
+        trajectory = runner.get_steps(n_steps, stop_at_trajectory_end=False)
+        if policy_name != "random":
+            close_benchmark_agent(policy)
+
+    def optional(values):
+        return np.asarray([np.nan if v is None else v for v in values], np.float32)
+    np.savez(filename,
+             states=np.asarray(trajectory.states, np.float32),
+             actions=np.asarray(trajectory.actions),
+             rewards=np.asarray(trajectory.rewards, np.float32),
+             next_states=np.asarray(trajectory.next_states, np.float32),
+             terminals=np.asarray(trajectory.terminals, np.uint8),
+             values=optional(trajectory.values),
+             log_probs=optional(trajectory.log_probs),
+             env_id=np.array(env_id),
+             policy=np.array(policy_name))
+
+def load_rollouts(filename: Union[Path, str]) -> Dict[str, np.ndarray]:
+    """Load rollouts written by `record`."""
+    with np.load(filename) as data:
+        rollouts = {name: data[name] for name in data.files}
+    rollouts["env_id"] = str(rollouts["env_id"])
+    rollouts["policy"] = str(rollouts["policy"])
+    return rollouts
+
+def _ppo(agent, rollouts: dict, n_iterations: int) -> int:
+    """PPO iterations of n_local_steps on consecutive parts of the rollouts. Missing values and log-probs are 0."""
+    values = np.nan_to_num(rollouts["values"])
+    advantages, returns = generalized_advantage_estimation(rollouts["rewards"], values, rollouts["terminals"],
+                                                           0.0, agent.config["gamma"], agent.config["gae_lambda"])
+    log_probs = np.nan_to_num(rollouts["log_probs"])
+    n_local_steps = int(agent.config["n_local_steps"])
+    n_parts = len(values) // n_local_steps
+    if n_parts == 0:
+        raise ValueError(f"At least n_local_steps ({n_local_steps}) steps are needed to replay into PPO.")
+    n_updates_start = agent.n_updates
+    for iteration in range(n_iterations):
+        part = slice((iteration % n_parts) * n_local_steps, (iteration % n_parts + 1) * n_local_steps)
+        agent.update(rollouts["states"][part], rollouts["actions"][part], advantages[part], returns[part],
+                     values[part], log_probs[part], (iteration + 1) * n_local_steps)
+    return agent.n_updates - n_updates_start
+
+def _a2c(agent, rollouts: dict, n_iterations: int) -> int:
+    """A2C updates on consecutive parts of n_local_steps of the rollouts. Missing values are 0."""
+    values = np.nan_to_num(rollouts["values"])
+    advantages, returns = generalized_advantage_estimation(rollouts["rewards"], values, rollouts["terminals"],
+                                                           0.0, agent.config["gamma"], 1.0)
+    n_local_steps = int(agent.config["n_local_steps"])
+    n_parts = len(values) // n_local_steps
+    if n_parts == 0:
+        raise ValueError(f"At least n_local_steps ({n_local_steps}) steps are needed to replay into A2C.")
+    for iteration in range(n_iterations):
+        part = slice((iteration % n_parts) * n_local_steps, (iteration % n_parts + 1) * n_local_steps)
+        with profiling.timer("train"):
+            agent.train(rollouts["states"][part], rollouts["actions"][part], advantages[part], returns[part])
+    return n_iterations
+
+def _q_learning(agent, rollouts: dict, n_iterations: int) -> int:
+    """
+    DQN or SAC iterations of sampling from the replay memory, training and updating the target networks.
+    The replay memory is filled with the rollouts the first time.
+    """
+    import tensorflow as tf
+    batch_size = int(agent.config["batch_size"])
+    uniform_weights = np.ones((batch_size,), np.float32)
+    actions = rollouts["actions"]
+    actions = actions.astype(np.int32) if actions.ndim == 1 else actions.astype(np.float32)
+    if agent.replay_buffer.n_entries == 0:
+        for i in range(len(actions)):
+            agent.replay_buffer.add(rollouts["states"][i], actions[i], rollouts["rewards"][i],
+                                    rollouts["next_states"][i], rollouts["terminals"][i])
+    if agent.config.get("fused_train", False):
+        agent.replay_buffer.sync()
+        for _ in range(n_iterations):
+            with profiling.timer("train"):
+                agent.train_fused(tf.constant(int(agent.config["n_train_steps"])))
+        return n_iterations * int(agent.config["n_train_steps"])
+    for _ in range(n_iterations):
+        for _ in range(int(agent.config["n_train_steps"])):
+            with profiling.timer("replay_sample"):
+                sample = agent.replay_buffer.get_batch(batch_size)
+            with profiling.timer("train"):
+                agent.train(sample["states0"],
+                            sample["actions"].astype(actions.dtype).reshape(batch_size, *actions.shape[1:]),
+                            sample["rewards"],
+                            sample["states1"],
+                            sample["terminals1"],
+                            sample.get("weights", uniform_weights))
+        with profiling.timer("target_update"):
+            agent.target_updater.soft_update(agent.config["tau"])
+    return n_iterations * int(agent.config["n_train_steps"])
+
+# Function that replays the rollouts into an agent for a number of iterations and returns the number of updates
+REPLAYS: Dict[str, Callable] = {
+    "PPO": _ppo,
+    "A2C": _a2c,
+    "DQN": _q_learning,
+    "SAC": _q_learning
+}
+
+def replay(filename: Union[Path, str],
+           agent_name: str,
+           n_iterations: int,
+           profile_file: Optional[Union[Path, str]] = None,
+           **agent_args) -> dict:
+    """
+    Updates per second of an agent on recorded rollouts.
+    The environment is only made to know the spaces it uses; it is never stepped.
+    If profile_file is given, the time spent in each phase of the updates is written to it.
+    """
+    rollouts = load_rollouts(filename)
+    env = make_env(rollouts["env_id"])
+    with tempfile.TemporaryDirectory() as monitor_path:
+        agent = make_benchmark_agent(agent_name, env, monitor_path, **agent_args)
+        REPLAYS[agent_name](agent, rollouts, 1)  # Warm up (tracing)
+        profiler = profiling.enable() if profile_file is not None else None
+        start = time.perf_counter()
+        n_updates = REPLAYS[agent_name](agent, rollouts, n_iterations)
+        seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiling.disable()
+            profiler.save(profile_file)
+        close_benchmark_agent(agent)
+    return result("replay", agent_name, rollouts["env_id"], n_updates, seconds, "updates/s",
+                  n_iterations=n_iterations, n_recorded_steps=len(rollouts["rewards"]), policy=rollouts["policy"])
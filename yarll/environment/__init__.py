@@ -41,7 +41,8 @@ register_env(
 register_env(
     "FrozenLake8x8-v0",
     entry_point="yarll.environment.environment:Environment",
+    max_episode_steps=200,
     tags={
-        "wrappers": ["environment.wrappers:DiscreteObservationWrapper"]
+        "wrapper_entry_points": ["yarll.environment.wrappers:DiscreteObservationWrapper"]
     }
 )
@@ -0,0 +1,189 @@
+# -*- coding: utf8 -*-
+
+"""
+Pools of environment copies that are stepped together.
+`SerialEnvPool` steps the environments one after the other in the current process,
+`SubprocEnvPool` steps them in parallel in worker processes.
+"""
+
+import multiprocessing
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+from yarll.environment.registration import make
+
+
+def make_env_copy(env):
+    """Make a new instance of an environment using the parameters in its description."""
+    return make(**env_parameters(env))
+
+def env_parameters(env) -> dict:
+    """Parameters with which an environment can be made again using `make`."""
+    return dict(env.metadata.get("parameters", {"env_id": env.spec.id}))
+
+
+class SerialEnvPool(object):
+    """Environments that are stepped one after the other in the current process."""
+
+    def __init__(self, envs: list) -> None:
+        super(SerialEnvPool, self).__init__()
+        self.envs = envs
+        self.n_envs = len(envs)
+
+    def reset(self, i: int) -> np.ndarray:
+        """Reset the environment with index i and return its initial state."""
+        return self.envs[i].reset()
+
+    def step(self, actions: Sequence) -> Tuple[list, np.ndarray, np.ndarray, tuple]:
+        """Execute an action in every environment."""
+        results = [env.step(action) for env, action in zip(self.envs, actions)]
+        states, rewards, dones, infos = zip(*results)
+        return list(states), np.asarray(rewards, dtype=np.float64), np.asarray(dones, dtype=bool), infos
+
+    def render(self, i: int = 0) -> None:
+        self.envs[i].render()
+
+    def close(self) -> None:
+        pass
+
+
+def _pool_worker(remote, parent_remote, parameters: List[dict], seeds: List[Optional[int]],
+                 obs_buffer, obs_dtype: np.dtype, obs_shape: tuple, first_index: int) -> None:
+    """
+    Loop of a worker process that owns the environments with indices
+    `first_index` until `first_index + len(parameters)`.
+    Observations are written into the rows of the shared buffer that belong to these environments,
+    only rewards, terminals and infos are sent back through the pipe.
+    """
+    parent_remote.close()
+    envs = [make(**p) for p in parameters]
+    for env, seed in zip(envs, seeds):
+        if seed is not None:
+            env.seed(seed)
+    all_obs = np.frombuffer(obs_buffer, dtype=obs_dtype).reshape((-1, *obs_shape))
+    obs = all_obs[first_index:first_index + len(envs)]
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                results = []
+                for i, (env, action) in enumerate(zip(envs, data)):
+                    state, reward, done, info = env.step(action)
+                    obs[i] = state
+                    results.append((reward, done, info))
+                remote.send(results)
+            elif cmd == "reset":
+                obs[data] = envs[data].reset()
+                remote.send(None)
+            elif cmd == "render":
+                envs[data].render()
+                remote.send(None)
+            elif cmd == "close":
+                break
+            else:
+                raise NotImplementedError(f"Unknown command {cmd}.")
+    except (KeyboardInterrupt, EOFError):  # EOFError: the main process has exited
+        pass
+    finally:
+        for env in envs:
+            env.close()
+        remote.close()
+
+
+class SubprocEnvPool(object):
+    """
+    Environments that are stepped in parallel in worker processes.
+    Each worker owns a contiguous slice of the environments and communicates with this process
+    over a pipe. Observations are not pickled, but written by the workers into a shared memory buffer.
+    """
+
+    def __init__(self,
+                 parameters: List[dict],
+                 observation_space,
+                 seeds: Optional[List[Optional[int]]] = None,
+                 n_workers: Optional[int] = None,
+                 start_method: str = "spawn") -> None:
+        super(SubprocEnvPool, self).__init__()
+        self.n_envs = len(parameters)
+        n_workers = multiprocessing.cpu_count() if n_workers is None else n_workers
+        n_workers = max(1, min(n_workers, self.n_envs))
+        seeds = [None] * self.n_envs if seeds is None else seeds
+
+        self.obs_dtype = np.dtype(observation_space.dtype)
+        self.obs_shape = tuple(observation_space.shape)
+        ctx = multiprocessing.get_context(start_method)
+        n_obs_bytes = self.n_envs * int(np.prod(self.obs_shape)) * self.obs_dtype.itemsize
+        self.obs_buffer = ctx.RawArray("b", n_obs_bytes)
+        self.obs = np.frombuffer(self.obs_buffer, dtype=self.obs_dtype).reshape((self.n_envs, *self.obs_shape))
+
+        # Divide the environments as evenly as possible over the workers
+        bounds = np.linspace(0, self.n_envs, n_workers + 1).astype(int)
+        self.slices = [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+        # Worker index and index within that worker for every environment
+        self.env_locations = [(w, i - s.start) for w, s in enumerate(self.slices) for i in range(s.start, s.stop)]
+        self.remotes = []
+        self.processes = []
+        for s in self.slices:
+            remote, worker_remote = ctx.Pipe()
+            process = ctx.Process(target=_pool_worker,
+                                  args=(worker_remote, remote, parameters[s], seeds[s],
+                                        self.obs_buffer, self.obs_dtype, self.obs_shape, s.start),
+                                  daemon=True)
+            process.start()
+            worker_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+        self.closed = False
+
+    def reset(self, i: int) -> np.ndarray:
+        """Reset the environment with index i and return its initial state."""
+        worker, index = self.env_locations[i]
+        self.remotes[worker].send(("reset", index))
+        self.remotes[worker].recv()
+        return self.obs[i].copy()
+
+    def step(self, actions: Sequence) -> Tuple[np.ndarray, np.ndarray, np.ndarray, tuple]:
+        """Execute an action in every environment."""
+        for remote, s in zip(self.remotes, self.slices):
+            remote.send(("step", actions[s]))
+        results = [result for remote in self.remotes for result in remote.recv()]
+        rewards, dones, infos = zip(*results)
+        return self.obs.copy(), np.asarray(rewards, dtype=np.float64), np.asarray(dones, dtype=bool), infos
+
+    def render(self, i: int = 0) -> None:
+        worker, index = self.env_locations[i]
+        self.remotes[worker].send(("render", index))
+        self.remotes[worker].recv()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(("close", None))
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+
+def make_env_pool(env,
+                  n_envs: int,
+                  backend: str = "serial",
+                  seed: Optional[int] = None,
+                  n_workers: Optional[int] = None):
+    """
+    Make a pool of n_envs copies of an environment.
+    With the serial backend, the given environment is kept as the first one of the pool
+    (e.g. to keep a monitor wrapper around it). With the subprocess backend,
+    all environments are made in the worker processes.
+    """
+    seeds = [None if seed is None else seed + i for i in range(n_envs)]
+    if backend == "serial":
+        envs = [env] + [make_env_copy(env) for _ in range(n_envs - 1)]
+        for env_copy, env_seed in zip(envs[1:], seeds[1:]):
+            if env_seed is not None:
+                env_copy.seed(env_seed)
+        return SerialEnvPool(envs)
+    elif backend == "subprocess":
+        parameters = [env_parameters(env) for _ in range(n_envs)]
+        return SubprocEnvPool(parameters, env.observation_space, seeds=seeds, n_workers=n_workers)
+    raise NotImplementedError(f"Unknown environment pool backend {backend}.")
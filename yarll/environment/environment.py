@@ -1,7 +1,11 @@
 # -*- coding: utf8 -*-
 
+import gym
 from yarll.environment.wrappers import DescriptionWrapper
 
 class Environment(DescriptionWrapper):
-    def __init__(self, env, **kwargs):
+    def __init__(self, env=None, old_env_name=None, **kwargs):
+        # When used as the entry point of a re-registered environment, wrap the original one
+        if env is None:
+            env = gym.make(old_env_name)
         super(Environment, self).__init__(env)
@@ -7,7 +7,7 @@ from typing import Sequence
 import numpy as np
 
 import gym
-from yarll.misc.utils import AtariRescale42x42
+from yarll.environment.wrappers import AtariRescale42x42
 from yarll.environment.environment import Environment
 
 gym.logger.set_level(gym.logger.ERROR)
@@ -111,3 +111,26 @@ class CenteredScaledActionWrapper(gym.ActionWrapper):
 
     def reverse_action(self, action):
         return (2 * action - self._high - self._low) / self._diff
+
+
+def _process_frame42(frame: np.ndarray) -> np.ndarray:
+    import cv2
+    frame = frame[34:34 + 160, :160]
+    # Resize by half, then down to 42x42 (essentially mipmapping). If
+    # we resize directly we lose pixels that, when mapped to 42x42,
+    # aren't close enough to the pixel boundary.
+    frame = cv2.resize(frame, (80, 80))
+    frame = cv2.resize(frame, (42, 42))
+    frame = frame.mean(2)
+    frame = frame.astype(np.float32)
+    frame *= (1.0 / 255.0)
+    frame = np.reshape(frame, [42, 42, 1])
+    return frame
+
+class AtariRescale42x42(gym.ObservationWrapper):
+    def __init__(self, env=None):
+        super(AtariRescale42x42, self).__init__(env)
+        self.observation_space = gym.spaces.Box(0.0, 1.0, [42, 42, 1])
+
+    def observation(self, observation: np.ndarray) -> np.ndarray:
+        return _process_frame42(observation)
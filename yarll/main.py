@@ -4,18 +4,26 @@
 import argparse
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-from yarll.misc.utils import json_to_dict, save_config, set_seed, spaces_mapping
+from yarll.misc.utils import json_to_dict, save_config, set_seed, set_tf_threads, spaces_mapping, start_run_metadata
 
-def run_experiment(spec, monitor_path=None, only_last=False, description=None, seed=None):
+def run_experiment(spec, monitor_path=None, only_last=False, description=None, seed=None,
+                   intra_op_threads=None, inter_op_threads=None):
     """Run an experiment using a specification dictionary."""
 
     from pathlib import Path
 
+    if intra_op_threads is not None or inter_op_threads is not None:
+        set_tf_threads(intra_op_threads, inter_op_threads)
+
     if seed is None:
         import random
         seed = random.randint(0, 2 ** 32 - 1)
     set_seed(seed)
 
+    # Git information and installed packages are collected while the environments and agent are being made
+    repo_path = (Path(__file__) / "../../").resolve()
+    metadata = start_run_metadata(repo_path)
+
     import datetime
     import gym
     gym.logger.set_level(gym.logger.ERROR)
@@ -60,8 +68,23 @@ def run_experiment(spec, monitor_path=None, only_last=False, description=None, s
                 config,
                 agent.__class__,
                 [env.metadata["parameters"] for env in envs],
-                repo_path=(Path(__file__) / "../../").resolve())
-    agent.learn()
+                repo_path=repo_path,
+                metadata=metadata)
+    if not spec.get("profiling", False):
+        agent.learn()
+        return
+    import tensorflow as tf
+    from yarll.misc import profiling
+    profiler = profiling.enable()
+    try:
+        agent.learn()
+    finally:
+        # Also for a run that fails, which is when the profile may be needed most
+        profiling.disable()
+        writer = tf.summary.create_file_writer(str(monitor_path / "profile"))
+        report = profiler.write_summaries(writer, step=profiler.counters.get("env_steps", 0))
+        profiler.save(monitor_path / "profile.json", report)
+        print(f"Profile written to {monitor_path / 'profile.json'}")
 
 
 parser = argparse.ArgumentParser()
@@ -72,6 +95,10 @@ parser.add_argument("--monitor_path", metavar="monitor_path", default=None, type
 parser.add_argument("--only_last", default=False, action="store_true",
                     help="Only use the last environment in a list of provided environments.")
 parser.add_argument("--seed", default=None, type=int, help="Seed to use for the experiment.")
+parser.add_argument("--intra_op_threads", default=None, type=int,
+                    help="Threads TensorFlow uses within an operation (default: number of cores).")
+parser.add_argument("--inter_op_threads", default=None, type=int,
+                    help="Threads TensorFlow uses to run independent operations (default: number of cores).")
 
 def main():
     args = parser.parse_args()
@@ -80,7 +107,9 @@ def main():
         monitor_path=args.monitor_path,
         only_last=args.only_last,
         description=args.description,
-        seed=args.seed
+        seed=args.seed,
+        intra_op_threads=args.intra_op_threads,
+        inter_op_threads=args.inter_op_threads
     )
 
 if __name__ == '__main__':
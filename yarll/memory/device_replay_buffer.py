@@ -0,0 +1,83 @@
+# -*- coding: utf8 -*-
+
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import tensorflow as tf
+
+from yarll.memory.experiences_memory import Experience
+
+class DeviceReplayBuffer:
+    """
+    Replay memory of which the experiences are stored in TensorFlow variables,
+    such that batches can be sampled inside a compiled function without copying them from numpy.
+    New experiences are kept on the host until `sync` is called, which writes them all at once.
+    """
+
+    def __init__(self, buffer_size: int) -> None:
+        self.buffer_size: int = buffer_size
+        self.num_experiences: int = 0
+        self.index: int = 0  # Position where the next experience will be written
+        self.pending: List[Tuple] = []
+        self.variables: Optional[Dict[str, tf.Variable]] = None
+        self.n_entries_variable = tf.Variable(0, dtype=tf.int32, trainable=False)
+
+    def _allocate(self, state: np.ndarray, action: np.ndarray) -> None:
+        shapes = {
+            "states0": np.shape(state),
+            "actions": np.shape(action),
+            "rewards": (),
+            "states1": np.shape(state),
+            "terminals1": ()
+        }
+        self.variables = {name: tf.Variable(tf.zeros((self.buffer_size, *shape), tf.float32), trainable=False)
+                          for name, shape in shapes.items()}
+
+    def add(self, state: np.ndarray, action: np.ndarray, reward: float, new_state: np.ndarray, done: bool) -> None:
+        if self.variables is None:
+            self._allocate(state, action)
+        self.pending.append((state, action, reward, new_state, done))
+        self.num_experiences = min(self.num_experiences + 1, self.buffer_size)
+
+    def add_by_experiences(self, experiences: List[Experience]) -> None:
+        for experience in experiences:
+            self.add(experience.state, experience.action, experience.reward,
+                     experience.next_state, experience.terminal)
+
+    def sync(self) -> None:
+        """Write the experiences that were added since the last call to the variables."""
+        if not self.pending:
+            return
+        # If more experiences than fit were added, only the last ones are written, to the slots they would end up in
+        pending = self.pending[-self.buffer_size:]
+        first = self.index + len(self.pending) - len(pending)
+        indices = (first + np.arange(len(pending))) % self.buffer_size
+        columns = zip(*pending)
+        for (name, variable), column in zip(self.variables.items(), columns):
+            values = np.asarray(column, np.float32).reshape((len(pending), *variable.shape[1:]))
+            variable.scatter_nd_update(indices[:, None], values)
+        self.index = (self.index + len(self.pending)) % self.buffer_size
+        self.n_entries_variable.assign(self.num_experiences)
+        self.pending = []
+
+    def sample(self, batch_size: int) -> Dict[str, tf.Tensor]:
+        """Randomly sample batch_size synced experiences (with replacement). Can be used in a tf.function."""
+        indices = tf.random.uniform((batch_size,), maxval=self.n_entries_variable, dtype=tf.int32)
+        return {name: tf.gather(variable, indices) for name, variable in self.variables.items()}
+
+    def get_batch(self, batch_size: int) -> Dict[str, np.ndarray]:
+        self.sync()
+        return {name: value.numpy() for name, value in self.sample(batch_size).items()}
+
+    @property
+    def size(self) -> int:
+        return self.buffer_size
+
+    @property
+    def n_entries(self) -> int:
+        return self.num_experiences
+
+    def erase(self):
+        self.num_experiences = 0
+        self.index = 0
+        self.pending = []
+        self.n_entries_variable.assign(0)
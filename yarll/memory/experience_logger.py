@@ -0,0 +1,151 @@
+# -*- coding: utf8 -*-
+
+"""
+Logging of experiences to disk.
+Transitions are collected in preallocated numpy chunks that are written
+as .npz files (one array per column) by a background thread.
+"""
+
+from pathlib import Path
+import queue
+import threading
+from typing import Dict, Optional, Union
+import numpy as np
+
+COLUMNS = ("states", "actions", "rewards", "next_states", "terminals")
+
+class ExperienceLogger(object):
+    """
+    Writes transitions to `directory` in chunks of `chunk_size` transitions.
+    At most `max_pending_chunks` full chunks wait to be written, after which `add` blocks,
+    such that the memory use is bounded.
+    With `sample_rate` < 1, each transition is only kept with that probability.
+    """
+
+    def __init__(self,
+                 directory: Union[Path, str],
+                 chunk_size: int = 10000,
+                 max_pending_chunks: int = 4,
+                 sample_rate: float = 1.0,
+                 seed: Optional[int] = None) -> None:
+        super(ExperienceLogger, self).__init__()
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.chunk_size: int = chunk_size
+        self.sample_rate: float = sample_rate
+        self.random = np.random.RandomState(seed)  # Separate from the global state, to not influence experiments
+        self.chunk: Optional[Dict[str, np.ndarray]] = None
+        self.index: int = 0  # Position in the current chunk
+        self.n_chunks: int = 0
+        self.n_logged: int = 0
+
+        self.queue: queue.Queue = queue.Queue(maxsize=max_pending_chunks)
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self._write_chunks, daemon=True)
+        self.thread.start()
+        self.closed: bool = False
+
+    def _allocate(self, state: np.ndarray, action: np.ndarray) -> Dict[str, np.ndarray]:
+        return {
+            "states": np.empty((self.chunk_size, *state.shape[1:]), np.float32),
+            "actions": np.empty((self.chunk_size, *action.shape[1:]), action.dtype),
+            "rewards": np.empty((self.chunk_size,), np.float32),
+            "next_states": np.empty((self.chunk_size, *state.shape[1:]), np.float32),
+            "terminals": np.empty((self.chunk_size,), bool)
+        }
+
+    def _write_chunks(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, chunk = item
+            try:
+                # Write under a temporary name first, such that readers never see partial chunks
+                tmp_path = path.with_suffix(".tmp")
+                with open(tmp_path, "wb") as f:
+                    np.savez(f, **chunk)
+                tmp_path.replace(path)
+            except Exception as e:  # pylint: disable=broad-except
+                self.error = e
+
+    def _submit(self) -> None:
+        if self.error is not None:
+            raise self.error
+        chunk = {name: column[:self.index] for name, column in self.chunk.items()}
+        path = self.directory / f"chunk_{self.n_chunks:06d}.npz"
+        self.queue.put((path, chunk))
+        self.n_chunks += 1
+        # The submitted chunk is owned by the writer thread now
+        self.chunk = None
+        self.index = 0
+
+    def add(self, states, actions, rewards, next_states, terminals) -> None:
+        """Log a batch of transitions, with the transitions along the first dimension."""
+        states = np.asarray(states)
+        actions = np.asarray(actions)
+        rewards = np.asarray(rewards)
+        next_states = np.asarray(next_states)
+        terminals = np.asarray(terminals)
+        if self.sample_rate < 1.0:
+            keep = self.random.uniform(size=len(rewards)) < self.sample_rate
+            states, actions, rewards, next_states, terminals = [
+                x[keep] for x in (states, actions, rewards, next_states, terminals)]
+        start = 0
+        n = len(rewards)
+        while start < n:
+            if self.chunk is None:
+                self.chunk = self._allocate(states, actions)
+            end = min(n, start + self.chunk_size - self.index)
+            i, j = self.index, self.index + end - start
+            self.chunk["states"][i:j] = states[start:end]
+            self.chunk["actions"][i:j] = actions[start:end]
+            self.chunk["rewards"][i:j] = rewards[start:end]
+            self.chunk["next_states"][i:j] = next_states[start:end]
+            self.chunk["terminals"][i:j] = terminals[start:end]
+            self.index = j
+            if self.index == self.chunk_size:
+                self._submit()
+            start = end
+        self.n_logged += n
+
+    def add_single(self, state, action, reward, next_state, terminal) -> None:
+        """Log a single transition."""
+        if self.sample_rate < 1.0 and self.random.uniform() >= self.sample_rate:
+            return
+        if self.chunk is None:
+            self.chunk = self._allocate(np.asarray(state)[None], np.asarray(action)[None])
+        i = self.index
+        self.chunk["states"][i] = state
+        self.chunk["actions"][i] = action
+        self.chunk["rewards"][i] = reward
+        self.chunk["next_states"][i] = next_state
+        self.chunk["terminals"][i] = terminal
+        self.index += 1
+        self.n_logged += 1
+        if self.index == self.chunk_size:
+            self._submit()
+
+    def close(self) -> None:
+        """Write the remaining transitions and wait until everything is on disk."""
+        if self.closed:
+            return
+        if self.index > 0:
+            self._submit()
+        self.queue.put(None)
+        self.thread.join()
+        self.closed = True
+        if self.error is not None:
+            raise self.error
+
+
+def load_experiences(directory: Union[Path, str]) -> Dict[str, np.ndarray]:
+    """Load all experiences written by an `ExperienceLogger`, concatenated in the order they were logged."""
+    paths = sorted(Path(directory).glob("chunk_*.npz"))
+    if not paths:
+        raise FileNotFoundError(f"No experiences found in {directory}.")
+    chunks = []
+    for path in paths:
+        with np.load(path) as data:
+            chunks.append({name: data[name] for name in COLUMNS})
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in COLUMNS}
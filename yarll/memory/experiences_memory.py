@@ -2,7 +2,9 @@
 
 from collections import namedtuple
 
-Experience = namedtuple("Experience", ["state", "action", "reward", "next_state", "value", "features", "terminal"])
+# log_prob is the log-probability of the action under the policy that chose it, if the policy provides it
+Experience = namedtuple("Experience", ["state", "action", "reward", "next_state", "value", "features", "terminal", "log_prob"],
+                        defaults=[None])
 
 class ExperiencesMemory(object):
     """Experience gathered from an environment."""
@@ -12,9 +14,9 @@ class ExperiencesMemory(object):
         self.experiences = []
         self.steps = 0
 
-    def add(self, state, action, reward, value=None, features=None, terminal=False, next_state=None):
+    def add(self, state, action, reward, value=None, features=None, terminal=False, next_state=None, log_prob=None):
         """Add a single transition to the trajectory."""
-        exp = Experience(state, action, reward, next_state, value, features, terminal)
+        exp = Experience(state, action, reward, next_state, value, features, terminal, log_prob)
         self.experiences.append(exp)
         self.steps += 1
 
@@ -25,6 +27,11 @@ class ExperiencesMemory(object):
         self.experiences.extend(other.experiences)
         self.steps += other.steps
 
+    def map_states(self, fn):
+        """Apply a function (e.g. a scaler) to the states and next states of all experiences."""
+        self.experiences = [exp._replace(state=fn(exp.state), next_state=fn(exp.next_state))
+                            for exp in self.experiences]
+
     @property
     def states(self):
         return [exp.state for exp in self.experiences]
@@ -54,6 +61,10 @@ class ExperiencesMemory(object):
     def terminals(self):
         return [exp.terminal for exp in self.experiences]
 
+    @property
+    def log_probs(self):
+        return [exp.log_prob for exp in self.experiences]
+
     @property
     def next_states(self):
         return [exp.next_state for exp in self.experiences]
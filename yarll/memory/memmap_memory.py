@@ -0,0 +1,129 @@
+# -*- coding: utf8 -*-
+
+from pathlib import Path
+import tempfile
+from typing import Dict, List, Optional, Union
+import numpy as np
+
+from yarll.memory.experiences_memory import Experience
+
+class MemmapMemory:
+    """
+    Replay memory with the same interface as `Memory` for large buffers of (image) observations.
+    Observations are stored in a memory-mapped file instead of in RAM.
+    Every frame is stored only once: the next state of the experience in slot i is the frame in slot i + 1.
+    When an experience doesn't continue from the previous one (e.g. after the end of an episode),
+    the slot holding the last next state is skipped when sampling.
+    With `uint8_scale`, observations are stored as uint8 after multiplying them by it
+    (e.g. 255 for pixels in [0, 1]) and are only converted back to float32 when making a batch.
+    """
+
+    def __init__(self,
+                 buffer_size: int,
+                 filename: Optional[Union[Path, str]] = None,
+                 uint8_scale: Optional[float] = None) -> None:
+        self.buffer_size: int = buffer_size
+        self.filename: Optional[Union[Path, str]] = filename
+        self.uint8_scale: Optional[float] = uint8_scale
+        self.num_experiences: int = 0
+        self.n_filled: int = 0  # Number of slots that have been written to at least once
+        self.pending: Optional[int] = None  # Slot holding the next state of the last experience
+        self.last_state: Optional[np.ndarray] = None  # That next state, as it was given
+        self.frames: Optional[np.memmap] = None
+        self.actions: Optional[np.ndarray] = None
+        self.rewards: Optional[np.ndarray] = None
+        self.terminals1: Optional[np.ndarray] = None
+        self.valid: Optional[np.ndarray] = None  # Slots that hold a complete experience
+
+    def _allocate(self, state: np.ndarray, action: np.ndarray) -> None:
+        if self.filename is None:
+            # The file is removed when the memory is garbage collected
+            self._file = tempfile.NamedTemporaryFile(prefix="replay_", suffix=".dat")
+            self.filename = self._file.name
+        dtype = np.uint8 if self.uint8_scale is not None else np.float32
+        self.frames = np.memmap(self.filename, dtype=dtype, mode="w+", shape=(self.buffer_size, *np.shape(state)))
+        self.actions = np.empty((self.buffer_size, *np.shape(action)), np.float32)
+        self.rewards = np.empty((self.buffer_size,), np.float32)
+        self.terminals1 = np.empty((self.buffer_size,), np.float32)
+        self.valid = np.zeros((self.buffer_size,), bool)
+
+    def _encode(self, frames: np.ndarray) -> np.ndarray:
+        if self.uint8_scale is None:
+            return frames
+        return np.clip(np.rint(np.asarray(frames) * self.uint8_scale), 0, 255).astype(np.uint8)
+
+    def _decode(self, frames: np.ndarray) -> np.ndarray:
+        if self.uint8_scale is None:
+            return frames
+        return frames.astype(np.float32) * np.float32(1.0 / self.uint8_scale)
+
+    def _write_frame(self, i: int, frame: np.ndarray) -> None:
+        if self.valid[i]:  # Overwrites the oldest experience
+            self.valid[i] = False
+            self.num_experiences -= 1
+        self.frames[i] = self._encode(frame)
+        self.n_filled = max(self.n_filled, i + 1)
+
+    def _get(self, indices: np.ndarray) -> Dict[str, np.ndarray]:
+        return {
+            "states0": self._decode(self.frames[indices]),
+            "actions": self.actions[indices],
+            "rewards": self.rewards[indices],
+            "states1": self._decode(self.frames[(indices + 1) % self.buffer_size]),
+            "terminals1": self.terminals1[indices]
+        }
+
+    def get_batch(self, batch_size: int) -> Dict[str, np.ndarray]:
+        # Randomly sample batch_size examples (with replacement), resampling slots without an experience
+        indices = np.random.randint(self.n_filled, size=batch_size)
+        invalid = ~self.valid[indices]
+        while invalid.any():
+            indices[invalid] = np.random.randint(self.n_filled, size=invalid.sum())
+            invalid = ~self.valid[indices]
+        return self._get(indices)
+
+    def get_all(self) -> Dict[str, np.ndarray]:
+        # From the oldest to the newest experience
+        start = 0 if self.pending is None else self.pending + 1
+        slots = (np.arange(self.buffer_size) + start) % self.buffer_size
+        return self._get(slots[self.valid[slots]])
+
+    def add(self, state: np.ndarray, action: np.ndarray, reward: float, new_state: np.ndarray, done: bool) -> None:
+        if self.frames is None:
+            self._allocate(state, action)
+        if self.pending is not None and (state is self.last_state or np.array_equal(state, self.last_state)):
+            # Continues from the previous experience: its next state is already stored
+            i = self.pending
+        else:
+            i = 0 if self.pending is None else (self.pending + 1) % self.buffer_size
+            self._write_frame(i, state)
+        j = (i + 1) % self.buffer_size
+        self._write_frame(j, new_state)
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.terminals1[i] = done
+        self.valid[i] = True
+        self.num_experiences += 1
+        self.pending = j
+        self.last_state = np.array(new_state)
+
+    def add_by_experiences(self, experiences: List[Experience]) -> None:
+        for experience in experiences:
+            self.add(experience.state, experience.action, experience.reward,
+                     experience.next_state, experience.terminal)
+
+    @property
+    def size(self) -> int:
+        return self.buffer_size
+
+    @property
+    def n_entries(self) -> int:
+        return self.num_experiences
+
+    def erase(self):
+        self.num_experiences = 0
+        self.n_filled = 0
+        self.pending = None
+        self.last_state = None
+        if self.valid is not None:
+            self.valid[:] = False
@@ -0,0 +1,101 @@
+# -*- coding: utf8 -*-
+
+"""
+Prioritized experience replay.
+Based on Prioritized Experience Replay (Schaul et al., 2015).
+"""
+
+from typing import Dict
+import numpy as np
+
+from yarll.memory.ring_buffer_memory import RingBufferMemory
+
+class SumTree:
+    """
+    Binary tree stored in an array in which every node is the sum of its two children.
+    The leaves hold the priorities. Updates and prefix sum searches take O(log n) time
+    and are vectorized over multiple indices or values at once.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity: int = capacity
+        # Number of leaves is rounded up to a power of 2 such that all leaves are at the same depth
+        self.n_leaves: int = 1
+        while self.n_leaves < capacity:
+            self.n_leaves *= 2
+        # Node 1 is the root, the children of node i are 2i and 2i + 1; node 0 is unused
+        self.tree = np.zeros(2 * self.n_leaves, np.float64)
+
+    @property
+    def total(self) -> float:
+        return self.tree[1]
+
+    def __getitem__(self, indices) -> np.ndarray:
+        return self.tree[np.asarray(indices) + self.n_leaves]
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray) -> None:
+        """Set the priorities of the leaves with the given indices."""
+        nodes = np.asarray(indices) + self.n_leaves
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        """For each value, find the index of the first leaf for which the cumulative sum of priorities exceeds it."""
+        values = np.array(values, np.float64)
+        nodes = np.ones(len(values), np.int64)
+        while nodes[0] < self.n_leaves:
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            go_right = values >= left_sums
+            values -= np.where(go_right, left_sums, 0.0)
+            nodes = left + go_right
+        return nodes - self.n_leaves
+
+
+class PrioritizedMemory(RingBufferMemory):
+    """
+    Replay memory that samples experiences with a probability
+    proportional to their priority to the power alpha.
+    `get_batch` also returns the importance-sampling weights and the indices of the experiences,
+    such that their priorities can be updated afterwards using `update_priorities`.
+    """
+
+    def __init__(self, buffer_size: int, alpha: float = 0.6, beta: float = 0.4, epsilon: float = 1e-6) -> None:
+        super(PrioritizedMemory, self).__init__(buffer_size)
+        self.alpha: float = alpha
+        self.beta: float = beta  # Can be annealed to 1 during learning
+        self.epsilon: float = epsilon  # Keeps priorities of experiences with a TD error of 0 above 0
+        self.tree = SumTree(buffer_size)
+        self.max_priority: float = 1.0
+
+    def add(self, state: np.ndarray, action: np.ndarray, reward: float, new_state: np.ndarray, done: bool) -> None:
+        index = self.index
+        super(PrioritizedMemory, self).add(state, action, reward, new_state, done)
+        # New experiences get the highest priority, such that they are sampled at least once
+        self.tree.update(np.array([index]), np.array([self.max_priority ** self.alpha]))
+
+    def get_batch(self, batch_size: int) -> Dict[str, np.ndarray]:
+        # Stratified sampling: one sample from each of batch_size equally sized segments
+        segment = self.tree.total / batch_size
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+        indices = np.minimum(self.tree.find(values), self.num_experiences - 1)
+        probabilities = self.tree[indices] / self.tree.total
+        weights = (self.num_experiences * probabilities) ** (-self.beta)
+        batch = self._get(indices)
+        batch["weights"] = (weights / weights.max()).astype(np.float32)
+        batch["indices"] = indices
+        return batch
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        """Set the priorities of experiences using their (new) TD errors."""
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices, priorities ** self.alpha)
+
+    def erase(self):
+        super(PrioritizedMemory, self).erase()
+        self.tree = SumTree(self.buffer_size)
+        self.max_priority = 1.0
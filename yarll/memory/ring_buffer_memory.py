@@ -0,0 +1,81 @@
+# -*- coding: utf8 -*-
+
+from typing import Dict, List, Optional
+import numpy as np
+
+from yarll.memory.experiences_memory import Experience
+
+class RingBufferMemory:
+    """
+    Replay memory with the same interface as `Memory`,
+    but with each field stored in a preallocated numpy array that is used as a circular buffer.
+    The arrays are allocated when the first experience is added, using its shapes.
+    """
+
+    def __init__(self, buffer_size: int) -> None:
+        self.buffer_size: int = buffer_size
+        self.num_experiences: int = 0
+        self.index: int = 0  # Position where the next experience will be written
+        self.states0: Optional[np.ndarray] = None
+        self.actions: Optional[np.ndarray] = None
+        self.rewards: Optional[np.ndarray] = None
+        self.states1: Optional[np.ndarray] = None
+        self.terminals1: Optional[np.ndarray] = None
+
+    def _allocate(self, state: np.ndarray, action: np.ndarray) -> None:
+        self.states0 = np.empty((self.buffer_size, *np.shape(state)), np.float32)
+        self.actions = np.empty((self.buffer_size, *np.shape(action)), np.float32)
+        self.rewards = np.empty((self.buffer_size,), np.float32)
+        self.states1 = np.empty((self.buffer_size, *np.shape(state)), np.float32)
+        self.terminals1 = np.empty((self.buffer_size,), np.float32)
+
+    def _get(self, indices: np.ndarray) -> Dict[str, np.ndarray]:
+        return {
+            "states0": self.states0[indices],
+            "actions": self.actions[indices],
+            "rewards": self.rewards[indices],
+            "states1": self.states1[indices],
+            "terminals1": self.terminals1[indices]
+        }
+
+    def get_batch(self, batch_size: int) -> Dict[str, np.ndarray]:
+        # Randomly sample batch_size examples (with replacement)
+        indices = np.random.randint(self.num_experiences, size=batch_size)
+        return self._get(indices)
+
+    def get_all(self) -> Dict[str, np.ndarray]:
+        # From the oldest to the newest experience
+        indices = (np.arange(self.num_experiences) + self.index) % self.num_experiences \
+            if self.num_experiences == self.buffer_size else np.arange(self.num_experiences)
+        return self._get(indices)
+
+    def add(self, state: np.ndarray, action: np.ndarray, reward: float, new_state: np.ndarray, done: bool) -> None:
+        if self.states0 is None:
+            self._allocate(state, action)
+        i = self.index
+        self.states0[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.states1[i] = new_state
+        self.terminals1[i] = done
+        self.index = (i + 1) % self.buffer_size
+        self.num_experiences = min(self.num_experiences + 1, self.buffer_size)
+
+    def add_by_experiences(self, experiences: List[Experience]) -> None:
+        for experience in experiences:
+            self.add(experience.state, experience.action, experience.reward,
+                     experience.next_state, experience.terminal)
+
+    @property
+    def size(self) -> int:
+        return self.buffer_size
+
+    @property
+    def n_entries(self) -> int:
+        # if buffer is full, return buffer size
+        # otherwise, return experience counter
+        return self.num_experiences
+
+    def erase(self):
+        self.num_experiences = 0
+        self.index = 0
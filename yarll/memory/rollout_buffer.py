@@ -0,0 +1,111 @@
+# -*- coding: utf8 -*-
+
+from typing import Callable, List, Optional
+import numpy as np
+
+from yarll.memory.experiences_memory import Experience
+
+class RolloutBuffer(object):
+    """
+    Experience gathered from an environment, stored in preallocated numpy columns.
+    Can be used instead of `ExperiencesMemory` when the number of steps is known in advance.
+    The columns are allocated when the first transition is added, using its shapes,
+    such that transitions of multiple environments (see `VecEnvRunner`) get an extra dimension.
+    The properties return views on the columns, so they are only valid until the buffer is reset.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        super(RolloutBuffer, self).__init__()
+        self.capacity: int = capacity
+        self.steps: int = 0
+        self._states: Optional[np.ndarray] = None
+        self._actions: Optional[np.ndarray] = None
+        self._rewards: Optional[np.ndarray] = None
+        self._next_states: Optional[np.ndarray] = None
+        self._values: Optional[np.ndarray] = None
+        self._log_probs: Optional[np.ndarray] = None  # Of the actions under the policy that chose them
+        self._terminals: Optional[np.ndarray] = None
+        # Features (e.g. RNN states) are only used by some policies and kept as Python objects
+        self._features: List = []
+
+    def _allocate(self, state, action, reward) -> None:
+        state_shape = np.shape(state)
+        action = np.asarray(action)
+        self._states = np.empty((self.capacity, *state_shape), dtype=np.float32)
+        self._next_states = np.empty((self.capacity, *state_shape), dtype=np.float32)
+        self._actions = np.empty((self.capacity, *action.shape), dtype=action.dtype)
+        self._rewards = np.empty((self.capacity, *np.shape(reward)), dtype=np.float32)
+        self._values = np.empty((self.capacity, *np.shape(reward)), dtype=np.float32)
+        self._log_probs = np.empty((self.capacity, *np.shape(reward)), dtype=np.float32)
+        self._terminals = np.empty((self.capacity, *np.shape(reward)), dtype=bool)
+
+    def add(self, state, action, reward, value=None, features=None, terminal=False, next_state=None,
+            log_prob=None) -> None:
+        """Add a single transition to the trajectory."""
+        if self._states is None:
+            self._allocate(state, action, reward)
+        if self.steps >= self.capacity:
+            raise IndexError(f"The rollout buffer is full (capacity {self.capacity}).")
+        i = self.steps
+        self._states[i] = state
+        self._actions[i] = action
+        self._rewards[i] = reward
+        self._values[i] = np.nan if value is None else value
+        self._log_probs[i] = np.nan if log_prob is None else log_prob
+        self._terminals[i] = terminal
+        if next_state is not None:
+            self._next_states[i] = next_state
+        self._features.append(features)
+        self.steps += 1
+
+    def reset(self) -> None:
+        """Start writing from the beginning again, keeping the allocated columns."""
+        self.steps = 0
+        self._features = []
+
+    def map_states(self, fn: Callable[[np.ndarray], np.ndarray]) -> None:
+        """Apply a function (e.g. a scaler) in place to the states and next states."""
+        self._states[:self.steps] = fn(self.states)
+        self._next_states[:self.steps] = fn(self.next_states)
+
+    @property
+    def states(self) -> np.ndarray:
+        return self._states[:self.steps]
+
+    @property
+    def actions(self) -> np.ndarray:
+        return self._actions[:self.steps]
+
+    @property
+    def rewards(self) -> np.ndarray:
+        return self._rewards[:self.steps]
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._values[:self.steps]
+
+    @property
+    def log_probs(self) -> np.ndarray:
+        return self._log_probs[:self.steps]
+
+    @property
+    def features(self) -> list:
+        return self._features
+
+    @property
+    def terminal(self):
+        """Last experience is terminal."""
+        return self._terminals[self.steps - 1]
+
+    @property
+    def terminals(self) -> np.ndarray:
+        return self._terminals[:self.steps]
+
+    @property
+    def next_states(self) -> np.ndarray:
+        return self._next_states[:self.steps]
+
+    def __getitem__(self, i):
+        i = range(self.steps)[i]  # Support negative indices and raise IndexError when out of range
+        return Experience(self._states[i], self._actions[i], self._rewards[i], self._next_states[i],
+                          self._values[i], self._features[i], self._terminals[i], self._log_probs[i])
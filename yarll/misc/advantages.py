@@ -0,0 +1,56 @@
+# -*- coding: utf8 -*-
+
+"""
+Advantages and returns of (batches of) trajectories.
+All functions accept arrays of shape [T] (one environment) or [T, n_envs],
+where terminals[t] indicates that the episode ended with the transition at step t.
+The bootstrap values are the value predictions of the states after the last step;
+they are ignored for environments of which the last step was terminal.
+"""
+
+from typing import Tuple
+import numpy as np
+
+def _discounted_cumsum(x: np.ndarray, discounts: np.ndarray, last: np.ndarray) -> np.ndarray:
+    """
+    Compute y[t] = x[t] + discounts[t] * y[t + 1], with y[T] = last.
+    Only the time dimension is iterated over, all environments are handled at once.
+    """
+    y = np.empty_like(x)
+    for t in range(len(x) - 1, -1, -1):
+        last = x[t] + discounts[t] * last
+        y[t] = last
+    return y
+
+def discounted_returns(rewards: np.ndarray,
+                       terminals: np.ndarray,
+                       bootstrap_values: np.ndarray,
+                       gamma: float) -> np.ndarray:
+    """
+    Discounted sum of future rewards until the end of the episode,
+    bootstrapped using the value of the last state if the episode didn't end.
+    """
+    rewards = np.asarray(rewards, dtype=np.float32)
+    nonterminals = 1.0 - np.asarray(terminals, dtype=np.float32)
+    bootstrap_values = np.asarray(bootstrap_values, dtype=np.float32)
+    return _discounted_cumsum(rewards, gamma * nonterminals, bootstrap_values)
+
+def generalized_advantage_estimation(rewards: np.ndarray,
+                                     values: np.ndarray,
+                                     terminals: np.ndarray,
+                                     bootstrap_values: np.ndarray,
+                                     gamma: float,
+                                     lambda_: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Generalized Advantage Estimation (Schulman et al., 2015).
+    Returns the advantages and the lambda-returns (advantages + values) to use as critic targets.
+    With lambda_ = 1, the advantages are the discounted returns minus the values.
+    """
+    rewards = np.asarray(rewards, dtype=np.float32)
+    values = np.asarray(values, dtype=np.float32)
+    nonterminals = 1.0 - np.asarray(terminals, dtype=np.float32)
+    bootstrap_values = np.asarray(bootstrap_values, dtype=np.float32)
+    next_values = np.concatenate([values[1:], bootstrap_values[None]])
+    deltas = rewards + gamma * nonterminals * next_values - values
+    advantages = _discounted_cumsum(deltas, gamma * lambda_ * nonterminals, np.zeros_like(bootstrap_values))
+    return advantages, advantages + values
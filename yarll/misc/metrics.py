@@ -0,0 +1,129 @@
+# -*- coding: utf8 -*-
+
+"""
+Aggregation of scalar metrics before writing them as summaries.
+"""
+
+from pathlib import Path
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import numpy as np
+import tensorflow as tf
+
+class _Metric(object):
+    """Values of a metric since the last flush: exact sum and count, and the last values in a ring buffer."""
+
+    def __init__(self, capacity: int) -> None:
+        super(_Metric, self).__init__()
+        self.values = np.empty(capacity, np.float64)
+        self.count: int = 0
+        self.sum: float = 0.0
+        self.step: int = 0
+
+    def add(self, value: float, step: int) -> None:
+        self.values[self.count % len(self.values)] = value
+        self.count += 1
+        self.sum += value
+        self.step = step
+
+    def take(self) -> Tuple[int, float, int, np.ndarray]:
+        """Return the step, mean, count and retained values, and start over."""
+        result = self.step, self.sum / self.count, self.count, self.values[:min(self.count, len(self.values))].copy()
+        self.count = 0
+        self.sum = 0.0
+        return result
+
+
+class MetricsAggregator(object):
+    """
+    Collects scalars and lines of text and writes them at an interval in a background thread,
+    instead of writing a summary for every value.
+    For every metric, the mean and the number of values since the last flush are written,
+    optionally with percentiles of (at most `capacity` of the last) values.
+    A flush happens when `flush_every_seconds` have passed or the step has advanced by `flush_every_steps`.
+    """
+
+    def __init__(self,
+                 writer=None,
+                 flush_every_seconds: Optional[float] = 10.0,
+                 flush_every_steps: Optional[int] = None,
+                 percentiles: Sequence[float] = (),
+                 capacity: int = 1024) -> None:
+        super(MetricsAggregator, self).__init__()
+        self.writer = writer
+        self.flush_every_seconds = flush_every_seconds
+        self.flush_every_steps = flush_every_steps
+        self.percentiles = list(percentiles)
+        self.capacity = capacity
+        self.metrics: Dict[str, _Metric] = {}
+        self.lines: Dict[Path, List[str]] = {}
+        self.last_flush_time = time.monotonic()
+        self.last_flush_step = 0
+        # Agents can log from a collector thread and the main thread at the same time
+        self.lock = threading.Lock()
+
+        self.queue: queue.Queue = queue.Queue()
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+        self.closed = False
+
+    def scalar(self, name: str, value, step: int) -> None:
+        """Record a value of a metric."""
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = _Metric(self.capacity)
+            metric.add(float(np.asarray(value)), int(step))
+        self._maybe_flush(step)
+
+    def line(self, filename: Union[Path, str], text: str) -> None:
+        """Append a line of text to a file."""
+        with self.lock:
+            self.lines.setdefault(Path(filename), []).append(text)
+
+    def _maybe_flush(self, step: int) -> None:
+        if self.flush_every_steps is not None and step - self.last_flush_step >= self.flush_every_steps:
+            self.flush(step)
+        elif self.flush_every_seconds is not None and time.monotonic() - self.last_flush_time >= self.flush_every_seconds:
+            self.flush(step)
+
+    def flush(self, step: Optional[int] = None) -> None:
+        """Hand everything that was recorded since the last flush over to the writer thread."""
+        with self.lock:
+            records = {name: metric.take() for name, metric in self.metrics.items() if metric.count > 0}
+            lines, self.lines = self.lines, {}
+            self.last_flush_time = time.monotonic()
+            if step is not None:
+                self.last_flush_step = step
+        if records or lines:
+            self.queue.put((records, lines))
+
+    def _write(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            records, lines = item
+            if records and self.writer is not None:
+                with self.writer.as_default():
+                    for name, (step, mean, count, values) in records.items():
+                        tf.summary.scalar(name, mean, step=step)
+                        tf.summary.scalar(f"{name}/count", count, step=step)
+                        if self.percentiles:
+                            for q, value in zip(self.percentiles, np.percentile(values, self.percentiles)):
+                                tf.summary.scalar(f"{name}/p{q:g}", value, step=step)
+                self.writer.flush()
+            for filename, file_lines in lines.items():
+                with open(filename, "a") as f:
+                    f.write("".join(f"{l}\n" for l in file_lines))
+
+    def close(self) -> None:
+        """Write everything that is left and stop the writer thread."""
+        if self.closed:
+            return
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.closed = True
@@ -0,0 +1,148 @@
+# -*- coding: utf8 -*-
+
+"""
+Timing of the phases of a run (environment steps, action selection, training, ...).
+Profiling is disabled by default, in which case `timer` returns a context manager that does nothing.
+Timers can be nested: the name of a timer that is started inside another one is prefixed with the outer name.
+
+Usage:
+    from yarll.misc import profiling
+    with profiling.timer("train"):
+        ...
+    profiling.count("env_steps", n_envs)
+"""
+
+from contextlib import contextmanager
+import json
+from pathlib import Path
+import threading
+import time
+from typing import Dict, Optional, Union
+import numpy as np
+
+class _Timings(object):
+    """Exact total and count of the durations of a timer, and the last ones in a ring buffer for percentiles."""
+
+    def __init__(self, capacity: int) -> None:
+        super(_Timings, self).__init__()
+        self.durations = np.empty(capacity, np.float64)
+        self.count: int = 0
+        self.total: float = 0.0
+
+    def add(self, duration: float) -> None:
+        self.durations[self.count % len(self.durations)] = duration
+        self.count += 1
+        self.total += duration
+
+    def stats(self, wall_time: float) -> dict:
+        durations = self.durations[:min(self.count, len(self.durations))]
+        p50, p99 = np.percentile(durations, [50, 99])
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count,
+            "p50": p50,
+            "p99": p99,
+            "share": self.total / wall_time if wall_time > 0 else 0.0
+        }
+
+
+class Profiler(object):
+    """Collects named timers and counters."""
+
+    def __init__(self, capacity: int = 10000) -> None:
+        super(Profiler, self).__init__()
+        self.capacity = capacity
+        self.timings: Dict[str, _Timings] = {}
+        self.counters: Dict[str, int] = {}
+        self.start_time = time.perf_counter()
+        self.local = threading.local()  # Stack of the names of the running timers, per thread
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name: str):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        full_name = f"{stack[-1]}/{name}" if stack else name
+        stack.append(full_name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                timings = self.timings.get(full_name)
+                if timings is None:
+                    timings = self.timings[full_name] = _Timings(self.capacity)
+                timings.add(duration)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self) -> dict:
+        """Statistics of all timers and counters since the profiler was made. Durations are in seconds."""
+        wall_time = time.perf_counter() - self.start_time
+        with self.lock:
+            timers = {name: timings.stats(wall_time) for name, timings in sorted(self.timings.items())}
+            counters = dict(self.counters)
+        return {
+            "wall_time": wall_time,
+            "steps_per_second": counters.get("env_steps", 0) / wall_time,
+            "timers": timers,
+            "counters": counters
+        }
+
+    def write_summaries(self, writer, step: int) -> dict:
+        """Write the report as scalar summaries and return it."""
+        import tensorflow as tf
+        report = self.report()
+        with writer.as_default():
+            tf.summary.scalar("profile/steps_per_second", report["steps_per_second"], step=step)
+            for name, stats in report["timers"].items():
+                for key in ("share", "p50", "p99"):
+                    tf.summary.scalar(f"profile/{name}/{key}", stats[key], step=step)
+        writer.flush()
+        return report
+
+    def save(self, filename: Union[Path, str], report: Optional[dict] = None) -> None:
+        """Write the report as JSON."""
+        with open(filename, "w") as f:
+            json.dump(self.report() if report is None else report, f, indent=4)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_TIMER = _NullTimer()
+_profiler: Optional[Profiler] = None
+
+def enable(capacity: int = 10000) -> Profiler:
+    """Start profiling with a new profiler."""
+    global _profiler
+    _profiler = Profiler(capacity)
+    return _profiler
+
+def disable() -> None:
+    global _profiler
+    _profiler = None
+
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
+
+def timer(name: str):
+    """Context manager that times the code inside it if profiling is enabled."""
+    if _profiler is None:
+        return _NULL_TIMER
+    return _profiler.timer(name)
+
+def count(name: str, n: int = 1) -> None:
+    """Increase a counter if profiling is enabled."""
+    if _profiler is not None:
+        _profiler.count(name, n)
@@ -0,0 +1,103 @@
+# -*- coding: utf8 -*-
+
+"""Utilities that work on TensorFlow tensors and variables."""
+
+from typing import Sequence
+import numpy as np
+import tensorflow as tf
+
+def flatten(x):
+    return tf.reshape(x, [-1, np.prod(x.get_shape().as_list()[1:])])
+
+def soft_update(source_vars: Sequence[tf.Variable], target_vars: Sequence[tf.Variable], tau: float) -> None:
+    """Move each source variable by a factor of tau towards the corresponding target variable.
+
+    Arguments:
+        source_vars {Sequence[tf.Variable]} -- Source variables to copy from
+        target_vars {Sequence[tf.Variable]} -- Variables to copy data to
+        tau {float} -- How much to change to source var, between 0 and 1.
+    """
+    if len(source_vars) != len(target_vars):
+        raise ValueError("source_vars and target_vars must have the same length.")
+    for source, target in zip(source_vars, target_vars):
+        target.assign((1.0 - tau) * target + tau * source)
+
+
+def hard_update(source_vars: Sequence[tf.Variable], target_vars: Sequence[tf.Variable]) -> None:
+    """Copy source variables to target variables.
+
+    Arguments:
+        source_vars {Sequence[tf.Variable]} -- Source variables to copy from
+        target_vars {Sequence[tf.Variable]} -- Variables to copy data to
+    """
+    soft_update(source_vars, target_vars, 1.0) # Tau of 1, so get everything from source and keep nothing from target
+
+class TargetUpdater(object):
+    """
+    Compiled soft and hard updates of target variables.
+    All variables are updated in place in a single graph call,
+    instead of one eager `assign` per variable as in `soft_update`.
+    """
+
+    def __init__(self, source_vars: Sequence[tf.Variable], target_vars: Sequence[tf.Variable]) -> None:
+        super(TargetUpdater, self).__init__()
+        if len(source_vars) != len(target_vars):
+            raise ValueError("source_vars and target_vars must have the same length.")
+        self.source_vars = list(source_vars)
+        self.target_vars = list(target_vars)
+
+    @tf.function
+    def _update(self, tau):
+        for source, target in zip(self.source_vars, self.target_vars):
+            target.assign_add(tf.cast(tau, target.dtype) * (source - target))
+
+    @tf.function
+    def _copy(self):
+        for source, target in zip(self.source_vars, self.target_vars):
+            target.assign(source)
+
+    def soft_update(self, tau: float) -> None:
+        """Move each target variable by a factor of tau towards the corresponding source variable."""
+        self._update(tf.constant(tau, tf.float32))
+
+    def hard_update(self) -> None:
+        """Copy the source variables to the target variables, bit for bit."""
+        self._copy()
+
+class FlatVariables(object):
+    """
+    Reads and writes a list of variables as a single flat vector.
+    Both directions are a single compiled call, instead of one call per variable.
+    Vectors of another floating point type (e.g. float16) are cast inside the compiled call.
+    """
+
+    def __init__(self, variables: Sequence[tf.Variable]) -> None:
+        super(FlatVariables, self).__init__()
+        self.variables = list(variables)
+        self.sizes = [int(np.prod(v.shape)) for v in self.variables]
+        self.size = sum(self.sizes)
+
+    @tf.function
+    def flat(self):
+        """Values of all variables, concatenated into a float32 tensor."""
+        return tf.concat([tf.reshape(tf.cast(v, tf.float32), (-1,)) for v in self.variables], axis=0)
+
+    @tf.function
+    def _update(self, flat, add: bool):
+        for variable, value in zip(self.variables, tf.split(flat, self.sizes)):
+            value = tf.cast(tf.reshape(value, variable.shape), variable.dtype)
+            if add:
+                variable.assign_add(value)
+            else:
+                variable.assign(value)
+
+    def get(self) -> np.ndarray:
+        return self.flat().numpy()
+
+    def set(self, flat) -> None:
+        """Assign the consecutive parts of a flat vector to the variables."""
+        self._update(tf.convert_to_tensor(flat), False)
+
+    def add(self, flat) -> None:
+        """Add the consecutive parts of a flat vector to the variables."""
+        self._update(tf.convert_to_tensor(flat), True)
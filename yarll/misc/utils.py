@@ -1,5 +1,11 @@
 # -*- coding: utf8 -*-
 
+# TensorFlow and scipy are only imported where they are needed, such that environments, memories, scripts, ...
+# that use these utilities can be imported without them. Functions that work on TensorFlow variables are in tf_utils.
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import hashlib
+import importlib
 import itertools
 import sys
 import argparse
@@ -8,13 +14,9 @@ import os
 from pathlib import Path
 import random
 import subprocess
-from typing import Any, Callable, Dict, List, Sequence, Union
-import pkg_resources
-import tensorflow as tf
-from scipy import signal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
 import numpy as np
 
-import gym
 from gym.spaces import Discrete, Box, MultiBinary, MultiDiscrete
 
 def discount_rewards(x: Sequence, gamma: float) -> np.ndarray:
@@ -22,6 +24,7 @@ def discount_rewards(x: Sequence, gamma: float) -> np.ndarray:
     Given vector x, computes a vector y such that
     y[i] = x[i] + gamma * x[i+1] + gamma^2 x[i+2] + ...
     """
+    from scipy import signal
     return signal.lfilter([1], [1, -gamma], x[::-1], axis=0)[::-1]
 
 # Source: http://stackoverflow.com/a/12201744/1735784
@@ -32,29 +35,6 @@ def rgb2gray(rgb: np.ndarray) -> np.ndarray:
     """
     return np.dot(rgb[..., :3], [0.299, 0.587, 0.114])
 
-def _process_frame42(frame: np.ndarray) -> np.ndarray:
-    import cv2
-    frame = frame[34:34 + 160, :160]
-    # Resize by half, then down to 42x42 (essentially mipmapping). If
-    # we resize directly we lose pixels that, when mapped to 42x42,
-    # aren't close enough to the pixel boundary.
-    frame = cv2.resize(frame, (80, 80))
-    frame = cv2.resize(frame, (42, 42))
-    frame = frame.mean(2)
-    frame = frame.astype(np.float32)
-    frame *= (1.0 / 255.0)
-    frame = np.reshape(frame, [42, 42, 1])
-    return frame
-
-class AtariRescale42x42(gym.ObservationWrapper):
-    def __init__(self, env=None):
-        super(AtariRescale42x42, self).__init__(env)
-        self.observation_space = Box(0.0, 1.0, [42, 42, 1])
-
-    def observation(self, observation: np.ndarray) -> np.ndarray:
-        return _process_frame42(observation)
-
-
 def preprocess_image(img: np.ndarray) -> np.ndarray:
     """
     Preprocess an image by converting it to grayscale and dividing its values by 256
@@ -68,37 +48,102 @@ def execute_command(cmd: List[str]) -> str:
     res = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
     return res.decode()[:-1]  # decode to go from bytes to str, [:-1] to remove newline at end
 
-def save_config(directory: Union[str, Path],
-                config: Dict,
-                agent_class: type,
-                envs: list,
-                repo_path: Union[str, Path] = Path(__file__).parent / "../../") -> None:
-    """Save the configuration of an agent to a file."""
-    filtered_config = {k: v for k, v in config.items() if not k.startswith("env")}
-    filtered_config["envs"] = envs
-    # Save git information if possible
+def _cache_directory() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "yarll" / "run_metadata"
+
+def environment_fingerprint() -> str:
+    """
+    Hash of the interpreter and the directories packages are imported from.
+    Installing, upgrading or removing a package changes the modification time of the directory it is in.
+    """
+    paths = []
+    for path in sys.path:
+        try:
+            paths.append([path, os.stat(path or ".").st_mtime_ns])
+        except OSError:
+            continue
+    description = json.dumps([sys.executable, sys.version, sys.prefix, paths])
+    return hashlib.sha1(description.encode()).hexdigest()
+
+def _cached(name: str, fn: Callable[[], Any]) -> Any:
+    """Result of fn, read from the cache file with the given name if it exists and written to it otherwise."""
+    cache_file = _cache_directory() / f"{name}.json"
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    value = fn()
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write_json(cache_file, value)
+    except OSError:
+        pass
+    return value
+
+def run_metadata(repo_path: Union[str, Path] = Path(__file__).parent / "../../") -> dict:
+    """
+    Git information of the repository and the installed packages.
+    The packages are cached per environment fingerprint and the commit message per commit,
+    such that runs in the same environment and at the same commit only need to run `git rev-parse` and `git diff`.
+    """
+    metadata: Dict[str, Any] = {}
     git_dir = Path(repo_path) / ".git"
     try:
-        git = {
-            "head": execute_command(["git", f"--git-dir={git_dir}", "rev-parse", "--abbrev-ref", "HEAD"]),
-            "commit": execute_command(["git", f"--git-dir={git_dir}", "rev-parse", "HEAD"]),
-            "message": execute_command(["git", f"--git-dir={git_dir}", "log", "-1", "--pretty=%B"])[:-1],
+        commit, head = execute_command(["git", f"--git-dir={git_dir}", "rev-parse", "HEAD", "--abbrev-ref", "HEAD"]).split("\n")
+        message = _cached(f"git_message_{commit}",
+                          lambda: execute_command(["git", f"--git-dir={git_dir}", "log", "-1", "--pretty=%B"])[:-1])
+        metadata["git"] = {
+            "head": head,
+            "commit": commit,
+            "message": message,
             "diff": execute_command(["git", f"--git-dir={git_dir}", "diff", "--no-prefix"])
         }
-        filtered_config["git"] = git
-    except subprocess.CalledProcessError:
+    except (subprocess.CalledProcessError, OSError):
         pass
+    metadata["packages"] = _cached(f"packages_{environment_fingerprint()}",
+                                   lambda: execute_command([sys.executable, "-m", "pip", "freeze"]).split("\n"))
+    return metadata
+
+def start_run_metadata(repo_path: Union[str, Path] = Path(__file__).parent / "../../") -> Future:
+    """Collect the run metadata in a background thread, e.g. while the agent is being made."""
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(run_metadata, repo_path)
+    executor.shutdown(wait=False)
+    return future
+
+def atomic_write_json(filename: Union[str, Path], data: Any) -> None:
+    """Write data as JSON under a temporary name first, such that readers never see a partial file."""
+    tmp_filename = Path(f"{filename}.tmp")
+    with open(tmp_filename, "w") as outfile:
+        json.dump(data, outfile, indent=4)
+    os.replace(tmp_filename, filename)
 
-    # save pip freeze output
-    pipfreeze = execute_command([sys.executable, "-m", "pip", "freeze"])
-    filtered_config["packages"] = pipfreeze.split("\n")
+def save_config(directory: Union[str, Path],
+                config: Dict,
+                agent_class: type,
+                envs: list,
+                repo_path: Union[str, Path] = Path(__file__).parent / "../../",
+                metadata: Optional[Union[dict, Future]] = None) -> None:
+    """
+    Save the configuration of an agent to a file.
+    metadata is the result of `run_metadata`, or a future of it (from `start_run_metadata`) to wait for.
+    If it isn't given, it is collected now.
+    """
+    filtered_config = {k: v for k, v in config.items() if not k.startswith("env")}
+    filtered_config["envs"] = envs
+    if metadata is None:
+        metadata = run_metadata(repo_path)
+    elif isinstance(metadata, Future):
+        metadata = metadata.result()
+    # Git information (if possible) and pip freeze output
+    filtered_config.update(metadata)
     # Save command used to run program
     filtered_config["program_command"] = " ".join(sys.argv)
     # Save agent class
     filtered_config["agent_class"] = str(agent_class)
 
-    with open(Path(directory) / "config.json", "w") as outfile:
-        json.dump(filtered_config, outfile, indent=4)
+    atomic_write_json(Path(directory) / "config.json", filtered_config)
 
 def json_to_dict(file: Union[str, Path]) -> dict:
     """Load a json file as a dictionary."""
@@ -114,19 +159,27 @@ def ge(minimum: int) -> Callable[[Any], int]:
         return ivalue
     return f
 
-def flatten(x):
-    return tf.reshape(x, [-1, np.prod(x.get_shape().as_list()[1:])])
-
 def set_seed(seed: int):
     os.environ["PYTHONHASHSEED"] = str(seed)
     random.seed(seed)
     np.random.seed(seed)
+    import tensorflow as tf
     tf.random.set_seed(seed)
 
+def set_tf_threads(intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None) -> None:
+    """Limit the number of threads used by TensorFlow. Only has effect before TensorFlow executes anything."""
+    import tensorflow as tf
+    if intra_op_threads is not None:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads is not None:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
 def load(name: str):
-    """Load an object by string."""
-    entry_point = pkg_resources.EntryPoint.parse("x={}".format(name))
-    result = entry_point.resolve()
+    """Load an object by string of the form "module:attribute" (e.g. "yarll.agents.sac:SAC")."""
+    module_name, _, attributes = name.partition(":")
+    result = importlib.import_module(module_name)
+    for attribute in filter(None, attributes.split(".")):
+        result = getattr(result, attribute)
     return result
 
 def cluster_spec(num_workers: int, num_ps: int, num_masters: int = 0) -> dict:
@@ -157,29 +210,6 @@ def cluster_spec(num_workers: int, num_ps: int, num_masters: int = 0) -> dict:
         cluster["master"] = all_masters
     return cluster
 
-def soft_update(source_vars: Sequence[tf.Variable], target_vars: Sequence[tf.Variable], tau: float) -> None:
-    """Move each source variable by a factor of tau towards the corresponding target variable.
-
-    Arguments:
-        source_vars {Sequence[tf.Variable]} -- Source variables to copy from
-        target_vars {Sequence[tf.Variable]} -- Variables to copy data to
-        tau {float} -- How much to change to source var, between 0 and 1.
-    """
-    if len(source_vars) != len(target_vars):
-        raise ValueError("source_vars and target_vars must have the same length.")
-    for source, target in zip(source_vars, target_vars):
-        target.assign((1.0 - tau) * target + tau * source)
-
-
-def hard_update(source_vars: Sequence[tf.Variable], target_vars: Sequence[tf.Variable]) -> None:
-    """Copy source variables to target variables.
-
-    Arguments:
-        source_vars {Sequence[tf.Variable]} -- Source variables to copy from
-        target_vars {Sequence[tf.Variable]} -- Variables to copy data to
-    """
-    soft_update(source_vars, target_vars, 1.0) # Tau of 1, so get everything from source and keep nothing from target
-
 def flatten_list(l: List[List]):
     return list(itertools.chain.from_iterable(l))
 
@@ -189,3 +219,17 @@ spaces_mapping = {
     Box: "continuous",
     MultiBinary: "multibinary"
 }
+
+# Moved to other modules, but still importable from here without importing them (and TensorFlow) up front
+_MOVED = {
+    "flatten": "yarll.misc.tf_utils",
+    "soft_update": "yarll.misc.tf_utils",
+    "hard_update": "yarll.misc.tf_utils",
+    "TargetUpdater": "yarll.misc.tf_utils",
+    "AtariRescale42x42": "yarll.environment.wrappers"
+}
+
+def __getattr__(name: str):
+    if name in _MOVED:
+        return getattr(importlib.import_module(_MOVED[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""
+Measure the latency of sending the parameters of the DPPO master to its workers,
+using one broadcast and assign per variable and using a single flat buffer (as float32 or float16, full or as deltas).
+Run it using MPI, where rank 0 acts as the master and the other ranks as the workers:
+    mpirun -np 4 python -m yarll.scripts.benchmark_parameter_sync <DPPO experiment specification>
+"""
+
+import argparse
+import tempfile
+import time
+from mpi4py import MPI
+import numpy as np
+
+from yarll.agents.ppo.parameter_sync import ParameterBroadcaster, ParameterReceiver
+from yarll.agents.registration import make_agent
+from yarll.environment.registration import make
+from yarll.misc.tf_utils import FlatVariables
+from yarll.misc.utils import json_to_dict, spaces_mapping
+
+parser = argparse.ArgumentParser()
+parser.add_argument("experiment", type=str, help="Path to the DPPO experiment specification.")
+parser.add_argument("--n_calls", type=int, default=200, help="Number of synchronizations to time.")
+
+def make_variables(spec: dict, monitor_path: str):
+    """Trainable variables of the network of the DPPO master of an experiment."""
+    env = make(spec["environments"]["source"])
+    action_space_type = spaces_mapping.get(type(env.action_space), None)
+    state_dimensions = "multi" if len(env.observation_space.shape) > 1 else \
+        spaces_mapping.get(type(env.observation_space), None)
+    args = dict(spec["agent"]["args"], monitor_path=monitor_path, env=env, seed=None)
+    agent = make_agent(spec["agent"]["name"], state_dimensions, action_space_type, **args)
+    return agent.new_network_vars
+
+def per_variable(comm, variables):
+    """Synchronization as done before: a broadcast and an assign for every variable."""
+    if comm.Get_rank() == 0:
+        def sync():
+            for variable in variables:
+                comm.Bcast(variable.numpy(), root=0)
+    else:
+        receivers = [np.zeros(variable.shape, variable.dtype.as_numpy_dtype) for variable in variables]
+        def sync():
+            for receiver, variable in zip(receivers, variables):
+                comm.Bcast(receiver, root=0)
+                variable.assign(receiver)
+    return sync
+
+def flat(comm, variables, dtype: str, deltas: bool):
+    flat_variables = FlatVariables(variables)
+    if comm.Get_rank() == 0:
+        broadcaster = ParameterBroadcaster(comm, 0, flat_variables, dtype=dtype, deltas=deltas)
+        return broadcaster.broadcast
+    receiver = ParameterReceiver(comm, 0, flat_variables, dtype=dtype, deltas=deltas)
+    return receiver.receive
+
+def main():
+    args = parser.parse_args()
+    comm = MPI.COMM_WORLD
+    spec = json_to_dict(args.experiment)
+    with tempfile.TemporaryDirectory() as monitor_path:
+        variables = make_variables(spec, monitor_path)
+    methods = [("per_variable", per_variable(comm, variables))]
+    for dtype in ["float32", "float16"]:
+        for deltas in [False, True]:
+            methods.append((f"flat/{dtype}{'/deltas' if deltas else ''}", flat(comm, variables, dtype, deltas)))
+    methods.append(("barrier", lambda: None))
+    if comm.Get_rank() == 0:
+        n_parameters = sum(int(np.prod(v.shape)) for v in variables)
+        print(f"{comm.Get_size() - 1} workers, {len(variables)} variables, {n_parameters} parameters")
+    for name, sync in methods:
+        sync()  # Warm up (tracing)
+        comm.Barrier()
+        start = time.perf_counter()
+        for _ in range(args.n_calls):
+            sync()
+            comm.Barrier()  # Until every worker has assigned the parameters
+        seconds = time.perf_counter() - start
+        if comm.Get_rank() == 0:
+            print(f"{name}: {1e6 * seconds / args.n_calls:.1f} us per synchronization (including a barrier)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""
+Measure the latency of a soft update of the SAC target critics,
+using the eager `soft_update` and the compiled `TargetUpdater`.
+"""
+
+import argparse
+from copy import deepcopy
+import timeit
+import tensorflow as tf
+
+from yarll.agents.sac import SAC, SoftQNetwork
+from yarll.environment.registration import make
+from yarll.misc.tf_utils import TargetUpdater, soft_update
+from yarll.misc.utils import json_to_dict
+
+parser = argparse.ArgumentParser()
+parser.add_argument("experiment", type=str, help="Path to the SAC experiment specification.")
+parser.add_argument("--n_calls", type=int, default=1000, help="Number of updates to time.")
+
+def critic_config(spec: dict) -> dict:
+    """Critic settings of the experiment: SAC defaults overwritten by the arguments in the specification."""
+    config = dict(n_softqs=2, n_hidden_layers=2, n_hidden_units=256, hidden_layer_activation="relu", tau=0.005)
+    config.update({k: v for k, v in spec["agent"]["args"].items() if k in config})
+    return config
+
+def main():
+    args = parser.parse_args()
+    spec = json_to_dict(args.experiment)
+    if spec["agent"]["name"] != SAC.__name__:
+        raise ValueError("The experiment must use the SAC agent.")
+    config = critic_config(spec)
+    env = make(spec["environments"]["source"])
+    states = tf.zeros((1, *env.observation_space.shape))
+    actions = tf.zeros((1, *env.action_space.shape))
+
+    nets = [SoftQNetwork(config["n_hidden_layers"], config["n_hidden_units"], config["hidden_layer_activation"])
+            for _ in range(config["n_softqs"])]
+    target_nets = [deepcopy(net) for net in nets]
+    for net in nets + target_nets:
+        net(states, actions)
+    source_vars = [v for net in nets for v in net.variables]
+    target_vars = [v for net in target_nets for v in net.variables]
+    n_parameters = sum(int(tf.size(v)) for v in source_vars)
+
+    def eager():
+        for net, target_net in zip(nets, target_nets):
+            soft_update(net.variables, target_net.variables, config["tau"])
+
+    updater = TargetUpdater(source_vars, target_vars)
+    def compiled():
+        updater.soft_update(config["tau"])
+
+    print(f"{config['n_softqs']} critics with {config['n_hidden_layers']}x{config['n_hidden_units']} hidden units, "
+          f"{len(source_vars)} variables, {n_parameters} parameters")
+    for name, fn in [("soft_update", eager), ("TargetUpdater", compiled)]:
+        fn()  # Warm up (tracing)
+        seconds = timeit.timeit(fn, number=args.n_calls)
+        print(f"{name}: {1e6 * seconds / args.n_calls:.1f} us per call")
+
+if __name__ == '__main__':
+    main()
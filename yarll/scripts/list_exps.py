@@ -3,11 +3,11 @@ import json
 import argparse
 from pathlib import Path
 import pandas as pd
-import dateutil
+import dateutil.parser
 
 
 parser = argparse.ArgumentParser()
-parser.add_argument("directory", type=Path help="Path to the directory.")
+parser.add_argument("directory", type=Path, help="Path to the directory.")
 
 
 def main():
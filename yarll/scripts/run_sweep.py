@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+"""
+Run experiments for several specifications and seeds on the local machine.
+Runs are executed as separate processes, each pinned to its own set of cores
+and with TensorFlow limited to that number of threads, such that they don't oversubscribe the machine.
+Every run logs to <sweep_directory>/<specification name>/seed_<seed>.
+Progress and results are appended to <sweep_directory>/summary.jsonl, one JSON object per line.
+Running the same command again skips the runs that already finished successfully.
+"""
+
+import argparse
+from collections import deque
+import datetime
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Set
+
+from yarll.misc.utils import ge
+
+SUMMARY_FILE = "summary.jsonl"
+
+parser = argparse.ArgumentParser()
+parser.add_argument("experiments", type=str, nargs="+", help="JSON files with experiment specifications.")
+parser.add_argument("sweep_directory", type=str, help="Directory to write the runs and the summary to.")
+parser.add_argument("--seeds", type=int, nargs="+", default=None, help="Seeds to run every experiment with.")
+parser.add_argument("--n_seeds", type=ge(1), default=1,
+                    help="Number of seeds (0, 1, ...) to run every experiment with, if no seeds are given.")
+parser.add_argument("--cores_per_run", type=ge(1), default=1, help="Cores that each run is pinned to.")
+parser.add_argument("--max_parallel", type=ge(1), default=None,
+                    help="Maximum number of simultaneous runs (default: available cores // cores_per_run).")
+parser.add_argument("--intra_op_threads", type=ge(1), default=None,
+                    help="TensorFlow threads within an operation (default: cores_per_run).")
+parser.add_argument("--inter_op_threads", type=ge(1), default=1,
+                    help="TensorFlow threads to run independent operations.")
+parser.add_argument("--profile", default=False, action="store_true",
+                    help="Profile the runs, which adds their steps per second to the summary.")
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def core_sets(cores_per_run: int, max_parallel: Optional[int] = None) -> List[List[int]]:
+    """Disjoint sets of cores_per_run cores, one per run that can be executed at the same time."""
+    cores = available_cores()
+    n_sets = max(1, len(cores) // cores_per_run)
+    if max_parallel is not None:
+        n_sets = min(n_sets, max_parallel)
+    return [cores[i * cores_per_run:(i + 1) * cores_per_run] for i in range(n_sets)]
+
+def finished_runs(summary_file: Path) -> Set[str]:
+    """Identifiers of the runs that finished successfully according to the summary."""
+    finished = set()
+    if not summary_file.exists():
+        return finished
+    with open(summary_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:  # Partial last line after an interruption
+                continue
+            if record.get("status") == "finished":
+                finished.add(record["run"])
+    return finished
+
+class Run(object):
+    """A single experiment with a single seed, executed as a separate process."""
+
+    def __init__(self, experiment: Path, seed: int, sweep_directory: Path) -> None:
+        super(Run, self).__init__()
+        self.experiment = experiment
+        self.seed = seed
+        self.id = f"{experiment.stem}/seed_{seed}"
+        self.monitor_path = sweep_directory / experiment.stem / f"seed_{seed}"
+        self.process: Optional[subprocess.Popen] = None
+        self.cores: List[int] = []
+        self.start_time = 0.0
+
+    def start(self, cores: List[int], intra_op_threads: int, inter_op_threads: int, profile: bool) -> None:
+        self.monitor_path.mkdir(parents=True, exist_ok=True)
+        self.cores = cores
+        experiment = self.experiment
+        if profile:
+            spec = json.loads(experiment.read_text())
+            spec["profiling"] = True
+            experiment = self.monitor_path / "experiment.json"
+            experiment.write_text(json.dumps(spec, indent=4))
+        env = dict(os.environ,
+                   OMP_NUM_THREADS=str(intra_op_threads),  # Threads of numpy's BLAS
+                   PYTHONPATH=os.pathsep.join(filter(None, [str(Path(__file__).parents[2]), os.environ.get("PYTHONPATH")])))
+        preexec_fn = (lambda: os.sched_setaffinity(0, cores)) if hasattr(os, "sched_setaffinity") else None
+        with open(self.monitor_path / "output.log", "w") as log:
+            self.process = subprocess.Popen([sys.executable, "-m", "yarll.main", str(experiment),
+                                             "--monitor_path", str(self.monitor_path),
+                                             "--seed", str(self.seed),
+                                             "--intra_op_threads", str(intra_op_threads),
+                                             "--inter_op_threads", str(inter_op_threads)],
+                                            stdout=log,
+                                            stderr=subprocess.STDOUT,
+                                            env=env,
+                                            preexec_fn=preexec_fn)
+        self.start_time = time.monotonic()
+
+    def result(self) -> dict:
+        """Summary of a run that has ended."""
+        returncode = self.process.returncode
+        record = {
+            "run": self.id,
+            "status": "finished" if returncode == 0 else "failed",
+            "returncode": returncode,
+            "seconds": time.monotonic() - self.start_time,
+            "monitor_path": str(self.monitor_path)
+        }
+        profile_file = self.monitor_path / "profile.json"
+        if profile_file.exists():
+            with open(profile_file) as f:
+                record["steps_per_second"] = json.load(f)["steps_per_second"]
+        return record
+
+def write_record(summary_file: Path, record: dict) -> None:
+    record["time"] = datetime.datetime.now().astimezone().isoformat()
+    with open(summary_file, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+def run_sweep(experiments: Sequence[Path],
+              seeds: Sequence[int],
+              sweep_directory: Path,
+              cores_per_run: int = 1,
+              max_parallel: Optional[int] = None,
+              intra_op_threads: Optional[int] = None,
+              inter_op_threads: int = 1,
+              profile: bool = False) -> List[dict]:
+    """Run every experiment with every seed, skipping the runs that already finished. Returns the new results."""
+    sweep_directory.mkdir(parents=True, exist_ok=True)
+    summary_file = sweep_directory / SUMMARY_FILE
+    finished = finished_runs(summary_file)
+    runs = [Run(experiment, seed, sweep_directory) for experiment in experiments for seed in seeds]
+    pending = deque(run for run in runs if run.id not in finished)
+    print(f"{len(runs) - len(pending)} of {len(runs)} runs already finished")
+    free_cores = deque(core_sets(cores_per_run, max_parallel))
+    running: Dict[str, Run] = {}
+    results = []
+    try:
+        while pending or running:
+            while pending and free_cores:
+                run = pending.popleft()
+                run.start(free_cores.popleft(), intra_op_threads or cores_per_run, inter_op_threads, profile)
+                running[run.id] = run
+                write_record(summary_file, {"run": run.id, "status": "started", "cores": run.cores})
+                print(f"Started {run.id} on cores {run.cores}")
+            time.sleep(1.0)
+            for run_id, run in list(running.items()):
+                if run.process.poll() is None:
+                    continue
+                del running[run_id]
+                free_cores.append(run.cores)
+                record = run.result()
+                write_record(summary_file, record)
+                results.append(record)
+                print(f"{record['status'].capitalize()} {run_id} in {record['seconds']:.0f}s "
+                      f"({len(runs) - len(pending) - len(running)} of {len(runs)} done)")
+    except KeyboardInterrupt:
+        # The interrupted runs are started again when the sweep is resumed
+        for run in running.values():
+            run.process.terminate()
+        for run in running.values():
+            run.process.wait()
+        raise
+    return results
+
+def main():
+    args = parser.parse_args()
+    seeds = args.seeds if args.seeds is not None else list(range(args.n_seeds))
+    results = run_sweep([Path(e).absolute() for e in args.experiments],
+                        seeds,
+                        Path(args.sweep_directory).absolute(),
+                        cores_per_run=args.cores_per_run,
+                        max_parallel=args.max_parallel,
+                        intra_op_threads=args.intra_op_threads,
+                        inter_op_threads=args.inter_op_threads,
+                        profile=args.profile)
+    n_failed = sum(record["status"] != "finished" for record in results)
+    if n_failed > 0:
+        print(f"{n_failed} runs failed, see their output.log")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()